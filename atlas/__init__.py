@@ -1,5 +1,34 @@
-from .core import *
-from .data import *
-from .resources import *
-from .interfaces import *
-from .utils import *
+# atlas/__init__.py
+
+# Public names and the submodules defining them. They are imported on first
+# access (PEP 562) so that `import atlas` stays cheap: the scientific stack,
+# neomodel, aiohttp and spaCy are only loaded by the code that uses them.
+_EXPORTS = {
+    'ATLAS': '.core.atlas',
+    'Entity': '.core.entity',
+    'EntityFactory': '.core.entity',
+    'Pattern': '.core.pattern',
+    'iQuery': '.core.iquery',
+    'ShardedATLAS': '.core.sharding',
+    'Repository': '.data.repository',
+    'AsyncRepository': '.data.async_repository',
+    'OpenAIGPTHandler': '.resources.openai_handler',
+    'ResponseProcessor': '.resources.response_processor',
+    'config': '.utils.config',
+    'get_settings': '.utils.config',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
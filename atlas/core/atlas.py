@@ -2,18 +2,53 @@
 
 import asyncio
 import logging
+import math
+import re
+import time
+from collections import Counter
 from typing import Dict, Any
-import networkx as nx
-from .entity import Entity
-from ..data.repository import Repository
+from . import checkpoint
+from .dependencies import order_by_dependencies
+from .entity import Entity, EntityFactory
+from .iquery import iQuery
+from .pattern import Pattern
+from .graph import ReferenceGraph
+from .metrics import EntityMetrics, SMOOTHING_STRATEGIES
+from .offline import OfflineCycle
+from .scheduler import CycleBudget, GlobalState, UpdateScheduler
+from .workers import WorkerPool
+from ..data.repository import Repository, write_behind
+from ..data.async_repository import AsyncRepository
 from ..utils.config import config
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_entity_id(entity_id):
+    """
+    Canonical form of an entity ID used for deduplication.
+
+    Case, surrounding whitespace and the difference between runs of spaces
+    and underscores are ignored, so 'Health Policy', 'health_policy' and
+    ' HEALTH  POLICY ' all normalise to 'health_policy'.
+
+    Args:
+        entity_id (str): The entity ID.
+
+    Returns:
+        str: The normalised ID.
+    """
+    return re.sub(r'[\s_]+', '_', entity_id.strip()).casefold()
+
+
 class ATLAS:
     _instance = None
 
+    # Weights of the terms in the scheduling priority of an (entity, iQuery) pair
+    AUTHORITY_WEIGHT = 10.0
+    STALENESS_WEIGHT = 1.0
+    REFERENCE_WEIGHT = 1.0
+
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(ATLAS, cls).__new__(cls)
@@ -23,10 +58,27 @@ class ATLAS:
     def __init__(self):
         if not self.initialized:
             self.repository = Repository()
+            self.async_repository = AsyncRepository(self.repository)
             self.entities = {}
-            self.global_state = {}
+            self.normalized_ids = {}
+            self.patterns = {}
+            self.router = None  # Set when running as a shard of a ShardedATLAS
+            self.reference_counts = Counter()
+            self._entity_references = {}
+            self.reference_graph = ReferenceGraph()
+            self.metrics = EntityMetrics(self.reference_graph)
+            self.scheduler = UpdateScheduler(
+                priority_fn=self.work_priority,
+                cost_fn=lambda entity, iquery: iquery.estimate_tokens(entity),
+            )
+            self.global_state = GlobalState(on_change=self.scheduler.global_changed)
+            # Called as listener(entity, key, value) with partial values of streaming iQueries
+            self.partial_listeners = []
             self.update_interval = config.ATLAS_UPDATE_INTERVAL
+            self.cycle_call_budget = config.ATLAS_CYCLE_CALL_BUDGET
+            self.cycle_token_budget = config.ATLAS_CYCLE_TOKEN_BUDGET
             self.loop = asyncio.get_event_loop()
+            self._last_checkpoint = time.monotonic()
             self.initialized = True
 
 
@@ -34,18 +86,304 @@ class ATLAS:
         if entity.entity_id not in self.entities:
             print(f"Registering ENTITY: {entity.entity_id}")
             self.entities[entity.entity_id] = entity
+            self.normalized_ids.setdefault(normalize_entity_id(entity.entity_id), entity.entity_id)
+            self._count_references(entity.entity_id, entity.references)
+            self.reference_graph.set_references(entity.entity_id, entity.references)
+            self.metrics.set_registered(entity.entity_id, True)
+            self.scheduler.track_entity(entity)
             logger.debug(f"Entity '{entity.entity_id}' registered with ATLAS. Total entities: {len(self.entities)}")
         else:
             logger.warning(f"Entity '{entity.entity_id}' already registered. Skipping registration.")
 
-    async def global_update_cycle(self):
+    def register_pattern(self, pattern):
+        """
+        Registers a pattern so that entities can be created by pattern name.
+
+        Args:
+            pattern (Pattern): The pattern to register.
+        """
+        self.patterns[pattern.name] = pattern
+
+    def hydrate(self, handlers, conditions=None, page_size=None):
+        """
+        Rebuilds the in-memory graph from the repository on restart.
+
+        All entities, patterns, inheritance edges, iQueries and handler links
+        are loaded with a few paged bulk reads (see Repository.load_snapshot)
+        and the objects are built around the loaded records without writing
+        anything back, instead of running each constructor's lookups and
+        writes. Handlers and conditions are code rather than data, so they
+        are supplied by the caller.
+
+        Args:
+            handlers (dict): handler_type -> resource handler instance.
+            conditions (dict, optional): iQuery name -> Condition.
+            page_size (int, optional): Entities per bulk read.
+
+        Returns:
+            dict: Counts of the hydrated objects and the time taken, in
+            seconds, to load ('load_seconds') and build ('build_seconds').
+        """
+        started = time.perf_counter()
+        snapshot = self.repository.load_snapshot(page_size)
+        loaded = time.perf_counter()
+        counts = self._build_from_snapshot(snapshot, handlers, conditions)
+        finished = time.perf_counter()
+        report = dict(counts, load_seconds=loaded - started, build_seconds=finished - loaded)
+        logger.info(f"Hydrated {report['entities']} entities, {report['patterns']} patterns and "
+                    f"{report['iqueries']} iQueries in {finished - started:.2f}s "
+                    f"(load {report['load_seconds']:.2f}s, build {report['build_seconds']:.2f}s).")
+        return report
+
+    def _build_from_snapshot(self, snapshot, handlers, conditions=None):
+        """
+        Builds iQueries, patterns and entities around the records of a
+        GraphSnapshot without writing to the repository.
+
+        Returns:
+            dict: The number of entities, patterns and iQueries built.
+        """
+        conditions = conditions or {}
+        iqueries = {}
+        for record in snapshot.iqueries:
+            iquery_handlers = []
+            for handler_type in snapshot.iquery_handlers.get(record.name, []):
+                if handler_type in handlers:
+                    iquery_handlers.append(handlers[handler_type])
+                else:
+                    logger.warning(f"No handler of type '{handler_type}' given for iQuery '{record.name}'.")
+            iqueries[record.name] = iQuery(
+                record.name, record.target_attribute, iquery_handlers,
+                conditions=conditions.get(record.name),
+                prompt_template=record.prompt_template,
+                model=record,
+            )
+
+        records = {record.name: record for record in snapshot.patterns}
+        patterns = {}
+
+        def build_pattern(name, path=()):
+            if name in patterns:
+                return patterns[name]
+            if name in path:
+                raise ValueError(f"Circular inheritance detected in pattern '{name}'")
+            parents = [build_pattern(parent, path + (name,))
+                       for parent in snapshot.pattern_parents.get(name, []) if parent in records]
+            pattern_iqueries = order_by_dependencies(
+                [iqueries[iquery_name] for iquery_name in snapshot.pattern_iqueries.get(name, [])
+                 if iquery_name in iqueries]
+            )
+            patterns[name] = Pattern(name, pattern_iqueries, parents, model=records[name])
+            return patterns[name]
+
+        for name in records:
+            build_pattern(name)
+
+        for record in snapshot.entities:
+            Entity(
+                entity_id=record.entity_id,
+                patterns=[patterns[name] for name in snapshot.entity_patterns.get(record.entity_id, [])
+                          if name in patterns],
+                attributes=dict(record.attributes or {}),
+                model=record,
+            )
+
+        return {'entities': len(snapshot.entities), 'patterns': len(patterns), 'iqueries': len(iqueries)}
+
+    def write_checkpoint(self, path=None):
+        """
+        Writes the runtime state to a binary checkpoint file.
+
+        The checkpoint holds the entities with their attributes and patterns,
+        the patterns and iQueries with their links, the global state, the
+        metric arrays and the scheduler's pending work, as length-prefixed
+        (optionally zlib-compressed) records. See atlas.core.checkpoint.
+
+        Args:
+            path (str, optional): The file. Defaults to ATLAS_CHECKPOINT_PATH.
+
+        Returns:
+            int: The size of the checkpoint in bytes.
+        """
+        return self._write_checkpoint(self._checkpoint_path(path), checkpoint.capture(self))
+
+    async def checkpoint_async(self, path=None):
+        """
+        Like write_checkpoint, but only captures the state on the event loop;
+        compression and file I/O run in the default executor.
+        """
+        path = self._checkpoint_path(path)
+        records = checkpoint.capture(self)
+        return await asyncio.get_running_loop().run_in_executor(None, self._write_checkpoint, path, records)
+
+    def _checkpoint_path(self, path):
+        path = path or config.ATLAS_CHECKPOINT_PATH
+        if not path:
+            raise ValueError("No checkpoint path given and ATLAS_CHECKPOINT_PATH is not set.")
+        return path
+
+    def _write_checkpoint(self, path, records):
+        started = time.perf_counter()
+        size = checkpoint.write_checkpoint(path, records, compress=config.ATLAS_CHECKPOINT_COMPRESS)
+        self._last_checkpoint = time.monotonic()
+        logger.info(f"Wrote checkpoint '{path}' ({len(records)} records, {size} bytes) "
+                    f"in {time.perf_counter() - started:.2f}s.")
+        return size
+
+    def restore_checkpoint(self, path, handlers, conditions=None):
+        """
+        Restores the runtime state from a checkpoint written by
+        write_checkpoint, in one sequential read of the file.
+
+        Objects are built as in hydrate, without reading from or writing to
+        the repository. Metric arrays are realigned by entity ID and seed the
+        next graph analysis, and only the work that was pending at checkpoint
+        time is scheduled again.
+
+        Args:
+            path (str): The checkpoint file.
+            handlers (dict): handler_type -> resource handler instance.
+            conditions (dict, optional): iQuery name -> Condition.
+
+        Returns:
+            dict: Counts of the restored objects and the time taken in seconds.
+        """
+        started = time.perf_counter()
+        state = checkpoint.load_checkpoint(path)
+        self.global_state.update(state.global_state)
+        counts = self._build_from_snapshot(state.snapshot, handlers, conditions)
+
+        graph = self.reference_graph
+        rows = [graph.add_node(entity_id) for entity_id in state.graph_ids]
+        for name, values in state.metrics.items():
+            column = self.metrics.column(name).copy()
+            column[rows] = values
+            self.metrics.set_column(name, column)
+        if 'hub' in state.metrics and 'authority' in state.metrics:
+            graph.hub_scores = self.metrics.column('hub').copy()
+            graph.authority_scores = self.metrics.column('authority').copy()
+        self.scheduler.retain_pending(state.pending)
+
+        report = dict(counts, seconds=time.perf_counter() - started)
+        logger.info(f"Restored {report['entities']} entities, {report['patterns']} patterns and "
+                    f"{report['iqueries']} iQueries from checkpoint '{path}' in {report['seconds']:.2f}s.")
+        return report
+
+    async def _checkpoint_periodically(self):
         while True:
-            logger.info("Starting global update cycle.")
-            entities_copy = list(self.entities.values())
-            tasks = [entity.local_update(self.global_state) for entity in entities_copy]
-            await asyncio.gather(*tasks)
-            logger.info("Global update cycle completed.")
-            await asyncio.sleep(self.update_interval)
+            await asyncio.sleep(config.ATLAS_CHECKPOINT_INTERVAL)
+            await self._checkpoint_if_due()
+
+    async def _checkpoint_if_due(self):
+        if not config.ATLAS_CHECKPOINT_PATH:
+            return
+        if time.monotonic() - self._last_checkpoint >= config.ATLAS_CHECKPOINT_INTERVAL:
+            try:
+                await self.checkpoint_async()
+            except Exception as e:
+                logger.error(f"Periodic checkpoint failed: {e}")
+
+    def spawn_entity(self, entity_data):
+        """
+        Creates and registers an entity from entity data.
+
+        Patterns may be given as Pattern objects or registered pattern names.
+        When running as a shard, entities owned by another shard are routed to
+        it instead of being created here. The entity is persisted with
+        blocking repository calls; code running on the event loop should use
+        spawn_entity_async.
+
+        Args:
+            entity_data (dict): 'entity_id' and optional 'patterns' and 'attributes'.
+
+        Returns:
+            Entity or None: The local entity, or None if it was routed elsewhere.
+        """
+        entity, candidate = self._spawn_candidate(entity_data)
+        if candidate is None:
+            return entity
+        return EntityFactory.create_entity(candidate)
+
+    async def spawn_entity_async(self, entity_data):
+        """
+        Like spawn_entity, but persists the new entity off the event loop.
+        """
+        entity, candidate = self._spawn_candidate(entity_data)
+        if candidate is None:
+            return entity
+        [entity] = await EntityFactory.create_many_async([candidate])
+        return entity
+
+    def _spawn_candidate(self, entity_data):
+        # (entity, None) if there is nothing to create, else (None, entity data to create)
+        entity_id = entity_data['entity_id']
+        if self.router is not None and not self.router.is_local(entity_id):
+            self.router.route_entity(entity_data)
+            return None, None
+        existing_id = self.normalized_ids.get(normalize_entity_id(entity_id))
+        if existing_id is not None:
+            return self.entities[existing_id], None
+        return None, {**entity_data, 'patterns': self._resolve_patterns(entity_data)}
+
+    def _resolve_patterns(self, entity_data):
+        patterns = []
+        for pattern in entity_data.get('patterns', []):
+            if isinstance(pattern, str):
+                if pattern not in self.patterns:
+                    logger.warning(f"Unknown pattern '{pattern}' for Entity '{entity_data['entity_id']}'. Skipping it.")
+                    continue
+                pattern = self.patterns[pattern]
+            patterns.append(pattern)
+        return patterns
+
+    def register_entities(self, entities_data):
+        """
+        Creates and registers many entities with deduplication and batched
+        persistence.
+
+        Candidate IDs are normalised (see normalize_entity_id) and candidates
+        that duplicate an earlier one in the batch or an already registered
+        entity are dropped before any I/O. The remaining entities are written
+        through EntityFactory.create_many in batched transactions.
+
+        Args:
+            entities_data (iterable): Entity data dicts as for spawn_entity.
+
+        Returns:
+            list: The newly created local entities.
+        """
+        candidates = self._entity_candidates(entities_data)
+        if not candidates:
+            return []
+        return EntityFactory.create_many(candidates)
+
+    async def register_entities_async(self, entities_data):
+        """
+        Like register_entities, but runs the batched writes off the event loop.
+        """
+        candidates = self._entity_candidates(entities_data)
+        if not candidates:
+            return []
+        return await EntityFactory.create_many_async(candidates)
+
+    def _entity_candidates(self, entities_data):
+        candidates = []
+        seen = set()
+        duplicates = 0
+        for entity_data in entities_data:
+            entity_id = entity_data['entity_id']
+            key = normalize_entity_id(entity_id)
+            if key in seen or key in self.normalized_ids:
+                duplicates += 1
+                continue
+            seen.add(key)
+            if self.router is not None and not self.router.is_local(entity_id):
+                self.router.route_entity(entity_data)
+                continue
+            candidates.append({**entity_data, 'patterns': self._resolve_patterns(entity_data)})
+        if duplicates:
+            logger.info(f"Dropped {duplicates} duplicate entity candidates.")
+        return candidates
 
     def unregister_entity(self, entity_id: str):
         """
@@ -56,20 +394,117 @@ class ATLAS:
         """
         if entity_id in self.entities:
             del self.entities[entity_id]
+            if self.normalized_ids.get(normalize_entity_id(entity_id)) == entity_id:
+                del self.normalized_ids[normalize_entity_id(entity_id)]
+            self._count_references(entity_id, [])
+            self.reference_graph.remove_node(entity_id)
+            self.metrics.set_registered(entity_id, False)
+            self.scheduler.untrack_entity(entity_id)
             logger.debug(f"Entity '{entity_id}' unregistered from ATLAS.")
 
+    def references_changed(self, entity):
+        """
+        Notifies ATLAS that an entity's references changed.
+
+        Args:
+            entity (Entity): The entity whose references changed.
+        """
+        self._count_references(entity.entity_id, entity.references)
+        self.reference_graph.set_references(entity.entity_id, entity.references)
+        self.scheduler.attribute_changed(entity, 'references')
+
+    def _count_references(self, entity_id, references):
+        deltas = Counter()
+        deltas.subtract(self._entity_references.pop(entity_id, ()))
+        if references:
+            self._entity_references[entity_id] = tuple(set(references))
+            deltas.update(self._entity_references[entity_id])
+        deltas = Counter({target: delta for target, delta in deltas.items() if delta})
+        if self.router is not None:
+            # Inbound counts of entities owned by other shards live there
+            deltas = self.router.route_reference_deltas(deltas)
+        self.reference_counts.update(deltas)
+
+    def work_priority(self, entity, iquery_name):
+        """
+        Scheduling priority of an (entity, iQuery) pair; higher runs first.
+
+        Combines the entity's authority (as computed by
+        perform_graph_analysis), how long the iQuery has gone without running
+        relative to the update interval, and how many entities reference it.
+
+        Args:
+            entity (Entity): The entity the work belongs to.
+            iquery_name (str): The name of the iQuery.
 
-    def run(self):
+        Returns:
+            float: The priority score.
+        """
+        authority = self.metrics.get('authority', entity.entity_id)
+        staleness = self.scheduler.staleness(entity.entity_id, iquery_name)
+        if staleness is None:
+            staleness_score = 2.0  # Never-run work ranks like long-stale work
+        else:
+            staleness_score = min(staleness / max(self.update_interval, 1), 2.0)
+        references = self.reference_counts.get(entity.entity_id, 0)
+        return (self.AUTHORITY_WEIGHT * authority
+                + self.STALENESS_WEIGHT * staleness_score
+                + self.REFERENCE_WEIGHT * math.log1p(max(references, 0)))
+
+
+    def run(self, continuous=False):
         """
         Starts the ATLAS system and runs the global update cycle.
+
+        Args:
+            continuous (bool): Run the worker-pool mode instead of
+                fixed-interval cycles. See run_continuous.
         """
         try:
-            self.loop.run_until_complete(self.global_update_cycle())
+            if continuous:
+                self.loop.run_until_complete(self.run_continuous())
+            else:
+                self.loop.run_until_complete(self.global_update_cycle())
         except KeyboardInterrupt:
             logger.info("ATLAS stopped by user.")
         finally:
+            write_behind.flush()
+            if config.ATLAS_CHECKPOINT_PATH:
+                self.write_checkpoint()
             self.loop.close()
 
+    async def run_continuous(self, num_workers=None, queue_size=None, item_deadline=None):
+        """
+        Runs ATLAS in streaming mode until cancelled.
+
+        Instead of fixed-interval cycles that wait for the slowest entity,
+        a pool of workers continuously pulls (entity, iQuery) work from the
+        scheduler through a bounded queue, so throughput is limited by LLM
+        capacity rather than by the slowest call.
+
+        Args:
+            num_workers (int, optional): Number of workers. Defaults to ATLAS_WORKERS.
+            queue_size (int, optional): Work queue capacity. Defaults to ATLAS_WORK_QUEUE_SIZE.
+            item_deadline (float, optional): Per-item deadline in seconds.
+                Defaults to ATLAS_ITEM_DEADLINE.
+        """
+        self.worker_pool = WorkerPool(
+            self,
+            num_workers=num_workers or config.ATLAS_WORKERS,
+            queue_size=queue_size or config.ATLAS_WORK_QUEUE_SIZE,
+            item_deadline=item_deadline or config.ATLAS_ITEM_DEADLINE,
+            retry_delay=self.update_interval,
+        )
+        background = [asyncio.create_task(write_behind.run())]
+        if config.ATLAS_CHECKPOINT_PATH:
+            background.append(asyncio.create_task(self._checkpoint_periodically()))
+        try:
+            await self.worker_pool.run()
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+
     async def trigger_dynamic_refactor(self):
         """
         Triggers dynamic refactoring of entities based on conditions.
@@ -98,78 +533,152 @@ class ATLAS:
         Manages autopoiesis by generating new entities and patterns.
 
         This method checks each entity for self-generation capabilities and
-        registers any new entities that are created.
+        registers the entity data they generate in one deduplicated batch.
         """
         logger.info("Managing autopoiesis.")
-        for entity in self.entities.values():
+        candidates = []
+        for entity in list(self.entities.values()):
             if entity.should_self_generate():
-                new_entities = await entity.self_generate(self.global_state)
-                for new_entity in new_entities:
-                    self.register_entity(new_entity)
+                candidates.extend(await entity.self_generate(self.global_state))
+        await self.register_entities_async(candidates)
 
-    async def global_update_cycle(self):
+    def perform_graph_analysis(self, tol=1e-8, max_iter=100, write_back=True):
         """
-        Runs the global update cycle for all entities.
+        Analyzes the graph structure and performs operations like authority smoothing.
 
-        This method is an async generator that continuously updates all entities
-        and performs related operations in a cycle.
+        Hub and authority scores are computed on the persistent reference
+        graph, warm-started from the previous analysis, and stored in the
+        metric arrays. References to entities that are not registered are
+        treated as dangling nodes.
+
+        Args:
+            tol (float): Convergence tolerance of the power iteration.
+            max_iter (int): Maximum number of power iterations.
+            write_back (bool): Copy the scores to the entities and the repository.
         """
-        while True:
-            logger.info("Starting global update cycle.")
-            tasks = [entity.local_update(self.global_state) for entity in self.entities.values()]
-            await asyncio.gather(*tasks)
-            await self.trigger_dynamic_refactor()
-            await self.manage_autopoiesis()
-            logger.info("Global update cycle completed.")
-            await asyncio.sleep(self.update_interval)
+        hub_scores, authority_scores = self.reference_graph.hits(tol=tol, max_iter=max_iter)
+        self.metrics.set_column('hub', hub_scores)
+        self.metrics.set_column('authority', authority_scores)
+        if write_back:
+            self.write_back_metrics(('authority', 'hub'))
 
-    def perform_graph_analysis(self):
+    async def smooth_authority(self, strategies=(('boost_bottom_k', {}),)):
         """
-        Analyzes the graph structure and performs operations like authority smoothing.
+        Smooths authority values between entities in the graph.
+
+        This method performs graph analysis and then applies the given
+        smoothing strategies, in order, as vectorized operations over the
+        authority scores of all registered entities. By default the entities
+        with the lowest authority are moved halfway towards the mean.
 
-        This method creates a graph of entities and calculates hub and authority scores.
+        Args:
+            strategies (iterable): (name, params) pairs; names are keys of
+                SMOOTHING_STRATEGIES ('clip', 'damp', 'boost_bottom_k').
         """
-        G = nx.DiGraph()
-        for entity in self.entities.values():
-            G.add_node(entity.entity_id)
-            for reference in entity.references:
-                G.add_edge(entity.entity_id, reference)
+        self.perform_graph_analysis(write_back=False)
+        authority = self.metrics.column('authority')
+        mask = self.metrics.registered
+        for name, params in strategies:
+            if name not in SMOOTHING_STRATEGIES:
+                raise ValueError(f"Unknown smoothing strategy '{name}'.")
+            authority = SMOOTHING_STRATEGIES[name](authority, mask, **params)
+        self.metrics.set_column('authority', authority)
+        await self.write_back_metrics_async(('authority', 'hub'))
 
-        hub_scores, authority_scores = nx.hits(G)
-        print("SCORES: ", authority_scores.items())
-        print("ENTITIES: ", self.entities.items())
-        for entity_id, authority in authority_scores.items():
-            self.entities[entity_id].attributes['authority'] = authority
+    def write_back_metrics(self, names):
+        """
+        Copies metric values into the attributes of the registered entities
+        and persists them with a single batched repository write.
 
-    async def smooth_authority(self):
+        Args:
+            names (iterable): The metrics to write back.
         """
-        Smooths authority values between entities in the graph.
+        updates = self._copy_metrics(names)
+        if updates:
+            self.repository.bulk_update_attributes(updates)
+        self._notify_metrics_changed(names)
 
-        This method performs graph analysis and boosts the authority of entities
-        with the lowest authority scores.
+    async def write_back_metrics_async(self, names):
+        """
+        Like write_back_metrics, but runs the repository write off the event loop.
         """
-        self.perform_graph_analysis()
-        min_authority = min(e.attributes['authority'] for e in self.entities.values())
-        max_authority = max(e.attributes['authority'] for e in self.entities.values())
+        updates = self._copy_metrics(names)
+        if updates:
+            await self.async_repository.bulk_update_attributes(updates)
+        self._notify_metrics_changed(names)
 
-        for entity in self.entities.values():
-            if entity.attributes['authority'] == min_authority:
-                await entity.boost_authority(self.global_state)
+    def _copy_metrics(self, names):
+        graph = self.reference_graph
+        columns = {name: self.metrics.column(name) for name in names}
+        updates = {}
+        for entity_id, entity in self.entities.items():
+            row = graph.index[entity_id]
+            values = {name: float(column[row]) for name, column in columns.items()}
+            entity.attributes.update(values)
+            updates[entity_id] = values
+        return updates
+
+    def _notify_metrics_changed(self, names):
+        for name in names:
+            if self.scheduler.reads_attribute(name):
+                for entity in self.entities.values():
+                    self.scheduler.attribute_changed(entity, name)
 
     async def global_update_cycle(self):
         """
-        Runs the global update cycle for all entities.
+        Runs the global update cycle for the entities that have pending work.
 
-        This method is an async generator that continuously updates all entities
-        and performs related operations in a cycle.
+        Only (entity, iQuery) pairs marked dirty by the scheduler since the
+        previous cycle are executed, so the cost of a cycle scales with what
+        changed rather than with the size of the graph. Work is handed out in
+        priority order until the cycle's call/token budget is spent; the rest
+        carries over to the next cycle.
         """
         logger.info("Starting global update cycle.")
-        entities_copy = list(self.entities.values())
-        tasks = [entity.local_update(self.global_state) for entity in entities_copy]
+        budget = CycleBudget(self.cycle_call_budget, self.cycle_token_budget)
+        pending = self.scheduler.take(budget)
+        if self.scheduler.has_pending():
+            logger.info(f"Cycle budget spent ({budget.calls} calls, ~{budget.tokens} tokens); "
+                        f"{len(self.scheduler)} iQueries carried over.")
+        tasks = [entity.local_update(self.global_state, iqueries) for entity, iqueries in pending]
         await asyncio.gather(*tasks)
         # Uncomment if you want to trigger these actions per cycle
         # await self.trigger_dynamic_refactor()
         # await self.manage_autopoiesis()
         # await self.smooth_authority()
+        await write_behind.drain()
+        await self._checkpoint_if_due()
         logger.info("Global update cycle completed.")
         await asyncio.sleep(self.update_interval)
+
+    async def offline_update_cycle(self, endpoint, directory=None, poll_interval=None):
+        """
+        Runs an update cycle through a batch endpoint, for refreshes that do
+        not need interactive latency.
+
+        The prompts of all pending (entity, iQuery) pairs are written to a
+        JSONL file and submitted as one batch; once it has finished the
+        results are applied to the entities and the repository in bulk.
+        Progress is kept in a manifest in ``directory``, so calling this
+        again after a crash resumes the interrupted cycle rather than
+        starting a new one. See atlas.core.offline.
+
+        Args:
+            endpoint (BatchEndpoint): E.g. OpenAIBatchEndpoint, or
+                LocalBatchEndpoint for tests.
+            directory (str, optional): Defaults to ATLAS_OFFLINE_DIR.
+            poll_interval (float, optional): Seconds between status checks.
+                Defaults to ATLAS_OFFLINE_POLL_INTERVAL.
+
+        Returns:
+            dict: The cycle's manifest, with the number of requests and of
+            applied, failed and deferred pairs.
+        """
+        cycle = OfflineCycle(
+            self, endpoint,
+            directory or config.ATLAS_OFFLINE_DIR,
+            config.ATLAS_OFFLINE_POLL_INTERVAL if poll_interval is None else poll_interval,
+        )
+        report = await cycle.run()
+        await self._checkpoint_if_due()
+        return report
@@ -0,0 +1,281 @@
+# atlas/core/checkpoint.py
+
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from enum import IntEnum
+
+import numpy as np
+
+from ..data.backends.base import (
+    GraphSnapshot,
+    EntityRecord,
+    PatternRecord,
+    IQueryRecord,
+)
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, then records until an END record.
+#   header: magic (8 bytes), format version (uint16), reserved (uint16)
+#   record: type (uint8), flags (uint8), payload length (uint32), payload
+# Integers are little-endian. JSON payloads are UTF-8; metric payloads are a
+# length-prefixed name followed by raw float64 values.
+MAGIC = b'ATLASCKP'
+VERSION = 1
+_HEADER = struct.Struct('<8sHH')
+_RECORD = struct.Struct('<BBI')
+_NAME_LENGTH = struct.Struct('<H')
+_END = struct.Struct('<Q')
+
+FLAG_COMPRESSED = 0x01
+
+
+class RecordType(IntEnum):
+    META = 1
+    GLOBAL_STATE = 2
+    IQUERY = 3
+    PATTERN = 4
+    ENTITY = 5
+    METRIC = 6
+    PENDING = 7
+    END = 255
+
+
+class CheckpointError(Exception):
+    """Raised for unreadable, truncated or incompatible checkpoint files."""
+    pass
+
+
+def _json_default(value):
+    # numpy scalars from metric write-back, sets, and anything else as text
+    if hasattr(value, 'item'):
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    return str(value)
+
+
+def encode_json(value):
+    return json.dumps(value, separators=(',', ':'), default=_json_default).encode('utf-8')
+
+
+def encode_metric(name, values):
+    name = name.encode('utf-8')
+    return _NAME_LENGTH.pack(len(name)) + name + np.ascontiguousarray(values, dtype='<f8').tobytes()
+
+
+def decode_metric(payload):
+    (length,) = _NAME_LENGTH.unpack_from(payload)
+    name = bytes(payload[_NAME_LENGTH.size:_NAME_LENGTH.size + length]).decode('utf-8')
+    values = np.frombuffer(payload, dtype='<f8', offset=_NAME_LENGTH.size + length).copy()
+    return name, values
+
+
+def capture(atlas):
+    """
+    Serialise the runtime state of an ATLAS instance into checkpoint records.
+
+    Runs on the event loop thread so that the state is consistent; the
+    returned records can then be written from another thread.
+
+    Args:
+        atlas (ATLAS): The instance to capture.
+
+    Returns:
+        list: (RecordType, payload bytes) pairs.
+    """
+    records = [(RecordType.META, encode_json({
+        'created': time.time(),
+        'entities': len(atlas.entities),
+        'cycle': atlas.scheduler.cycle,
+    }))]
+    records.append((RecordType.GLOBAL_STATE, encode_json(dict(atlas.global_state))))
+    iqueries = {}
+    for pattern in atlas.patterns.values():
+        for iquery in pattern.iqueries:
+            iqueries[iquery.name] = iquery
+    for entity in atlas.entities.values():
+        for iquery in entity.iqueries:
+            iqueries.setdefault(iquery.name, iquery)
+    for iquery in iqueries.values():
+        records.append((RecordType.IQUERY, encode_json({
+            'name': iquery.name,
+            'target_attribute': iquery.target_attribute,
+            'prompt_template': iquery.prompt_template,
+            'status': iquery.status,
+            'handlers': [handler.resource_handler_model.handler_type for handler in iquery.resource_handlers],
+        })))
+    for pattern in atlas.patterns.values():
+        records.append((RecordType.PATTERN, encode_json({
+            'name': pattern.name,
+            'parents': [parent.name for parent in pattern.parent_patterns],
+            'iqueries': [iquery.name for iquery in pattern.iqueries],
+        })))
+    for entity in atlas.entities.values():
+        records.append((RecordType.ENTITY, encode_json({
+            'entity_id': entity.entity_id,
+            'uid': getattr(entity.model, 'uid', None),
+            'patterns': [pattern.name for pattern in entity.patterns],
+            'attributes': entity.attributes,
+        })))
+    graph = atlas.reference_graph
+    records.append((RecordType.META, encode_json({'graph_ids': graph.ids})))
+    for name in atlas.metrics.names():
+        records.append((RecordType.METRIC, encode_metric(name, atlas.metrics.column(name))))
+    records.append((RecordType.PENDING, encode_json(sorted(atlas.scheduler.pending()))))
+    return records
+
+
+def write_checkpoint(path, records, compress=True, level=6, min_compress_size=256):
+    """
+    Write checkpoint records to a file.
+
+    The file is written next to the target and renamed into place, so a
+    crash never leaves a partial checkpoint at ``path``.
+
+    Args:
+        path (str): The checkpoint file.
+        records (list): (RecordType, payload bytes) pairs, e.g. from capture().
+        compress (bool): zlib-compress payloads of at least
+            ``min_compress_size`` bytes (only kept if smaller).
+        level (int): zlib compression level.
+
+    Returns:
+        int: The size of the file in bytes.
+    """
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, VERSION, 0))
+        for record_type, payload in records:
+            flags = 0
+            if compress and len(payload) >= min_compress_size:
+                compressed = zlib.compress(payload, level)
+                if len(compressed) < len(payload):
+                    payload, flags = compressed, FLAG_COMPRESSED
+            file.write(_RECORD.pack(record_type, flags, len(payload)))
+            file.write(payload)
+        file.write(_RECORD.pack(RecordType.END, 0, _END.size))
+        file.write(_END.pack(len(records)))
+        file.flush()
+        os.fsync(file.fileno())
+        size = file.tell()
+    os.replace(temporary, path)
+    return size
+
+
+def read_records(path):
+    """
+    Iterate over the records of a checkpoint file in one sequential pass
+    over a memory map of the file.
+
+    Args:
+        path (str): The checkpoint file.
+
+    Yields:
+        tuple: (RecordType, payload bytes), decompressed.
+
+    Raises:
+        CheckpointError: If the file is not a checkpoint, has an unsupported
+            version, or is truncated.
+    """
+    with open(path, 'rb') as file:
+        # mmap cannot map an empty file
+        if os.fstat(file.fileno()).st_size < _HEADER.size:
+            raise CheckpointError(f"'{path}' is too short to be a checkpoint.")
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, version, _ = _HEADER.unpack_from(view, 0)
+            if magic != MAGIC:
+                raise CheckpointError(f"'{path}' is not an ATLAS checkpoint.")
+            if version != VERSION:
+                raise CheckpointError(f"Unsupported checkpoint version {version} in '{path}'.")
+            offset = _HEADER.size
+            count = 0
+            while True:
+                if offset + _RECORD.size > len(view):
+                    raise CheckpointError(f"Checkpoint '{path}' is truncated after {count} records.")
+                record_type, flags, length = _RECORD.unpack_from(view, offset)
+                offset += _RECORD.size
+                if offset + length > len(view):
+                    raise CheckpointError(f"Checkpoint '{path}' is truncated after {count} records.")
+                payload = view[offset:offset + length]
+                offset += length
+                if record_type == RecordType.END:
+                    (expected,) = _END.unpack(payload)
+                    if expected != count:
+                        raise CheckpointError(f"Checkpoint '{path}' has {count} records, expected {expected}.")
+                    return
+                if flags & FLAG_COMPRESSED:
+                    payload = zlib.decompress(payload)
+                yield RecordType(record_type), payload
+                count += 1
+
+
+class CheckpointState:
+    """
+    The contents of a checkpoint file, decoded.
+
+    Attributes:
+        snapshot (GraphSnapshot): Entities, patterns and iQueries with their
+            links, in the form ATLAS.hydrate builds objects from.
+        global_state (dict): The global state.
+        metrics (dict): Metric name -> values aligned to ``graph_ids``.
+        graph_ids (list): Reference graph node IDs in row order.
+        pending (list): (entity_id, iQuery name) pairs with pending work.
+        meta (dict): Creation time, entity count and scheduler cycle.
+    """
+
+    def __init__(self):
+        self.snapshot = GraphSnapshot()
+        self.global_state = {}
+        self.metrics = {}
+        self.graph_ids = []
+        self.pending = []
+        self.meta = {}
+
+
+def load_checkpoint(path):
+    """
+    Decode a checkpoint file.
+
+    Args:
+        path (str): The checkpoint file.
+
+    Returns:
+        CheckpointState: The decoded state.
+    """
+    state = CheckpointState()
+    snapshot = state.snapshot
+    for record_type, payload in read_records(path):
+        if record_type == RecordType.METRIC:
+            name, values = decode_metric(payload)
+            state.metrics[name] = values
+            continue
+        data = json.loads(bytes(payload))
+        if record_type == RecordType.ENTITY:
+            snapshot.entities.append(EntityRecord(
+                entity_id=data['entity_id'], attributes=data['attributes'], uid=data.get('uid') or ''
+            ))
+            snapshot.entity_patterns[data['entity_id']] = data['patterns']
+        elif record_type == RecordType.IQUERY:
+            snapshot.iqueries.append(IQueryRecord(
+                name=data['name'], target_attribute=data['target_attribute'],
+                status=data['status'], prompt_template=data['prompt_template'],
+            ))
+            snapshot.iquery_handlers[data['name']] = data['handlers']
+        elif record_type == RecordType.PATTERN:
+            snapshot.patterns.append(PatternRecord(name=data['name']))
+            snapshot.pattern_parents[data['name']] = data['parents']
+            snapshot.pattern_iqueries[data['name']] = data['iqueries']
+        elif record_type == RecordType.GLOBAL_STATE:
+            state.global_state = data
+        elif record_type == RecordType.PENDING:
+            state.pending = [tuple(pair) for pair in data]
+        elif record_type == RecordType.META:
+            state.graph_ids = data.pop('graph_ids', state.graph_ids)
+            state.meta.update(data)
+    return state
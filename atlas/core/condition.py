@@ -23,6 +23,27 @@ class Condition(ABC):
         """
         pass
 
+    def read_attributes(self):
+        """
+        Report which entity attributes this condition reads.
+
+        Used by the update scheduler to decide which (entity, iQuery) pairs
+        become dirty when an attribute changes.
+
+        Returns:
+            frozenset or None: The attribute names read, or None if unknown.
+        """
+        return None
+
+    def read_globals(self):
+        """
+        Report which global state keys this condition reads.
+
+        Returns:
+            frozenset or None: The global state keys read, or None if unknown.
+        """
+        return None
+
     def __and__(self, other):
         """
         Combine this condition with another using logical AND.
@@ -91,6 +112,12 @@ class AttributeCondition(Condition):
         actual_value = entity.get_attribute(self.attribute_name)
         return self.comparison(actual_value, self.expected_value)
 
+    def read_attributes(self):
+        return frozenset([self.attribute_name])
+
+    def read_globals(self):
+        return frozenset()
+
 class GlobalCondition(Condition):
     """
     A condition that checks a value in the global state.
@@ -126,6 +153,12 @@ class GlobalCondition(Condition):
         actual_value = global_state.get(self.global_key)
         return self.comparison(actual_value, self.expected_value)
 
+    def read_attributes(self):
+        return frozenset()
+
+    def read_globals(self):
+        return frozenset([self.global_key])
+
 class CompositeCondition(Condition):
     """
     A condition that combines multiple conditions using a logical operator.
@@ -158,3 +191,22 @@ class CompositeCondition(Condition):
         """
         results = [cond.evaluate(entity, global_state) for cond in self.conditions]
         return self.operator_func(*results)
+
+    def read_attributes(self):
+        return _union(cond.read_attributes() for cond in self.conditions)
+
+    def read_globals(self):
+        return _union(cond.read_globals() for cond in self.conditions)
+
+def _union(key_sets):
+    """
+    Union the key sets reported by child conditions.
+
+    Returns None as soon as any child reports an unknown dependency set.
+    """
+    result = set()
+    for keys in key_sets:
+        if keys is None:
+            return None
+        result |= keys
+    return frozenset(result)
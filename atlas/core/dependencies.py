@@ -0,0 +1,88 @@
+# atlas/core/dependencies.py
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def build_dependency_graph(iqueries):
+    """
+    Build the attribute dependency DAG of a list of iQueries.
+
+    An iQuery depends on an earlier iQuery in the list if it reads the
+    earlier one's target attribute, or writes the same target attribute (so
+    the final value matches sequential execution). iQueries whose reads are
+    unknown depend on every earlier iQuery. Only edges to earlier iQueries are
+    created, so the result is always acyclic and a sequential run in list
+    order remains a valid schedule.
+
+    Args:
+        iqueries (list): The iQueries, in declared order.
+
+    Returns:
+        list: For each iQuery, the set of indices of the iQueries it waits for.
+    """
+    predecessors = []
+    for index, iquery in enumerate(iqueries):
+        reads = iquery.read_attributes()
+        depends_on = set()
+        for earlier_index in range(index):
+            earlier = iqueries[earlier_index]
+            if (reads is None
+                    or earlier.target_attribute in reads
+                    or earlier.target_attribute == iquery.target_attribute):
+                depends_on.add(earlier_index)
+        predecessors.append(depends_on)
+    return predecessors
+
+
+def dependency_depth(predecessors):
+    """
+    Length of the longest dependency chain, i.e. the number of sequential
+    rounds needed to run the DAG.
+
+    Args:
+        predecessors (list): Output of build_dependency_graph.
+
+    Returns:
+        int: The number of rounds.
+    """
+    depths = []
+    for depends_on in predecessors:
+        depths.append(1 + max((depths[i] for i in depends_on), default=0))
+    return max(depths, default=0)
+
+
+def order_by_dependencies(iqueries):
+    """
+    Order iQueries so that each one comes after the iQueries whose target
+    attributes it reads, keeping the given order where there is no such
+    dependency. Used when the declared order is not known, e.g. for
+    iQueries loaded from the repository. iQueries with unknown reads go
+    last; iQueries in a read cycle keep their given order.
+
+    Args:
+        iqueries (list): The iQueries.
+
+    Returns:
+        list: The iQueries in a valid declared order.
+    """
+    reads = [iquery.read_attributes() for iquery in iqueries]
+    known = [index for index, read in enumerate(reads) if read is not None]
+    waits_for = {
+        index: {other for other in known
+                if other != index and iqueries[other].target_attribute in reads[index]
+                and iqueries[other].target_attribute != iqueries[index].target_attribute}
+        for index in known
+    }
+    ordered = []
+    placed = set()
+    while len(placed) < len(known):
+        ready = [index for index in known if index not in placed and waits_for[index] <= placed]
+        if not ready:
+            ready = [index for index in known if index not in placed]
+            logger.warning(f"Read cycle among iQueries: {[iqueries[i].name for i in ready]}.")
+        ordered.append(ready[0])
+        placed.add(ready[0])
+    ordered.extend(index for index, read in enumerate(reads) if read is None)
+    return [iqueries[index] for index in ordered]
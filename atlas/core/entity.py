@@ -1,6 +1,13 @@
 from ..data.repository import Repository
+from ..data.async_repository import AsyncRepository
+from .dependencies import build_dependency_graph, dependency_depth
+from .iquery import IQueryError
+from .pattern import plan_batches
 from typing import Dict, Any
 import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
 
 class EntityError(Exception):
     """Custom exception class for Entity-related errors."""
@@ -13,7 +20,18 @@ class Entity:
     This class manages the attributes, patterns, and iQueries associated with an entity.
     It also handles persistence and updates of the entity's state.
     """
-    def __init__(self, entity_id, patterns=None, attributes=None):
+    def __init__(self, entity_id, patterns=None, attributes=None, model=None):
+        """
+        Initialize the Entity.
+
+        Args:
+            entity_id (str): The entity ID.
+            patterns (list, optional): Patterns assigned to the entity.
+            attributes (dict, optional): Initial attributes.
+            model (EntityModel, optional): An already persisted model, e.g. from
+                a bulk write. The node and its pattern relationships are then
+                assumed to exist and are not written again.
+        """
         from .atlas import ATLAS  
         self.repository = Repository()
         self.atlas = ATLAS()
@@ -21,9 +39,14 @@ class Entity:
         self.patterns = patterns or []
         self.iqueries = []
         self.attributes = attributes or {}
+        self.partial_attributes = {}  # Values of streaming iQueries still being generated
         self.references = self.attributes.get('references', [])
-        self._persist_entity()
-        self.initialize_iqueries()
+        if model is None:
+            self._persist_entity()
+            self.initialize_iqueries()
+        else:
+            self.model = model
+            self.initialize_iqueries(persist=False)
         self.atlas.register_entity(self)
 
     def _persist_entity(self):
@@ -31,27 +54,93 @@ class Entity:
         if existing_entity:
             self.model = existing_entity
             if self.attributes:
-                self.model.attributes.update(self.attributes)
-                self.model.save()
+                self.model = self.repository.update_entity_attributes(self.entity_id, self.attributes)
         else:
             self.model = self.repository.create_entity(self.entity_id, self.attributes)
 
-    def initialize_iqueries(self):
+    def initialize_iqueries(self, persist=True):
         for pattern in self.patterns:
             self.iqueries.extend(pattern.get_iqueries())
-            self.repository.add_pattern_to_entity(self.model, pattern.model)
+            if persist:
+                self.repository.add_pattern_to_entity(self.model, pattern.model)
 
-    async def local_update(self, global_state):
-        for iquery in self.iqueries:
+    async def local_update(self, global_state, iqueries=None):
+        """
+        Run the entity's iQueries whose conditions are met.
+
+        iQueries are arranged in a DAG by the attributes they read and write;
+        independent iQueries run concurrently and each one only waits for the
+        iQueries whose target attributes it reads. Independent iQueries of a
+        batched pattern share one request (see PatternBatch).
+
+        Args:
+            global_state: The current global state of the system.
+            iqueries (list, optional): Only run these iQueries (e.g. the dirty
+                ones handed out by the scheduler). Defaults to all iQueries.
+        """
+        iqueries = self.iqueries if iqueries is None else iqueries
+        predecessors = build_dependency_graph(iqueries)
+        batches = plan_batches(self, iqueries, predecessors)
+        logger.debug(f"Running {len(iqueries)} iQueries for Entity '{self.entity_id}' "
+                     f"in {dependency_depth(predecessors)} dependency rounds.")
+        tasks = []
+        for index, (iquery, depends_on) in enumerate(zip(iqueries, predecessors)):
+            upstream = [tasks[upstream_index] for upstream_index in depends_on]
+            tasks.append(asyncio.ensure_future(
+                self._run_after(upstream, iquery, global_state, batches.get(index))
+            ))
+        await asyncio.gather(*tasks)
+
+    async def _run_after(self, upstream, iquery, global_state, batch=None):
+        if upstream:
             try:
-                if iquery.check_conditions(self, global_state):
+                await asyncio.gather(*upstream)
+            except BaseException:
+                # Including cancellation: the rest of the batch must not wait for this one
+                if batch is not None:
+                    batch.abandon(self)
+                raise
+        if batch is not None and await batch.run_member(self, iquery, global_state):
+            return
+        await self.run_iquery(iquery, global_state)
+
+    async def run_iquery(self, iquery, global_state):
+        """
+        Run a single iQuery for this entity if its conditions are met.
+
+        Failures are logged and the (entity, iQuery) pair is marked dirty again
+        so that it is retried in a later cycle.
+
+        Args:
+            iquery (iQuery): The iQuery to run.
+            global_state: The current global state of the system.
+
+        Returns:
+            bool: False if the iQuery failed, True otherwise.
+        """
+        scheduler = self.atlas.scheduler
+        # Writes by other iQueries of this entity may have re-marked this one
+        # dirty; it is about to see those writes, so clear it.
+        scheduler.mark_clean(self.entity_id, iquery.name)
+        try:
+            if iquery.check_conditions(self, global_state):
+                try:
                     new_entity_data = await iquery.execute(self)
-                    self.repository.update_entity_attributes(self.entity_id, self.attributes)
-                    if new_entity_data:
-                        self.generate_new_entities(new_entity_data)
-            except Exception as e:
-                print(f"Error during local update for Entity '{self.entity_id}': {e}")
-    
+                finally:
+                    # Drop what a cancelled or failed stream left behind
+                    self.partial_attributes.pop(iquery.target_attribute, None)
+                if new_entity_data:
+                    await self.generate_new_entities(new_entity_data)
+        except IQueryError:
+            # Already logged by the iQuery
+            scheduler.mark_dirty(self.entity_id, iquery.name)
+            return False
+        except Exception as e:
+            scheduler.mark_dirty(self.entity_id, iquery.name)
+            logger.exception(f"Error during local update for Entity '{self.entity_id}': {e}")
+            return False
+        return True
+
     def add_pattern(self, pattern):
         """
         Add a new pattern to the entity.
@@ -71,6 +160,7 @@ class Entity:
             self.repository.add_pattern_to_entity(self.model, pattern.model)
         except Exception as e:
             raise EntityError(f"Failed to add Pattern '{pattern.name}': {e}")
+        self.atlas.scheduler.refresh_entity(self)
 
     def add_attribute(self, key, value):
         """
@@ -85,9 +175,36 @@ class Entity:
         """
         try:
             self.attributes[key] = value
-            self.repository.update_entity_attributes(self.entity_id, {key: value})
+            self.partial_attributes.pop(key, None)
+            self.repository.stage_attribute_updates(self.entity_id, {key: value})
         except Exception as e:
             raise EntityError(f"Failed to add/update attribute '{key}': {e}")
+        if key == 'references':
+            self.references = value
+            self.atlas.references_changed(self)
+        else:
+            self.atlas.scheduler.attribute_changed(self, key)
+
+    def publish_partial(self, key, value):
+        """
+        Publish the partial value of an attribute that is still being
+        generated by a streaming iQuery.
+
+        Partial values are kept apart from the attributes: they are not
+        persisted and do not trigger dependent iQueries. They are passed to
+        the ATLAS partial listeners, e.g. to show progress, and replaced by
+        the final value in add_attribute.
+
+        Args:
+            key (str): The attribute key.
+            value: The value received so far.
+        """
+        self.partial_attributes[key] = value
+        for listener in self.atlas.partial_listeners:
+            try:
+                listener(self, key, value)
+            except Exception as e:
+                logger.error(f"Partial listener failed for '{self.entity_id}.{key}': {e}")
 
     def get_attribute(self, key):
         """
@@ -119,10 +236,11 @@ class Entity:
             return
         self.patterns.remove(pattern)
         # Remove the relationship in the repository
-        self.model.patterns.disconnect(pattern.model)
+        self.repository.remove_pattern_from_entity(self.model, pattern.model)
         # Reinitialize iQueries
         self.iqueries = []
         self.initialize_iqueries()
+        self.atlas.scheduler.refresh_entity(self)
 
     def remove_attribute(self, key):
         """
@@ -133,10 +251,37 @@ class Entity:
         """
         if key in self.attributes:
             del self.attributes[key]
-            self.repository.update_entity_attributes(self.entity_id, self.attributes)
+            self.repository.stage_attribute_updates(self.entity_id, removals=[key])
+            if key == 'references':
+                self.references = []
+                self.atlas.references_changed(self)
+            else:
+                self.atlas.scheduler.attribute_changed(self, key)
         else:
             print(f"Attribute '{key}' does not exist in Entity '{self.entity_id}'.")
-    
+
+    def add_reference(self, entity_id):
+        """
+        Add a reference from this entity to another entity.
+
+        Args:
+            entity_id (str): The ID of the referenced entity.
+        """
+        if entity_id in self.references:
+            return
+        self.add_attribute('references', self.references + [entity_id])
+
+    def remove_reference(self, entity_id):
+        """
+        Remove a reference from this entity to another entity.
+
+        Args:
+            entity_id (str): The ID of the referenced entity.
+        """
+        if entity_id not in self.references:
+            return
+        self.add_attribute('references', [ref for ref in self.references if ref != entity_id])
+
     def check_and_generate_new_entities(self, global_state):
         """
         Checks conditions and generates new entities based on iQuery responses.
@@ -152,10 +297,8 @@ class Entity:
                     self.atlas.register_entity(new_entity)
                     logger.info(f"Generated new entity: {new_entity.entity_id}")
 
-    def generate_new_entities(self, new_entity_data_list):
-        for data in new_entity_data_list:
-            new_entity = EntityFactory.create_entity(data)
-            self.atlas.register_entity(new_entity)
+    async def generate_new_entities(self, new_entity_data_list):
+        await self.atlas.register_entities_async(new_entity_data_list)
 
     def update_attributes_from_response(self, response):
         """
@@ -167,6 +310,12 @@ class Entity:
         if response and isinstance(response, dict):
             # Update attributes with new data
             self.attributes.update(response)
+            for key in response:
+                if key == 'references':
+                    self.references = self.attributes['references']
+                    self.atlas.references_changed(self)
+                else:
+                    self.atlas.scheduler.attribute_changed(self, key)
         else:
             print(f"Invalid response format for entity '{self.entity_id}'.")
 
@@ -193,3 +342,46 @@ class EntityFactory:
         patterns = entity_data.get('patterns', [])
         attributes = entity_data.get('attributes', {})
         return Entity(entity_id=entity_id, patterns=patterns, attributes=attributes)
+
+    @staticmethod
+    def create_many(entities_data, on_match='merge'):
+        """
+        Create many entities with batched persistence.
+
+        Nodes, attributes and pattern relationships are written through
+        Repository.batch_create_entities, one round trip per batch, instead of
+        several per entity.
+
+        Args:
+            entities_data (list): Entity data dicts as for create_entity.
+                Patterns must be Pattern objects.
+            on_match (str): How to treat attributes of entities that already
+                exist; see Repository.batch_create_entities.
+
+        Returns:
+            list: The created entities, in input order.
+        """
+        entities_data = list(entities_data)
+        models = Repository().batch_create_entities(entities_data, on_match=on_match)
+        return EntityFactory._from_models(entities_data, models)
+
+    @staticmethod
+    async def create_many_async(entities_data, on_match='merge'):
+        """
+        Like create_many, but runs the batched writes off the event loop.
+        """
+        entities_data = list(entities_data)
+        models = await AsyncRepository().batch_create_entities(entities_data, on_match=on_match)
+        return EntityFactory._from_models(entities_data, models)
+
+    @staticmethod
+    def _from_models(entities_data, models):
+        return [
+            Entity(
+                entity_id=data['entity_id'],
+                patterns=data.get('patterns', []),
+                attributes=data.get('attributes', {}),
+                model=model,
+            )
+            for data, model in zip(entities_data, models)
+        ]
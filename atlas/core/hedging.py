@@ -0,0 +1,185 @@
+import asyncio
+import math
+import threading
+import time
+import weakref
+from collections import deque
+
+from ..utils.config import config
+
+
+class LatencyTracker:
+    """
+    Latencies of a resource handler's recent successful calls, and lower
+    bounds of those cancelled because a hedged request won.
+
+    Keeps the last ``size`` samples; quantiles are recomputed from them once
+    every ``size // 16`` new samples rather than on every query.
+    """
+
+    def __init__(self, size=512):
+        self.samples = deque(maxlen=size)
+        self._sorted = []
+        self._stale = 0
+        self._refresh_every = max(1, size // 16)
+
+    def __len__(self):
+        return len(self.samples)
+
+    def record(self, seconds):
+        self.samples.append(seconds)
+        self._stale += 1
+
+    def quantile(self, q):
+        """
+        Returns:
+            float or None: The q-quantile of the recent latencies, or None
+            without samples.
+        """
+        if not self.samples:
+            return None
+        if not self._sorted or self._stale >= self._refresh_every:
+            self._sorted = sorted(self.samples)
+            self._stale = 0
+        return self._sorted[min(len(self._sorted) - 1, math.ceil(q * len(self._sorted)) - 1)]
+
+
+class HedgePolicy:
+    """
+    When a hedged request is sent, and how many may be.
+
+    A request is hedged once the primary handler has taken longer than the
+    ``quantile`` of its recent latencies (after ``min_samples`` of them), as
+    long as at most ``max_fraction`` of the last ``window`` eligible
+    requests were hedged. With the defaults (p95, 10%) about one request in
+    twenty is sent twice and spend grows by a few percent at most.
+    """
+
+    def __init__(self, quantile=None, max_fraction=None, min_samples=None, window=1000):
+        self.quantile = config.ATLAS_HEDGE_QUANTILE if quantile is None else quantile
+        self.max_fraction = config.ATLAS_HEDGE_MAX_FRACTION if max_fraction is None else max_fraction
+        self.min_samples = config.ATLAS_HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        self.window = window
+        self._hedges = deque()  # Request numbers of the recent hedges
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay(self, tracker):
+        """
+        Seconds to wait for the primary handler before hedging, or None if
+        its latencies are not known well enough yet.
+        """
+        if len(tracker) < self.min_samples:
+            return None
+        return tracker.quantile(self.quantile)
+
+    def start_request(self):
+        """
+        Count a request that may be hedged.
+        """
+        self.requests += 1
+
+    def try_hedge(self):
+        """
+        Count a hedge if the cap allows it.
+
+        Returns:
+            bool: Whether to send the hedged request.
+        """
+        horizon = self.requests - self.window
+        while self._hedges and self._hedges[0] <= horizon:
+            self._hedges.popleft()
+        if len(self._hedges) + 1 > self.max_fraction * min(self.requests, self.window):
+            return False
+        self._hedges.append(self.requests)
+        self.hedged += 1
+        return True
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'hedge_wins': self.hedge_wins,
+            'hedged_fraction': self.hedged / self.requests if self.requests else 0.0,
+        }
+
+
+async def first_response(primary, start_backup, delay, policy, tracker=None):
+    """
+    Await ``primary``, hedging with ``start_backup()`` if it has not
+    finished after ``delay`` seconds and the policy allows it.
+
+    The first truthy response wins and the other request is cancelled. A
+    failure (an exception or an empty response) of one request leaves the
+    other one to answer; if both fail, the primary's outcome is returned
+    or raised.
+
+    Args:
+        primary (coroutine): The request to the primary handler.
+        start_backup (callable): Returns the coroutine of the hedged
+            request, or None if it cannot be sent (e.g. its circuit is open).
+        delay (float): Seconds before hedging.
+        policy (HedgePolicy): Caps the share of hedged requests.
+        tracker (LatencyTracker, optional): The primary handler's latencies.
+            If the hedged request wins, the time the cancelled primary had
+            taken is recorded as a lower bound of its latency. Otherwise
+            only the calls fast enough to win would be recorded and the
+            hedging delay would drift down.
+
+    Returns:
+        The winning response.
+    """
+    started = time.monotonic()
+    tasks = [asyncio.ensure_future(primary)]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done or not policy.try_hedge():
+            return await tasks[0]
+        backup = start_backup()
+        if backup is None:
+            return await tasks[0]
+        tasks.append(asyncio.ensure_future(backup))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception() is None and task.result():
+                    if task is not tasks[0]:
+                        policy.hedge_wins += 1
+                        if tracker is not None and not tasks[0].done():
+                            tracker.record(time.monotonic() - started)
+                    return task.result()
+        return tasks[0].result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Let the cancelled request release its circuit breaker and connection
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+_trackers = weakref.WeakKeyDictionary()
+_trackers_lock = threading.Lock()
+_policy = None
+
+
+def get_latency_tracker(handler):
+    """
+    The LatencyTracker of a resource handler, shared by all iQueries.
+    """
+    with _trackers_lock:
+        tracker = _trackers.get(handler)
+        if tracker is None:
+            tracker = _trackers[handler] = LatencyTracker()
+        return tracker
+
+
+def get_hedge_policy():
+    """
+    The process-wide HedgePolicy; its cap applies across all iQueries.
+    """
+    global _policy
+    with _trackers_lock:
+        if _policy is None:
+            _policy = HedgePolicy()
+        return _policy
@@ -3,31 +3,49 @@ import random
 import json
 import logging
 import asyncio
+from string import Formatter
 from functools import reduce
 from operator import and_, or_
 from typing import Any
 
 from ..data.repository import Repository
-from ..data.models import IQueryModel, ResourceHandlerModel
+from ..data.async_repository import AsyncRepository
+from ..utils.circuitbreaker import CircuitOpenError, get_circuit_breaker
+from .hedging import first_response, get_hedge_policy, get_latency_tracker
+
+class IQueryError(Exception):
+    """Raised when an iQuery execution fails with every resource handler."""
+    pass
 
 class iQuery:
     MAX_RETRIES = 3
     BACKOFF_FACTOR = 2  # Exponential backoff factor
     VALID_STATUSES = {'pending', 'executing', 'completed', 'failed', 'retrying'}
+    EXPECTED_RESPONSE_TOKENS = 150  # Matches the default max_tokens of the LLM handlers
     
-    def __init__(self, name, target_attribute, resource_handlers, conditions=None):
+    def __init__(self, name, target_attribute, resource_handlers, conditions=None, prompt_template=None,
+                 model=None, cache=True, stream=False, hedge=False):
         self.repository = Repository()
+        self.async_repository = AsyncRepository(self.repository)
         self.name = name
         self.target_attribute = target_attribute
+        self.prompt_template = prompt_template
         self.resource_handlers = resource_handlers  # List of handler instances
         self.resource_handler_models = [handler.resource_handler_model for handler in resource_handlers]  # Extract models
         self.conditions = conditions or []
+        self.cache = cache  # False opts out of the response cache, e.g. for non-deterministic prompts
+        self.stream = stream  # Stream completions and publish partial values (Entity.publish_partial)
+        self.hedge = hedge  # Hedge slow requests with the next handler (HedgePolicy)
         self.status = 'pending'
         self.retry_count = 0
-        self._persist_iquery()
+        if model is None:
+            self._persist_iquery()
+        else:
+            # Already stored with its handler links, e.g. when hydrating
+            self.model = model
 
     def _persist_iquery(self):
-        existing_iquery = IQueryModel.nodes.get_or_none(name=self.name)
+        existing_iquery = self.repository.get_iquery_by_name(self.name)
         if existing_iquery:
             self.model = existing_iquery
         else:
@@ -35,7 +53,8 @@ class iQuery:
                 self.name,
                 self.target_attribute,
                 self.conditions,
-                self.status
+                self.status,
+                self.prompt_template
             )
         for handler_model in self.resource_handler_models:
             self.repository.add_resource_handler_to_iquery(self.model, handler_model)
@@ -45,65 +64,204 @@ class iQuery:
             return True
         return self.conditions.evaluate(entity, global_state)
 
+    def read_attributes(self):
+        """
+        Entity attributes this iQuery depends on: those read by its
+        conditions and the fields of its prompt template.
+
+        Returns:
+            frozenset or None: Attribute names read, or None if unknown.
+        """
+        condition_reads = self.conditions.read_attributes() if self.conditions else frozenset()
+        if condition_reads is None:
+            return None
+        return condition_reads | self.template_fields()
+
+    def template_fields(self):
+        """
+        Entity attributes referenced by the prompt template.
+
+        Returns:
+            frozenset: Attribute names used as template fields.
+        """
+        if not self.prompt_template:
+            return frozenset()
+        fields = set()
+        for _, field_name, _, _ in Formatter().parse(self.prompt_template):
+            if field_name:
+                fields.add(field_name.split('.')[0].split('[')[0])
+        fields.discard('entity_id')
+        return frozenset(fields)
+
+    def read_globals(self):
+        """
+        Global state keys this iQuery depends on.
+
+        Returns:
+            frozenset or None: Global state keys read, or None if unknown.
+        """
+        if not self.conditions:
+            return frozenset()
+        return self.conditions.read_globals()
+
     async def execute(self, entity):
+        """
+        Run the iQuery for an entity with its resource handlers, in order.
+
+        A handler is retried with exponential backoff up to MAX_RETRIES times
+        before falling back to the next one. Each handler has a circuit
+        breaker shared by all iQueries (see get_circuit_breaker): while it is
+        open the handler is skipped at once, so a degraded backend does not
+        keep every queued iQuery in backoff sleeps. With ``hedge`` enabled, a
+        first attempt that takes longer than the handler usually does is
+        raced against the next handler.
+
+        The outcome is that of this call: the iQuery runs concurrently for
+        many entities, so ``status`` only reports the latest transition.
+
+        Returns:
+            list: Data of new entities from the response.
+
+        Raises:
+            IQueryError: If every handler failed.
+        """
         logging.info(f"Executing IQuery '{self.name}' for entity {entity}")
-        self.status = 'executing'
-        self.model.status = self.status
-        self.model.save()
-        handlers = self.resource_handlers.copy()
-        while handlers and self.retry_count <= self.MAX_RETRIES:
-            handler = handlers.pop(0)
-            try:
-                query = self.build_query(entity)
-                logging.debug(f"Built query: {query}")
-                response = await handler.execute(query)
-                logging.debug(f"Received response: {response}")
-                if response:
+        await self.set_status('executing')
+        for index, handler in enumerate(self.resource_handlers):
+            if index:
+                logging.warning(f"Falling back to next handler for IQuery '{self.name}'")
+            breaker = get_circuit_breaker(handler)
+            # Per execution: the iQuery runs concurrently for many entities
+            retries = 0
+            while True:
+                try:
+                    query = self.build_query(entity)
+                    logging.debug(f"Built query: {query}")
+                    if retries:
+                        response = await self._call(handler, query, entity)
+                    else:
+                        response = await self._call_hedged(index, query, entity)
+                    logging.debug(f"Received response: {response}")
+                    if not response:
+                        # The handler has already retried internally
+                        break
                     # Use the processed response directly
                     attribute_value, new_entity_data = self.process_response(response)
                     entity.add_attribute(self.target_attribute, attribute_value)
-                    self.status = 'completed'
-                    self.model.status = self.status
-                    self.model.save()
+                    await self.set_status('completed')
                     logging.info(f"IQuery '{self.name}' completed successfully")
-                    return attribute_value
-            except Exception as e:
-                logging.error(f"Error with handler '{handler}': {str(e)}", exc_info=True)
-                self.retry_count += 1
-                if self.retry_count > self.MAX_RETRIES:
-                    if handlers:
-                        logging.warning(f"Falling back to next handler for IQuery '{self.name}'")
-                        self.status = 'retrying'
-                        self.retry_count = 0  # Reset for next handler
-                        continue
-                    else:
-                        logging.error(f"No more handlers to try. Marking IQuery '{self.name}' as failed")
-                        self.status = 'failed'
-                        self.model.status = self.status
-                        self.model.save()
-                        return
-                backoff_time = self.BACKOFF_FACTOR ** self.retry_count + random.uniform(0, 1)
+                    return new_entity_data
+                except CircuitOpenError as e:
+                    logging.warning(f"Skipping handler '{handler}' for IQuery '{self.name}': {e}")
+                    break
+                except Exception as e:
+                    logging.error(f"Error with handler '{handler}': {str(e)}", exc_info=True)
+                    retries += 1
+                    if retries > self.MAX_RETRIES or not breaker.allows():
+                        # Out of retries, or the failures opened the circuit
+                        break
+                backoff_time = self.BACKOFF_FACTOR ** retries + random.uniform(0, 1)
                 logging.info(f"Retrying with handler '{handler}' in {backoff_time:.2f} seconds...")
-                self.status = 'retrying'
-                self.model.status = self.status
-                self.model.save()
+                await self.set_status('retrying')
                 await asyncio.sleep(backoff_time)
-            self.status = 'failed'
-            self.model.status = self.status
-            self.model.save()
-            logging.error(f"IQuery '{self.name}' failed after all retries")
+        logging.error(f"No more handlers to try. Marking IQuery '{self.name}' as failed")
+        await self.set_status('failed')
+        raise IQueryError(f"IQuery '{self.name}' failed for entity {entity}")
+
+    async def _call(self, handler, query, entity):
+        """
+        One request to a handler through its circuit breaker. Latencies of
+        successful requests are recorded for hedging.
+        """
+        started = time.monotonic()
+        async with get_circuit_breaker(handler).attempt() as attempt:
+            response = await handler.execute(query, **self.handler_options(entity))
+            if not response:
+                attempt.failed()
+        if response:
+            get_latency_tracker(handler).record(time.monotonic() - started)
+        return response
+
+    async def _call_hedged(self, index, query, entity):
+        """
+        Like _call for resource_handlers[index], but with hedging enabled the
+        same request is also sent to the next handler if this one is slower
+        than usual (see HedgePolicy). Streaming iQueries are not hedged, as
+        both requests would publish partial values.
+        """
+        handler = self.resource_handlers[index]
+        if not self.hedge or self.stream or index + 1 >= len(self.resource_handlers):
+            return await self._call(handler, query, entity)
+        policy = get_hedge_policy()
+        tracker = get_latency_tracker(handler)
+        delay = policy.delay(tracker)
+        if delay is None:
+            return await self._call(handler, query, entity)
+        backup = self.resource_handlers[index + 1]
+        policy.start_request()
+        return await first_response(
+            self._call(handler, query, entity),
+            lambda: self._call(backup, query, entity) if get_circuit_breaker(backup).allows() else None,
+            delay,
+            policy,
+            tracker,
+        )
+
+    def handler_options(self, entity=None):
+        """
+        Keyword arguments passed to the handlers' execute().
+
+        Args:
+            entity (Entity, optional): The entity being updated; streaming
+                iQueries publish partial values of their target attribute to it.
+        """
+        options = {} if self.cache else {'cache': False}
+        if self.stream and entity is not None:
+            options['stream'] = True
+            options['on_partial'] = lambda text: entity.publish_partial(self.target_attribute, text)
+        return options
 
     def build_query(self, entity):
-        # Custom implementation as needed
+        if self.prompt_template:
+            return self.prompt_template.format_map({**entity.attributes, 'entity_id': entity.entity_id})
         return f"Provide {self.target_attribute} for {entity.entity_id}"
 
+    def estimate_tokens(self, entity):
+        """
+        Roughly estimate the tokens one execution for the entity will use.
+
+        Uses the common ~4 characters per token heuristic for the prompt plus
+        the expected response length.
+
+        Args:
+            entity (Entity): The entity the iQuery would run for.
+
+        Returns:
+            int: Estimated prompt and response tokens.
+        """
+        try:
+            prompt = self.build_query(entity)
+        except (KeyError, IndexError, ValueError):
+            # Template fields not yet available; fall back to the raw template
+            prompt = self.prompt_template or ''
+        return len(prompt) // 4 + self.EXPECTED_RESPONSE_TOKENS
+
     def update_status(self, new_status):
         if new_status not in self.VALID_STATUSES:
             raise ValueError(f"Invalid status '{new_status}' for iQuery.")
         self.status = new_status
-        self.model.status = self.status
-        self.model.save()
-        
+        self.repository.update_iquery_status(self.model, self.status)
+
+    async def set_status(self, new_status):
+        """
+        Like update_status, but persists the status without blocking the
+        event loop.
+        """
+        if new_status not in self.VALID_STATUSES:
+            raise ValueError(f"Invalid status '{new_status}' for iQuery.")
+        self.status = new_status
+        await self.async_repository.update_iquery_status(self.model, self.status)
+
     def process_response(self, response):
         # Example processing logic
         # Assume response is a dictionary with keys 'attribute_value' and 'new_entities'
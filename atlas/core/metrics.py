@@ -0,0 +1,131 @@
+# atlas/core/metrics.py
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EntityMetrics:
+    """
+    Numeric per-entity metrics (authority, hub score, ...) stored column-wise
+    in NumPy arrays aligned to the row index of a ReferenceGraph.
+
+    Rows of IDs that are only known as reference targets are kept but are
+    excluded by the ``registered`` mask, so vectorized operations can be
+    restricted to the entities ATLAS actually manages.
+    """
+
+    def __init__(self, graph):
+        """
+        Initialize the EntityMetrics.
+
+        Args:
+            graph (ReferenceGraph): The graph whose row index the columns follow.
+        """
+        self.graph = graph
+        self._columns = {}
+        self._registered = np.zeros(0, dtype=bool)
+
+    def _fit(self, array, fill):
+        size = len(self.graph)
+        if array.size < size:
+            array = np.concatenate([array, np.full(size - array.size, fill, dtype=array.dtype)])
+        return array
+
+    def column(self, name):
+        """
+        The array of a metric, grown to the current number of rows.
+
+        Args:
+            name (str): The metric name.
+
+        Returns:
+            numpy.ndarray: The metric values, aligned to ``graph.ids``.
+        """
+        array = self._fit(self._columns.get(name, np.zeros(0)), 0.0)
+        self._columns[name] = array
+        return array
+
+    def set_column(self, name, values):
+        """
+        Replace the values of a metric.
+
+        Args:
+            name (str): The metric name.
+            values (array-like): Values aligned to ``graph.ids``.
+        """
+        self._columns[name] = self._fit(np.array(values, dtype=np.float64), 0.0)
+
+    def get(self, name, entity_id, default=0.0):
+        """
+        The value of a metric for one entity.
+        """
+        row = self.graph.index.get(entity_id)
+        array = self._columns.get(name)
+        if row is None or array is None or row >= array.size:
+            return default
+        return float(array[row])
+
+    def set_registered(self, entity_id, registered):
+        row = self.graph.add_node(entity_id)
+        self._registered = self._fit(self._registered, False)
+        self._registered[row] = registered
+
+    @property
+    def registered(self):
+        """
+        Boolean mask of rows that belong to registered entities.
+        """
+        self._registered = self._fit(self._registered, False)
+        return self._registered
+
+    def names(self):
+        return list(self._columns)
+
+
+def clip_scores(values, mask, lower=None, upper=None):
+    """
+    Clip the masked scores to [lower, upper]. A bound of None leaves that
+    side open; without either bound the scores are returned unchanged.
+    """
+    if lower is None and upper is None:
+        return values
+    values[mask] = np.clip(values[mask], lower, upper)
+    return values
+
+
+def damp_scores(values, mask, alpha=0.1):
+    """
+    Pull the masked scores towards their mean by the fraction alpha.
+    """
+    if mask.any():
+        mean = values[mask].mean()
+        values[mask] = (1.0 - alpha) * values[mask] + alpha * mean
+    return values
+
+
+def boost_bottom_k(values, mask, k=None, fraction=0.5):
+    """
+    Move the k lowest masked scores the given fraction of the way to the
+    mean. With k=None, every score tied for the minimum is boosted.
+    """
+    rows = np.flatnonzero(mask)
+    if rows.size == 0:
+        return values
+    scores = values[rows]
+    if k is None:
+        bottom = rows[scores == scores.min()]
+    else:
+        k = min(k, rows.size)
+        bottom = rows[np.argpartition(scores, k - 1)[:k]]
+    values[bottom] += fraction * (scores.mean() - values[bottom])
+    return values
+
+
+SMOOTHING_STRATEGIES = {
+    'clip': clip_scores,
+    'damp': damp_scores,
+    'boost_bottom_k': boost_bottom_k,
+}
@@ -0,0 +1,277 @@
+"""
+Offline update cycles through a batch endpoint.
+
+Instead of one interactive request per (entity, iQuery) pair, an offline
+cycle writes the prompts of all pending work to a JSONL file, submits it to
+a BatchEndpoint, waits for the batch to finish and applies the results to
+the entities and the repository in bulk.
+
+Progress is recorded in a manifest next to the batch files, written
+atomically after each step:
+
+    prepared   -> the input file is complete
+    submitted  -> the endpoint accepted it ('batch_id')
+    downloaded -> the results are on disk
+    applied    -> the results were applied; the cycle is finished
+
+so a cycle interrupted by a crash resumes where it stopped on the next run
+instead of preparing and paying for the same requests again. A crash
+between the endpoint accepting a batch and the manifest recording its ID
+is the one window in which a batch can be submitted twice.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+
+from .dependencies import build_dependency_graph
+from ..data.repository import write_behind
+from ..resources.batch_endpoint import result_text
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+
+class OfflineCycleError(Exception):
+    pass
+
+
+def work_id(entity_id, iquery_name):
+    """
+    The custom ID of the request for an (entity, iQuery) pair.
+    """
+    return json.dumps([entity_id, iquery_name])
+
+
+def parse_work_id(custom_id):
+    """
+    The (entity_id, iQuery name) pair of a request's custom ID, or None.
+    """
+    try:
+        entity_id, iquery_name = json.loads(custom_id)
+    except (TypeError, ValueError):
+        return None
+    return entity_id, iquery_name
+
+
+class OfflineCycle:
+    """
+    One offline update cycle of an ATLAS instance. See the module docstring.
+
+    Args:
+        atlas (ATLAS): The instance whose pending work is run.
+        endpoint (BatchEndpoint): Where the batch is submitted.
+        directory (str): Where the manifest and batch files are kept.
+        poll_interval (float): Seconds between status checks.
+    """
+
+    def __init__(self, atlas, endpoint, directory, poll_interval=60.0):
+        self.atlas = atlas
+        self.endpoint = endpoint
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.manifest_path = os.path.join(directory, MANIFEST)
+
+    async def run(self):
+        """
+        Finish the unfinished cycle in the directory, if any, or prepare
+        and run a new one from the scheduler's pending work.
+
+        Returns:
+            dict: The final manifest: 'state', 'batch_id', 'batch_status'
+            and the number of 'requests', 'applied', 'failed' and
+            'deferred' (left to a later cycle) pairs.
+        """
+        manifest = self.load_manifest()
+        if manifest is not None and manifest['state'] != 'applied':
+            logger.info(f"Resuming offline cycle '{manifest['cycle']}' in state '{manifest['state']}'.")
+        else:
+            manifest = self.prepare()
+            if manifest is None:
+                logger.info("No pending work for an offline cycle.")
+                return {'state': 'applied', 'requests': 0, 'applied': 0, 'failed': 0, 'deferred': 0}
+        if manifest['state'] == 'prepared':
+            manifest['batch_id'] = await self.endpoint.submit(self._path(manifest, 'input'))
+            self._advance(manifest, 'submitted')
+            logger.info(f"Submitted {manifest['requests']} requests as batch '{manifest['batch_id']}'.")
+        if manifest['state'] == 'submitted':
+            batch = await self._wait(manifest['batch_id'])
+            manifest['batch_status'] = batch['status']
+            manifest['results'] = await self.endpoint.download(batch, self._path(manifest, 'output'))
+            self._advance(manifest, 'downloaded')
+        if manifest['state'] == 'downloaded':
+            manifest.update(await self._apply(manifest))
+            self._advance(manifest, 'applied')
+            logger.info(f"Offline cycle '{manifest['cycle']}' applied {manifest['applied']} results; "
+                        f"{manifest['failed']} failed and were rescheduled.")
+        return manifest
+
+    def prepare(self):
+        """
+        Take all pending work from the scheduler and write the input file.
+
+        Pairs that cannot be answered from the current attributes are put
+        back for a later cycle: those reading the target attribute of
+        another pending iQuery of the same entity (they run once it has
+        been updated), and those whose handler cannot build batch requests.
+        Pairs whose conditions are not met are dropped, as in a regular
+        cycle.
+
+        Returns:
+            dict or None: The manifest, or None if there is nothing to do.
+        """
+        scheduler = self.atlas.scheduler
+        cycle = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        manifest = {'cycle': cycle, 'state': 'prepared', 'batch_id': None, 'requests': 0, 'deferred': 0}
+        os.makedirs(self.directory, exist_ok=True)
+        input_path = self._path(manifest, 'input')
+        temporary = f"{input_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            for entity, iqueries in scheduler.drain():
+                for iquery, depends_on in zip(iqueries, build_dependency_graph(iqueries)):
+                    request = self._request(entity, iquery, depends_on)
+                    if request is None:
+                        scheduler.mark_dirty(entity.entity_id, iquery.name)
+                        manifest['deferred'] += 1
+                    elif request is not False:
+                        file.write(json.dumps(request) + '\n')
+                        manifest['requests'] += 1
+            file.flush()
+            os.fsync(file.fileno())
+        if not manifest['requests']:
+            os.remove(temporary)
+            return None
+        os.replace(temporary, input_path)
+        self._save_manifest(manifest)
+        logger.info(f"Prepared offline cycle '{cycle}' with {manifest['requests']} requests; "
+                    f"{manifest['deferred']} deferred.")
+        return manifest
+
+    def _request(self, entity, iquery, depends_on):
+        """
+        The batch request line for a pair, None to defer it or False to
+        drop it.
+        """
+        if depends_on:
+            return None
+        handler = iquery.resource_handlers[0] if iquery.resource_handlers else None
+        if not hasattr(handler, 'batch_request'):
+            return None
+        try:
+            if not iquery.check_conditions(entity, self.atlas.global_state):
+                return False
+            return handler.batch_request(
+                iquery.build_query(entity), work_id(entity.entity_id, iquery.name), **iquery.handler_options()
+            )
+        except Exception as e:
+            logger.error(f"Could not prepare iQuery '{iquery.name}' for '{entity.entity_id}': {e}")
+            return None
+
+    async def _wait(self, batch_id):
+        while True:
+            batch = await self.endpoint.status(batch_id)
+            if batch['status'] in self.endpoint.TERMINAL_STATUSES:
+                if batch['status'] != 'completed':
+                    logger.warning(f"Batch '{batch_id}' ended with status '{batch['status']}'.")
+                return batch
+            await asyncio.sleep(self.poll_interval)
+
+    async def _apply(self, manifest):
+        """
+        Apply the downloaded results: attributes are set on the entities and
+        written in bulk through the write-behind buffer, and generated
+        entities are registered in one batch. Applying the same results
+        again is harmless, so a crash while applying is recovered by
+        applying them again. Pairs without a usable result are rescheduled.
+        """
+        scheduler = self.atlas.scheduler
+        outstanding = set()
+        with open(self._path(manifest, 'input'), encoding='utf-8') as file:
+            for line in file:
+                if line.strip():
+                    outstanding.add(json.loads(line)['custom_id'])
+
+        answered = []
+        output_path = self._path(manifest, 'output')
+        if os.path.exists(output_path):
+            with open(output_path, encoding='utf-8') as file:
+                for line in file:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    pair = self._resolve(result.get('custom_id'))
+                    text = result_text(result)
+                    if pair is None or text is None or result['custom_id'] not in outstanding:
+                        continue
+                    outstanding.discard(result['custom_id'])
+                    answered.append((*pair, text))
+
+        processed = await asyncio.gather(*(
+            iquery.resource_handlers[0].response_processor.process_async(text) for _, iquery, text in answered
+        ))
+        applied = 0
+        completed = set()
+        new_entities = []
+        for (entity, iquery, _), response in zip(answered, processed):
+            if not response:
+                scheduler.mark_dirty(entity.entity_id, iquery.name)
+                continue
+            scheduler.mark_clean(entity.entity_id, iquery.name)
+            attribute_value, new_entity_data = iquery.process_response(response)
+            entity.add_attribute(iquery.target_attribute, attribute_value)
+            new_entities.extend(new_entity_data or [])
+            completed.add(iquery)
+            applied += 1
+        for custom_id in outstanding:
+            pair = self._resolve(custom_id)
+            if pair is not None:
+                scheduler.mark_dirty(pair[0].entity_id, pair[1].name)
+
+        await write_behind.drain()
+        for iquery in completed:
+            await iquery.set_status('completed')
+        if new_entities:
+            await self.atlas.register_entities_async(new_entities)
+        return {'applied': applied, 'failed': manifest['requests'] - applied}
+
+    def _resolve(self, custom_id):
+        pair = parse_work_id(custom_id)
+        if pair is None:
+            return None
+        entity = self.atlas.entities.get(pair[0])
+        if entity is None:
+            return None
+        iquery = next((iquery for iquery in entity.iqueries if iquery.name == pair[1]), None)
+        return None if iquery is None else (entity, iquery)
+
+    def load_manifest(self):
+        """
+        Returns:
+            dict or None: The manifest of the last cycle, if any.
+        """
+        try:
+            with open(self.manifest_path, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError as e:
+            raise OfflineCycleError(f"Unreadable offline cycle manifest '{self.manifest_path}': {e}")
+
+    def _advance(self, manifest, state):
+        manifest['state'] = state
+        self._save_manifest(manifest)
+
+    def _save_manifest(self, manifest):
+        temporary = f"{self.manifest_path}.tmp"
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, self.manifest_path)
+
+    def _path(self, manifest, kind):
+        return os.path.join(self.directory, f"{manifest['cycle']}.{kind}.jsonl")
@@ -1,5 +1,9 @@
 from ..data.repository import Repository
+from ..utils.circuitbreaker import CircuitOpenError, get_circuit_breaker
+import asyncio
+import json
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
@@ -7,12 +11,30 @@ class PatternConsistencyError(Exception):
     pass
 
 class Pattern:
-    def __init__(self, name, iqueries=None, parent_patterns=None):
+    def __init__(self, name, iqueries=None, parent_patterns=None, model=None, batched=False):
+        """
+        Initialize the Pattern.
+
+        Args:
+            name (str): The pattern name.
+            iqueries (list, optional): The pattern's own iQueries.
+            parent_patterns (list, optional): Patterns to inherit iQueries from.
+            model (optional): An already stored pattern record, e.g. when hydrating.
+            batched (bool): Answer the pattern's independent iQueries for an
+                entity with one combined LLM request. See PatternBatch.
+        """
         self.repository = Repository()
         self.name = name
         self.iqueries = iqueries or []
         self.parent_patterns = parent_patterns or []
-        self._persist_pattern()
+        self.batched = batched
+        if model is None:
+            self._persist_pattern()
+        else:
+            # Already stored with its iQuery and inheritance links
+            self.model = model
+        from .atlas import ATLAS
+        ATLAS().register_pattern(self)
 
     def _persist_pattern(self):
         existing_pattern = self.repository.get_pattern_by_name(self.name)
@@ -23,7 +45,7 @@ class Pattern:
         for iquery in self.iqueries:
             self.repository.add_iquery_to_pattern(self.model, iquery.model)
         for parent_pattern in self.parent_patterns:
-            self.model.parent_patterns.connect(parent_pattern.model)
+            self.repository.add_parent_pattern(self.model, parent_pattern.model)
 
     def get_iqueries(self):
         inherited_iqueries = []
@@ -43,7 +65,7 @@ class Pattern:
             print(f"Pattern '{parent_pattern.name}' is already a parent of Pattern '{self.name}'.")
             return
         self.parent_patterns.append(parent_pattern)
-        self.model.parent_patterns.connect(parent_pattern.model)
+        self.repository.add_parent_pattern(self.model, parent_pattern.model)
 
     def validate_consistency(self):
         visited = set()
@@ -54,4 +76,195 @@ class Pattern:
             for parent in pattern.parent_patterns:
                 dfs(parent)
         dfs(self)
-        logger.info(f"Pattern '{self.name}' passed consistency validation.")
\ No newline at end of file
+        logger.info(f"Pattern '{self.name}' passed consistency validation.")
+
+class PatternBatch:
+    """
+    The iQueries of a batched pattern that run together for one entity.
+
+    Instead of one request per iQuery, a single prompt asks for a JSON
+    object keyed by the members' target attributes, so the entity context
+    is sent once. Members are independent of each other (none reads,
+    directly or through other iQueries, what another one writes), so each
+    member waits until all of them are ready to run and the request is
+    then made once. Attributes missing from or empty in the answer are
+    left to the member's own iQuery, as are batches of one.
+    """
+
+    PROMPT = (
+        "Answer each of the following requests. Respond with a single JSON object and nothing else, "
+        "whose keys are exactly the quoted names below and whose values are the answers as strings.\n\n"
+    )
+
+    def __init__(self, pattern, members):
+        self.pattern = pattern
+        self.members = members
+        self._arrived = 0
+        self._eligible = []
+        self._request = None
+        self._ready = asyncio.Event()
+
+    async def run_member(self, entity, iquery, global_state):
+        """
+        Run a member as part of the batch.
+
+        Returns:
+            bool: True if the member was handled (answered by the batch, or
+            skipped because its conditions are not met); False if it must
+            run on its own.
+        """
+        scheduler = entity.atlas.scheduler
+        runnable = False
+        failed = True
+        try:
+            scheduler.mark_clean(entity.entity_id, iquery.name)
+            runnable = iquery.check_conditions(entity, global_state)
+            failed = False
+        except Exception as e:
+            # Leave the error handling to the iQuery's own run
+            logger.error(f"Error checking conditions of iQuery '{iquery.name}': {e}")
+        finally:
+            # Arrive whatever happens, or the other members wait forever
+            if runnable:
+                self._eligible.append(iquery)
+            self._arrive(entity)
+        if failed:
+            return False
+        if not runnable:
+            return True
+        await self._ready.wait()
+        answers = await self._request
+        value = answers.get(iquery.target_attribute)
+        if value in (None, ''):
+            return False
+        entity.add_attribute(iquery.target_attribute, value)
+        await iquery.set_status('completed')
+        return True
+
+    def abandon(self, entity):
+        """
+        Count a member that will not run, e.g. because an iQuery it waits
+        for failed or was cancelled, so that the others do not wait for it.
+        """
+        self._arrive(entity)
+
+    def _arrive(self, entity):
+        self._arrived += 1
+        if self._arrived == len(self.members):
+            self._request = asyncio.ensure_future(self._execute(entity))
+            self._ready.set()
+
+    async def _execute(self, entity):
+        if len(self._eligible) < 2:
+            return {}
+        first = self._eligible[0]
+        handler = first.resource_handlers[0]
+        try:
+            prompt = self.PROMPT + "\n".join(
+                f'"{iquery.target_attribute}": {iquery.build_query(entity)}' for iquery in self._eligible
+            )
+            async with get_circuit_breaker(handler).attempt() as attempt:
+                response = await handler.execute(
+                    prompt,
+                    max_tokens=first.EXPECTED_RESPONSE_TOKENS * len(self._eligible),
+                    **first.handler_options(),
+                )
+                if not response:
+                    attempt.failed()
+        except CircuitOpenError:
+            # The members' own iQueries fall back to their other handlers
+            return {}
+        except Exception as e:
+            logger.error(f"Batched request of pattern '{self.pattern.name}' for '{entity.entity_id}' failed: {e}")
+            return {}
+        answers = parse_json_object(response_text(response))
+        missing = [iquery.name for iquery in self._eligible if answers.get(iquery.target_attribute) in (None, '')]
+        if missing:
+            logger.warning(f"Batched answer of pattern '{self.pattern.name}' for '{entity.entity_id}' lacks "
+                           f"{', '.join(missing)}; running them individually.")
+        return answers
+
+
+def plan_batches(entity, iqueries, predecessors):
+    """
+    Group the iQueries of an entity's batched patterns that can share one
+    request.
+
+    Members of a batch have the same first resource handler and cache
+    setting. A batch runs once all of its members are ready, so it acts as
+    one node of the dependency graph: a member is only added if no
+    dependency path, direct or through other iQueries and batches, leads
+    from the batch to it or back. Otherwise two batches could each wait for
+    a member that depends on the other one.
+
+    Args:
+        entity (Entity): The entity the iQueries run for.
+        iqueries (list): The iQueries about to run.
+        predecessors (list): Their dependency graph (build_dependency_graph).
+
+    Returns:
+        dict: iQuery index -> the PatternBatch it belongs to.
+    """
+    # Nodes of the graph with batches contracted, named by their first iQuery
+    node_of = list(range(len(iqueries)))
+    members = {index: [index] for index in range(len(iqueries))}
+
+    def waits_for(node, other):
+        seen = {node}
+        stack = [node]
+        while stack:
+            for member in members[stack.pop()]:
+                for upstream in predecessors[member]:
+                    upstream_node = node_of[upstream]
+                    if upstream_node == other:
+                        return True
+                    if upstream_node not in seen:
+                        seen.add(upstream_node)
+                        stack.append(upstream_node)
+        return False
+
+    batches = {}
+    for pattern in entity.patterns:
+        if not pattern.batched:
+            continue
+        groups = {}
+        for index, iquery in enumerate(iqueries):
+            if iquery in pattern.iqueries and index not in batches and iquery.resource_handlers:
+                groups.setdefault((id(iquery.resource_handlers[0]), iquery.cache), []).append(index)
+        for first, *others in groups.values():
+            for index in others:
+                if not waits_for(index, first) and not waits_for(first, index):
+                    node_of[index] = first
+                    members[first].extend(members.pop(index))
+            if len(members[first]) > 1:
+                batch = PatternBatch(pattern, [iqueries[index] for index in members[first]])
+                batches.update((index, batch) for index in members[first])
+    return batches
+
+
+def response_text(response):
+    """
+    The text of a handler response: the 'attribute_value' or 'text' of a
+    processed response, or the response itself if it is a string.
+    """
+    if isinstance(response, dict):
+        return response.get('attribute_value') or response.get('text') or ''
+    return response or ''
+
+
+def parse_json_object(text):
+    """
+    Parse the JSON object in an LLM answer, ignoring code fences and any
+    text around it.
+
+    Returns:
+        dict: The object, or an empty dict if there is none.
+    """
+    match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not match:
+        return {}
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
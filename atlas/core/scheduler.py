@@ -0,0 +1,468 @@
+# atlas/core/scheduler.py
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class GlobalState(dict):
+    """
+    A dictionary that reports writes to a listener.
+
+    ATLAS uses this for its global state so that writes can mark the
+    (entity, iQuery) pairs whose conditions read the changed key as dirty.
+    """
+
+    def __init__(self, *args, on_change=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_change = on_change
+
+    def _notify(self, key):
+        if self.on_change is not None:
+            self.on_change(key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._notify(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._notify(key)
+
+    def update(self, *args, **kwargs):
+        changes = dict(*args, **kwargs)
+        super().update(changes)
+        for key in changes:
+            self._notify(key)
+
+    def pop(self, key, *args):
+        present = key in self
+        value = super().pop(key, *args)
+        if present:
+            self._notify(key)
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._notify(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def clear(self):
+        keys = list(self)
+        super().clear()
+        for key in keys:
+            self._notify(key)
+
+
+class CycleBudget:
+    """
+    A per-cycle allowance of iQuery executions and estimated tokens.
+
+    A limit of None or 0 means unlimited. The first item of a cycle is always
+    admitted so that a budget smaller than a single request cannot stall the
+    system.
+    """
+
+    def __init__(self, max_calls=None, max_tokens=None):
+        self.max_calls = max_calls or None
+        self.max_tokens = max_tokens or None
+        self.calls = 0
+        self.tokens = 0
+
+    def try_spend(self, tokens):
+        """
+        Reserve one call and the given number of tokens if they fit.
+
+        Args:
+            tokens (int): Estimated tokens for the call.
+
+        Returns:
+            bool: True if the budget admitted the call.
+        """
+        if self.calls:
+            if self.max_calls is not None and self.calls + 1 > self.max_calls:
+                return False
+            if self.max_tokens is not None and self.tokens + tokens > self.max_tokens:
+                return False
+        self.calls += 1
+        self.tokens += tokens
+        return True
+
+
+class UpdateScheduler:
+    """
+    Tracks which (entity, iQuery) pairs need to be re-run, in priority order.
+
+    Instead of re-walking every iQuery of every entity on each global update
+    cycle, mutations report what changed and only the pairs whose iQuery reads
+    the changed attribute or global key are marked dirty. iQueries whose
+    conditions cannot report their reads are treated as depending on
+    everything.
+
+    Dirty pairs are kept in a heap keyed on the priority returned by
+    ``priority_fn`` when they were marked. Work that does not fit into a
+    cycle's budget stays in the heap and is handed out first in later cycles;
+    ``aging`` raises the relative priority of work that has been waiting for
+    more cycles so that low-priority entities are not starved.
+    """
+
+    def __init__(self, priority_fn=None, cost_fn=None, aging=1.0):
+        self.priority_fn = priority_fn or (lambda entity, iquery_name: 0.0)
+        self.cost_fn = cost_fn or (lambda entity, iquery: 0)
+        self.aging = aging
+        self.cycle = 0
+        self._entities = {}
+        self._dirty = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._last_run = {}
+        self._in_flight = set()
+        self._deferred = set()
+        self._blocked = {}
+        self.on_work = None
+        self._iqueries_of = {}
+        self._entities_by_iquery = defaultdict(set)
+        self._iqueries_by_global = defaultdict(set)
+        self._volatile_globals = set()
+        self._attribute_readers = defaultdict(set)
+        self._volatile_attributes = set()
+
+    def __len__(self):
+        return len(self._dirty) + sum(len(names) for names in self._blocked.values())
+
+    def has_pending(self):
+        """
+        Returns:
+            bool: True if any (entity, iQuery) pair is dirty.
+        """
+        return bool(self._dirty)
+
+    def track_entity(self, entity):
+        """
+        Start tracking an entity and mark all of its iQueries dirty.
+
+        Args:
+            entity (Entity): The entity to track.
+        """
+        self._entities[entity.entity_id] = entity
+        self._iqueries_of[entity.entity_id] = set()
+        self.refresh_entity(entity)
+
+    def untrack_entity(self, entity_id):
+        """
+        Stop tracking an entity and forget any pending work for it.
+
+        Args:
+            entity_id (str): The ID of the entity to stop tracking.
+        """
+        self._entities.pop(entity_id, None)
+        self._blocked.pop(entity_id, None)
+        for name in self._iqueries_of.pop(entity_id, set()):
+            self._dirty.pop((entity_id, name), None)
+            self._deferred.discard((entity_id, name))
+            self._last_run.pop((entity_id, name), None)
+            self._unindex(entity_id, name)
+
+    def refresh_entity(self, entity):
+        """
+        Re-index an entity after its iQueries changed (e.g. a pattern was
+        added or removed). Newly attached iQueries are marked dirty.
+
+        Args:
+            entity (Entity): The entity whose iQueries changed.
+        """
+        entity_id = entity.entity_id
+        if entity_id not in self._entities:
+            return
+        current = {iquery.name: iquery for iquery in entity.iqueries}
+        previous = self._iqueries_of[entity_id]
+        for name in previous - current.keys():
+            self._unindex(entity_id, name)
+            self.mark_clean(entity_id, name)
+        self._iqueries_of[entity_id] = set(current)
+        for name in current.keys() - previous:
+            self._index(entity_id, current[name])
+            self.mark_dirty(entity_id, name)
+
+    def _index(self, entity_id, iquery):
+        self._entities_by_iquery[iquery.name].add(entity_id)
+        attribute_keys = iquery.read_attributes()
+        if attribute_keys is None:
+            self._volatile_attributes.add(iquery.name)
+        else:
+            for key in attribute_keys:
+                self._attribute_readers[key].add(iquery.name)
+        global_keys = iquery.read_globals()
+        if global_keys is None:
+            self._volatile_globals.add(iquery.name)
+        else:
+            for key in global_keys:
+                self._iqueries_by_global[key].add(iquery.name)
+
+    def _unindex(self, entity_id, name):
+        entity_ids = self._entities_by_iquery.get(name)
+        if entity_ids is None:
+            return
+        entity_ids.discard(entity_id)
+        if entity_ids:
+            return
+        del self._entities_by_iquery[name]
+        self._volatile_globals.discard(name)
+        self._volatile_attributes.discard(name)
+        for index in (self._iqueries_by_global, self._attribute_readers):
+            for key in [k for k, names in index.items() if name in names]:
+                index[key].discard(name)
+                if not index[key]:
+                    del index[key]
+
+    def reads_attribute(self, key):
+        """
+        Whether any tracked iQuery depends on the given attribute.
+
+        Lets callers that update an attribute on many entities at once skip
+        per-entity change notifications when nothing reads it.
+        """
+        return bool(self._volatile_attributes) or key in self._attribute_readers
+
+    def mark_dirty(self, entity_id, iquery_name):
+        """
+        Queue an (entity, iQuery) pair. Pairs that are already queued keep
+        their place in the heap.
+        """
+        key = (entity_id, iquery_name)
+        if entity_id not in self._entities or key in self._dirty:
+            return
+        if key in self._in_flight:
+            # Re-queued once the running execution finishes.
+            self._deferred.add(key)
+            return
+        priority = self.priority_fn(self._entities[entity_id], iquery_name)
+        seq = next(self._counter)
+        self._dirty[key] = seq
+        heapq.heappush(self._heap, (self.aging * self.cycle - priority, seq, key))
+        if self.on_work is not None:
+            self.on_work()
+
+    def mark_clean(self, entity_id, iquery_name):
+        # Heap entries are discarded lazily when popped.
+        key = (entity_id, iquery_name)
+        self._deferred.discard(key)
+        if self._dirty.pop(key, None) is not None:
+            self._release_blocked(entity_id)
+
+    def pending(self):
+        """
+        (entity_id, iQuery name) pairs with outstanding work: dirty,
+        deferred or running.
+        """
+        return set(self._dirty) | self._deferred | self._in_flight
+
+    def retain_pending(self, pairs):
+        """
+        Mark every dirty pair that is not in ``pairs`` clean, e.g. to restore
+        the pending work recorded in a checkpoint after tracking entities.
+
+        Args:
+            pairs (iterable): The (entity_id, iQuery name) pairs to keep.
+        """
+        keep = set(pairs)
+        for entity_id, iquery_name in list(self._dirty):
+            if (entity_id, iquery_name) not in keep:
+                self.mark_clean(entity_id, iquery_name)
+
+    def staleness(self, entity_id, iquery_name):
+        """
+        Seconds since the pair was last handed out, or None if never run.
+        """
+        last_run = self._last_run.get((entity_id, iquery_name))
+        return None if last_run is None else time.monotonic() - last_run
+
+    def attribute_changed(self, entity, key):
+        """
+        Mark the iQueries of an entity that read the given attribute as dirty.
+
+        An iQuery is not invalidated by writes to its own target attribute,
+        otherwise every successful execution would re-schedule itself.
+
+        Args:
+            entity (Entity): The entity whose attribute changed.
+            key (str): The attribute that changed.
+        """
+        if entity.entity_id not in self._entities:
+            return
+        for iquery in entity.iqueries:
+            if iquery.target_attribute == key:
+                continue
+            keys = iquery.read_attributes()
+            if keys is None or key in keys:
+                self.mark_dirty(entity.entity_id, iquery.name)
+
+    def global_changed(self, key):
+        """
+        Mark every (entity, iQuery) pair whose iQuery reads the given global
+        state key as dirty.
+
+        Args:
+            key (str): The global state key that changed.
+        """
+        names = self._iqueries_by_global.get(key, set()) | self._volatile_globals
+        for name in names:
+            for entity_id in self._entities_by_iquery.get(name, ()):
+                self.mark_dirty(entity_id, name)
+
+    def take(self, budget=None):
+        """
+        Take pending work in priority order until the budget is spent.
+
+        Work that does not fit stays queued, in order, for the next call.
+        Like pop(), pairs whose iQuery reads the target attribute of an
+        earlier iQuery of the same entity that stays queued or is running
+        are left queued, so a budget that cuts a cycle short never hands out
+        downstream work ahead of its inputs.
+
+        Args:
+            budget (CycleBudget, optional): Limits for this cycle. Defaults to
+                taking everything.
+
+        Returns:
+            list: (entity, iqueries) tuples ordered by the priority of each
+            entity's most urgent iQuery, with iQueries in the entity's
+            declared order.
+        """
+        self.cycle += 1
+        taken = {}
+        held = []
+        now = time.monotonic()
+        while self._heap:
+            entry = self._heap[0]
+            _, seq, key = entry
+            if self._dirty.get(key) != seq:
+                heapq.heappop(self._heap)
+                continue
+            entity_id, name = key
+            entity = self._entities[entity_id]
+            iquery = next((iq for iq in entity.iqueries if iq.name == name), None)
+            if iquery is None:
+                heapq.heappop(self._heap)
+                del self._dirty[key]
+                continue
+            if self._has_pending_upstream(entity, iquery):
+                # Its upstream may still be taken further down the heap
+                held.append((heapq.heappop(self._heap), entity, iquery))
+                continue
+            if budget is not None and not budget.try_spend(self.cost_fn(entity, iquery)):
+                break
+            heapq.heappop(self._heap)
+            self._take(key, now, taken)
+        # Held pairs whose upstream was taken above run after it in the same
+        # Entity.local_update; the others stay queued
+        progress = True
+        while progress:
+            progress = False
+            for item in list(held):
+                (_, _, key), entity, iquery = item
+                if self._has_pending_upstream(entity, iquery):
+                    continue
+                if budget is not None and not budget.try_spend(self.cost_fn(entity, iquery)):
+                    continue
+                held.remove(item)
+                self._take(key, now, taken)
+                progress = True
+        for entry, _, _ in held:
+            heapq.heappush(self._heap, entry)
+        batch = []
+        for entity_id, names in taken.items():
+            entity = self._entities[entity_id]
+            batch.append((entity, [iquery for iquery in entity.iqueries if iquery.name in names]))
+        logger.debug(f"Scheduled {sum(len(names) for names in taken.values())} iQueries across "
+                     f"{len(batch)} entities; {len(self._dirty)} left pending.")
+        return batch
+
+    def _take(self, key, now, taken):
+        del self._dirty[key]
+        self._last_run[key] = now
+        taken.setdefault(key[0], set()).add(key[1])
+
+    def drain(self):
+        """
+        Take all pending work regardless of budget.
+        """
+        return self.take()
+
+    def pop(self):
+        """
+        Hand out the single most urgent (entity, iQuery) pair and mark it as
+        in flight until finish() is called.
+
+        Pairs whose iQuery reads the target attribute of an earlier iQuery of
+        the same entity that is still queued or running are held back until
+        that iQuery finishes, so streaming execution respects the same
+        dependencies as Entity.local_update.
+
+        Returns:
+            tuple or None: (entity, iquery), or None if nothing is runnable.
+        """
+        while self._heap:
+            _, seq, key = heapq.heappop(self._heap)
+            if self._dirty.get(key) != seq:
+                continue
+            del self._dirty[key]
+            entity_id, name = key
+            entity = self._entities[entity_id]
+            iquery = next((iq for iq in entity.iqueries if iq.name == name), None)
+            if iquery is None:
+                continue
+            if self._has_pending_upstream(entity, iquery):
+                self._blocked.setdefault(entity_id, set()).add(name)
+                continue
+            self._in_flight.add(key)
+            self._last_run[key] = time.monotonic()
+            return entity, iquery
+        return None
+
+    def finish(self, entity_id, iquery_name, retry_after=None):
+        """
+        Mark a pair handed out by pop() as done.
+
+        Args:
+            entity_id (str): The entity ID.
+            iquery_name (str): The iQuery name.
+            retry_after (float, optional): If given, the execution failed and
+                the pair is queued again after this many seconds.
+        """
+        key = (entity_id, iquery_name)
+        self._in_flight.discard(key)
+        if retry_after is not None:
+            self._deferred.discard(key)
+            asyncio.get_running_loop().call_later(retry_after, self.mark_dirty, entity_id, iquery_name)
+        elif key in self._deferred:
+            self._deferred.discard(key)
+            self.mark_dirty(entity_id, iquery_name)
+        self._release_blocked(entity_id)
+
+    def _has_pending_upstream(self, entity, iquery):
+        reads = iquery.read_attributes()
+        for upstream in entity.iqueries:
+            if upstream is iquery:
+                return False
+            if reads is not None and upstream.target_attribute not in reads:
+                continue
+            key = (entity.entity_id, upstream.name)
+            if key in self._dirty or key in self._in_flight:
+                return True
+        return False
+
+    def _release_blocked(self, entity_id):
+        for name in self._blocked.pop(entity_id, ()):
+            self.mark_dirty(entity_id, name)
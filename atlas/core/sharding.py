@@ -0,0 +1,353 @@
+# atlas/core/sharding.py
+
+import asyncio
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import queue
+import time
+from collections import Counter
+
+from .graph import ReferenceGraph
+from ..data.repository import write_behind
+
+logger = logging.getLogger(__name__)
+
+
+class ShardingError(Exception):
+    """Raised when shards fail to start, answer or stop in time."""
+    pass
+
+
+def shard_for(entity_id, num_shards):
+    """
+    Stable shard assignment of an entity.
+
+    Uses a keyed hash rather than hash(), which is salted per process.
+
+    Args:
+        entity_id (str): The entity ID.
+        num_shards (int): Total number of shards.
+
+    Returns:
+        int: The index of the owning shard.
+    """
+    digest = hashlib.blake2b(entity_id.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+
+def _portable_entity_data(entity_data):
+    # Pattern objects hold live handlers; other processes resolve them by name.
+    return {
+        **entity_data,
+        'patterns': [getattr(pattern, 'name', pattern) for pattern in entity_data.get('patterns', [])],
+    }
+
+
+class ShardRouter:
+    """
+    Routes messages about entities owned by other shards.
+
+    Installed as ``ATLAS.router`` inside each shard process.
+    """
+
+    def __init__(self, shard_id, num_shards, inboxes):
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.inboxes = inboxes
+
+    def owner(self, entity_id):
+        return shard_for(entity_id, self.num_shards)
+
+    def is_local(self, entity_id):
+        return self.owner(entity_id) == self.shard_id
+
+    def route_entity(self, entity_data):
+        """
+        Send an entity creation request to the owning shard.
+
+        Args:
+            entity_data (dict): The entity data, as passed to ATLAS.spawn_entity.
+        """
+        owner = self.owner(entity_data['entity_id'])
+        logger.debug(f"Shard {self.shard_id}: routing Entity '{entity_data['entity_id']}' to shard {owner}.")
+        self.inboxes[owner].put(('create_entity', _portable_entity_data(entity_data)))
+
+    def route_reference_deltas(self, deltas):
+        """
+        Send inbound reference count changes to the shards owning the targets.
+
+        Args:
+            deltas (Counter): Reference count changes keyed by target entity ID.
+
+        Returns:
+            Counter: The changes for entities owned by this shard.
+        """
+        local = Counter()
+        remote = {}
+        for target, delta in deltas.items():
+            owner = self.owner(target)
+            if owner == self.shard_id:
+                local[target] = delta
+            else:
+                remote.setdefault(owner, {})[target] = delta
+        for owner, owner_deltas in remote.items():
+            self.inboxes[owner].put(('reference_delta', owner_deltas))
+        return local
+
+
+class ShardWorker:
+    """
+    The runtime of one shard: an ATLAS instance owning a subset of entities,
+    running its own update loop and serving messages from its inbox.
+    """
+
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, shard_id, num_shards, bootstrap, inboxes, results):
+        """
+        Initialize the ShardWorker.
+
+        Args:
+            shard_id (int): Index of this shard.
+            num_shards (int): Total number of shards.
+            bootstrap (callable): Picklable callable run inside the shard that
+                builds the patterns (and their handlers) and returns them.
+            inboxes (list): One multiprocessing queue per shard.
+            results (Queue): Queue for replies to the coordinator.
+        """
+        self.shard_id = shard_id
+        self.bootstrap = bootstrap
+        self.inbox = inboxes[shard_id]
+        self.results = results
+        self.router = ShardRouter(shard_id, num_shards, inboxes)
+        self.atlas = None
+
+    async def run(self):
+        self._setup()
+        self.results.put(('ready', self.shard_id))
+        update_task = asyncio.create_task(self._update_loop())
+        try:
+            await self._serve()
+        finally:
+            update_task.cancel()
+            await asyncio.gather(update_task, return_exceptions=True)
+            await write_behind.drain()
+        self.results.put(('stopped', self.shard_id))
+
+    def _setup(self):
+        from .atlas import ATLAS
+        self.atlas = ATLAS()
+        self.atlas.router = self.router
+        patterns = self.bootstrap()
+        if isinstance(patterns, dict):
+            patterns = patterns.values()
+        for pattern in patterns or []:
+            self.atlas.register_pattern(pattern)
+
+    async def _update_loop(self):
+        while True:
+            await self.atlas.global_update_cycle()
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self._receive)
+            if message is None:
+                continue
+            if message[0] == 'stop':
+                return
+            await self._handle(message)
+
+    async def _handle(self, message):
+        # Handlers that touch the repository are coroutines that run its I/O
+        # off the loop; the others only change in-memory state.
+        kind, args = message[0], message[1:]
+        try:
+            result = getattr(self, f'_on_{kind}')(*args)
+            if asyncio.iscoroutine(result):
+                await result
+        except Exception as e:
+            logger.exception(f"Shard {self.shard_id}: error handling '{kind}' message: {e}")
+
+    def _receive(self):
+        try:
+            return self.inbox.get(timeout=self.POLL_INTERVAL)
+        except queue.Empty:
+            return None
+
+    async def _on_create_entity(self, entity_data):
+        await self.atlas.spawn_entity_async(entity_data)
+
+    def _on_reference_delta(self, deltas):
+        self.atlas.reference_counts.update(deltas)
+
+    def _on_set_global(self, key, value):
+        self.atlas.global_state[key] = value
+
+    def _on_graph_request(self, request_id):
+        references = {entity_id: list(entity.references) for entity_id, entity in self.atlas.entities.items()}
+        self.results.put(('graph', request_id, self.shard_id, references))
+
+    async def _on_set_scores(self, scores):
+        # Stored like ATLAS.perform_graph_analysis does, so work_priority sees them
+        atlas = self.atlas
+        scores = {entity_id: values for entity_id, values in scores.items() if entity_id in atlas.entities}
+        rows = [atlas.reference_graph.index[entity_id] for entity_id in scores]
+        for name in ('authority', 'hub'):
+            column = atlas.metrics.column(name).copy()
+            column[rows] = [values[name] for values in scores.values()]
+            atlas.metrics.set_column(name, column)
+        await atlas.write_back_metrics_async(('authority', 'hub'))
+
+
+def _shard_main(shard_id, num_shards, bootstrap, inboxes, results):
+    asyncio.run(ShardWorker(shard_id, num_shards, bootstrap, inboxes, results).run())
+
+
+class ShardedATLAS:
+    """
+    Runs ATLAS across several worker processes, one shard each.
+
+    Entities are assigned to shards by a stable hash of their entity_id. Each
+    shard runs its own update loop; entity creation and reference count
+    changes that concern another shard are sent to it as messages, and
+    graph-wide steps such as authority analysis gather data from all shards.
+    The shards communicate through multiprocessing queues, so the whole setup
+    runs on a single machine.
+    """
+
+    def __init__(self, num_shards, bootstrap, mp_context=None):
+        """
+        Initialize the ShardedATLAS.
+
+        Args:
+            num_shards (int): Number of shard processes.
+            bootstrap (callable): Picklable (module-level) callable that builds
+                the patterns inside each shard process and returns them as a
+                list or a name -> Pattern dict.
+            mp_context: Multiprocessing context. Defaults to 'spawn', which
+                gives each shard a fresh interpreter and event loop.
+        """
+        self.num_shards = num_shards
+        self.bootstrap = bootstrap
+        self.context = mp_context or multiprocessing.get_context('spawn')
+        self.inboxes = [self.context.Queue() for _ in range(num_shards)]
+        self.results = self.context.Queue()
+        self.processes = []
+        self.reference_graph = ReferenceGraph()
+        self._request_ids = itertools.count()
+
+    def owner(self, entity_id):
+        return shard_for(entity_id, self.num_shards)
+
+    def start(self, timeout=60):
+        """
+        Start the shard processes and wait until they are ready.
+        """
+        for shard_id in range(self.num_shards):
+            process = self.context.Process(
+                target=_shard_main,
+                args=(shard_id, self.num_shards, self.bootstrap, self.inboxes, self.results),
+                name=f"atlas-shard-{shard_id}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        self._collect('ready', self.num_shards, timeout)
+        logger.info(f"Started {self.num_shards} ATLAS shards.")
+
+    def add_entity(self, entity_data):
+        """
+        Create an entity on its owning shard.
+
+        Args:
+            entity_data (dict): 'entity_id' and optional 'patterns' (names or
+                Pattern objects) and 'attributes'.
+        """
+        self.inboxes[self.owner(entity_data['entity_id'])].put(
+            ('create_entity', _portable_entity_data(entity_data))
+        )
+
+    def set_global(self, key, value):
+        """
+        Write a global state key on every shard.
+        """
+        for inbox in self.inboxes:
+            inbox.put(('set_global', key, value))
+
+    def gather_references(self, timeout=30):
+        """
+        Collect the references of all entities across shards.
+
+        Returns:
+            dict: entity_id -> list of referenced entity IDs.
+        """
+        request_id = next(self._request_ids)
+        for inbox in self.inboxes:
+            inbox.put(('graph_request', request_id))
+        references = {}
+        for reply in self._collect('graph', self.num_shards, timeout, request_id=request_id):
+            references.update(reply[3])
+        return references
+
+    def perform_graph_analysis(self, timeout=30):
+        """
+        Compute hub and authority scores over the entities of all shards and
+        send each shard the scores of the entities it owns.
+
+        Returns:
+            dict: entity_id -> authority score.
+        """
+        references = self.gather_references(timeout)
+        graph = self.reference_graph
+        for entity_id in set(graph.ids) - references.keys():
+            graph.remove_node(entity_id)
+        for entity_id, targets in references.items():
+            graph.set_references(entity_id, targets)
+        hub_scores, authority_scores = graph.hits()
+        per_shard = [{} for _ in range(self.num_shards)]
+        for entity_id in references:
+            row = graph.index[entity_id]
+            per_shard[self.owner(entity_id)][entity_id] = {
+                'authority': float(authority_scores[row]),
+                'hub': float(hub_scores[row]),
+            }
+        for shard_id, scores in enumerate(per_shard):
+            if scores:
+                self.inboxes[shard_id].put(('set_scores', scores))
+        return graph.scores_for(authority_scores, references)
+
+    def stop(self, timeout=30):
+        """
+        Stop all shards and wait for their processes to exit.
+        """
+        for inbox in self.inboxes:
+            inbox.put(('stop',))
+        try:
+            self._collect('stopped', len([p for p in self.processes if p.is_alive()]), timeout)
+        finally:
+            for process in self.processes:
+                process.join(timeout)
+                if process.is_alive():
+                    logger.warning(f"Shard process {process.name} did not exit; terminating it.")
+                    process.terminate()
+            self.processes = []
+
+    def _collect(self, kind, count, timeout, request_id=None):
+        replies = []
+        deadline = time.monotonic() + timeout
+        while len(replies) < count:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ShardingError(f"Timed out waiting for {count - len(replies)} '{kind}' replies from shards.")
+            try:
+                reply = self.results.get(timeout=remaining)
+            except queue.Empty:
+                continue
+            if reply[0] != kind or (request_id is not None and reply[1] != request_id):
+                logger.debug(f"Discarding stale shard reply: {reply[:2]}")
+                continue
+            replies.append(reply)
+        return replies
@@ -0,0 +1,132 @@
+# atlas/core/workers.py
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool:
+    """
+    Continuous execution of (entity, iQuery) work by a pool of async workers.
+
+    A feeder pulls the most urgent work from the ATLAS scheduler into a
+    bounded queue; when the queue is full the feeder waits, so the scheduler
+    keeps ordering work that has not been picked up yet. Each worker runs one
+    item at a time with a per-item deadline. New work, including iQueries of
+    newly registered entities, is fed as soon as it is marked dirty instead of
+    waiting for a fixed-interval cycle.
+    """
+
+    def __init__(self, atlas, num_workers=8, queue_size=100, item_deadline=120, retry_delay=60):
+        """
+        Initialize the WorkerPool.
+
+        Args:
+            atlas (ATLAS): The ATLAS instance whose scheduler supplies work.
+            num_workers (int): Number of concurrent workers.
+            queue_size (int): Capacity of the work queue.
+            item_deadline (float): Seconds an item may run before it is cancelled.
+            retry_delay (float): Seconds before a failed or timed-out item is retried.
+        """
+        self.atlas = atlas
+        self.scheduler = atlas.scheduler
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.item_deadline = item_deadline
+        self.retry_delay = retry_delay
+        self.queue = None
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+        self._wakeup = None
+        self._tasks = []
+
+    async def run(self):
+        """
+        Run the feeder and workers until cancelled or stop() is called.
+        """
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._wakeup = asyncio.Event()
+        self.scheduler.on_work = self._wakeup.set
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+        self._tasks.append(asyncio.create_task(self._feed()))
+        logger.info(f"Worker pool started with {self.num_workers} workers.")
+        try:
+            await asyncio.gather(*self._tasks)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.scheduler.on_work = None
+            await self._cancel_tasks()
+            self._requeue_unstarted()
+            logger.info(f"Worker pool stopped. Completed: {self.completed}, failed: {self.failed}, "
+                        f"timed out: {self.timed_out}.")
+
+    def stop(self):
+        """
+        Stop the feeder and workers. Items still waiting in the queue are
+        handed back to the scheduler.
+        """
+        for task in self._tasks:
+            task.cancel()
+
+    async def _cancel_tasks(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _requeue_unstarted(self):
+        while not self.queue.empty():
+            self._hand_back(*self.queue.get_nowait())
+
+    async def _feed(self):
+        epoch_started = time.monotonic()
+        while True:
+            # Advance the scheduler's aging epoch once per update interval so
+            # long-waiting work gains ground on newly marked work.
+            if time.monotonic() - epoch_started >= self.atlas.update_interval:
+                self.scheduler.cycle += 1
+                epoch_started = time.monotonic()
+            item = self.scheduler.pop()
+            if item is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            try:
+                await self.queue.put(item)
+            except asyncio.CancelledError:
+                self._hand_back(*item)
+                raise
+
+    async def _worker(self, worker_id):
+        while True:
+            entity, iquery = await self.queue.get()
+            retry_after = None
+            try:
+                succeeded = await asyncio.wait_for(
+                    entity.run_iquery(iquery, self.atlas.global_state),
+                    timeout=self.item_deadline
+                )
+                if succeeded:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                    retry_after = self.retry_delay
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                retry_after = self.retry_delay
+                logger.warning(f"Worker {worker_id}: iQuery '{iquery.name}' for Entity "
+                               f"'{entity.entity_id}' exceeded its {self.item_deadline}s deadline.")
+            except asyncio.CancelledError:
+                self._hand_back(entity, iquery)
+                self.queue.task_done()
+                raise
+            self.scheduler.finish(entity.entity_id, iquery.name, retry_after=retry_after)
+            self.queue.task_done()
+
+    def _hand_back(self, entity, iquery):
+        self.scheduler.finish(entity.entity_id, iquery.name)
+        self.scheduler.mark_dirty(entity.entity_id, iquery.name)
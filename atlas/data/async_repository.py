@@ -0,0 +1,121 @@
+# atlas/data/async_repository.py
+
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .repository import Repository
+from ..utils.config import config
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def repository_executor():
+    """
+    The process-wide thread pool that runs repository calls for async code.
+
+    Its size bounds the number of concurrent Neo4j round trips (neomodel
+    keeps one driver connection per thread).
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=config.ATLAS_REPOSITORY_THREADS,
+                thread_name_prefix='atlas-repository',
+            )
+        return _executor
+
+
+class AsyncRepository:
+    """
+    Awaitable counterpart of Repository for use inside the event loop.
+
+    Each operation runs the corresponding synchronous Repository method on a
+    bounded thread pool, so a Bolt round trip no longer stalls the event loop
+    and storage latency overlaps with in-flight LLM requests.
+    """
+
+    def __init__(self, repository=None, executor=None):
+        """
+        Initialize the AsyncRepository.
+
+        Args:
+            repository (Repository, optional): The repository to wrap.
+            executor (Executor, optional): Executor to run calls on. Defaults to
+                the shared pool from repository_executor().
+        """
+        self.repository = repository or Repository()
+        self.executor = executor
+
+    async def _run(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(method, *args, **kwargs)
+        return await loop.run_in_executor(self.executor or repository_executor(), call)
+
+    async def get_entity_by_id(self, entity_id):
+        return await self._run(self.repository.get_entity_by_id, entity_id)
+
+    async def create_entity(self, entity_id, attributes=None):
+        return await self._run(self.repository.create_entity, entity_id, attributes)
+
+    async def update_entity_attributes(self, entity_id, new_attributes):
+        return await self._run(self.repository.update_entity_attributes, entity_id, new_attributes)
+
+    async def bulk_update_attributes(self, updates, removals=None):
+        return await self._run(self.repository.bulk_update_attributes, updates, removals)
+
+    async def batch_create_entities(self, entities_data, on_match='merge', batch_size=None):
+        return await self._run(self.repository.batch_create_entities, entities_data,
+                               on_match=on_match, batch_size=batch_size)
+
+    async def delete_entity(self, entity_id):
+        return await self._run(self.repository.delete_entity, entity_id)
+
+    async def create_pattern(self, name):
+        return await self._run(self.repository.create_pattern, name)
+
+    async def get_pattern_by_name(self, name):
+        return await self._run(self.repository.get_pattern_by_name, name)
+
+    async def add_pattern_to_entity(self, entity, pattern):
+        return await self._run(self.repository.add_pattern_to_entity, entity, pattern)
+
+    async def remove_pattern_from_entity(self, entity, pattern):
+        return await self._run(self.repository.remove_pattern_from_entity, entity, pattern)
+
+    async def add_parent_pattern(self, pattern, parent_pattern):
+        return await self._run(self.repository.add_parent_pattern, pattern, parent_pattern)
+
+    async def create_iquery(self, name, target_attribute, conditions=None, status='pending', prompt_template=None):
+        return await self._run(self.repository.create_iquery, name, target_attribute, conditions, status,
+                               prompt_template)
+
+    async def get_iquery_by_name(self, name):
+        return await self._run(self.repository.get_iquery_by_name, name)
+
+    async def update_iquery_status(self, iquery, status):
+        return await self._run(self.repository.update_iquery_status, iquery, status)
+
+    async def add_iquery_to_entity(self, entity, iquery):
+        return await self._run(self.repository.add_iquery_to_entity, entity, iquery)
+
+    async def add_iquery_to_pattern(self, pattern, iquery):
+        return await self._run(self.repository.add_iquery_to_pattern, pattern, iquery)
+
+    async def create_resource_handler(self, handler_type, config=None):
+        return await self._run(self.repository.create_resource_handler, handler_type, config)
+
+    async def get_resource_handler_by_type(self, handler_type):
+        return await self._run(self.repository.get_resource_handler_by_type, handler_type)
+
+    async def add_resource_handler_to_iquery(self, iquery, handler):
+        return await self._run(self.repository.add_resource_handler_to_iquery, iquery, handler)
+
+    async def load_snapshot(self, page_size=None):
+        return await self._run(self.repository.load_snapshot, page_size)
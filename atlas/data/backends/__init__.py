@@ -0,0 +1,80 @@
+# atlas/data/backends/__init__.py
+
+import importlib
+import threading
+
+from .base import (
+    StorageBackend,
+    EntityRecord,
+    PatternRecord,
+    IQueryRecord,
+    ResourceHandlerRecord,
+    GraphSnapshot,
+)
+
+# name -> (module, class); imported on first use so that only the selected
+# backend's dependencies (e.g. neomodel) need to be installed
+BACKENDS = {
+    'neo4j': ('.neo4j', 'Neo4jBackend'),
+    'memory': ('.memory', 'MemoryBackend'),
+    'sqlite': ('.sqlite', 'SQLiteBackend'),
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=None, **options):
+    """
+    Create a storage backend.
+
+    Args:
+        name (str, optional): 'neo4j', 'memory' or 'sqlite'. Defaults to the
+            ATLAS_STORAGE_BACKEND setting.
+        **options: Passed to the backend constructor. The SQLite path
+            defaults to the ATLAS_SQLITE_PATH setting.
+
+    Returns:
+        StorageBackend: The new backend.
+    """
+    from ...utils.config import config
+    name = name or config.ATLAS_STORAGE_BACKEND
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown storage backend '{name}'. Choose one of: {', '.join(BACKENDS)}.")
+    if name == 'sqlite':
+        options.setdefault('path', config.ATLAS_SQLITE_PATH)
+    module_name, class_name = BACKENDS[name]
+    backend_class = getattr(importlib.import_module(module_name, __name__), class_name)
+    return backend_class(**options)
+
+
+def get_backend():
+    """
+    The process-wide backend used by Repository, created on first use.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+def set_backend(backend):
+    """
+    Replace the process-wide backend, e.g. with a MemoryBackend in tests and
+    benchmarks. Call before creating any ATLAS objects.
+
+    Args:
+        backend (StorageBackend or str): A backend, or a backend name.
+
+    Returns:
+        StorageBackend: The backend now in use.
+    """
+    global _backend
+    if isinstance(backend, str):
+        backend = create_backend(backend)
+    with _backend_lock:
+        _backend = backend
+    from ..repository import identity_map
+    identity_map.clear()
+    return backend
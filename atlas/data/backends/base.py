@@ -0,0 +1,187 @@
+# atlas/data/backends/base.py
+
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+
+def _new_uid():
+    return uuid.uuid4().hex
+
+
+@dataclass
+class EntityRecord:
+    entity_id: str
+    attributes: dict = field(default_factory=dict)
+    uid: str = field(default_factory=_new_uid)
+
+
+@dataclass
+class PatternRecord:
+    name: str
+    uid: str = field(default_factory=_new_uid)
+
+
+@dataclass
+class IQueryRecord:
+    name: str
+    target_attribute: str
+    conditions: list = field(default_factory=list)
+    status: str = 'pending'
+    prompt_template: str = None
+    uid: str = field(default_factory=_new_uid)
+
+
+@dataclass
+class ResourceHandlerRecord:
+    handler_type: str
+    config: dict = field(default_factory=dict)
+    uid: str = field(default_factory=_new_uid)
+
+
+@dataclass
+class GraphSnapshot:
+    """
+    Everything stored, as loaded by StorageBackend.load_snapshot.
+    Relationships are given by the names/IDs of both ends.
+    """
+    entities: list = field(default_factory=list)
+    patterns: list = field(default_factory=list)
+    iqueries: list = field(default_factory=list)
+    resource_handlers: list = field(default_factory=list)
+    entity_patterns: dict = field(default_factory=dict)    # entity_id -> [pattern name]
+    pattern_parents: dict = field(default_factory=dict)    # pattern name -> [parent name]
+    pattern_iqueries: dict = field(default_factory=dict)   # pattern name -> [iQuery name]
+    iquery_handlers: dict = field(default_factory=dict)    # iQuery name -> [handler type]
+
+
+class StorageBackend(ABC):
+    """
+    Storage operations behind the Repository.
+
+    Backends return record objects that expose the same fields as the
+    records above (entity_id/attributes, name, name/target_attribute/status,
+    handler_type/config). Relationship and status methods only rely on the
+    key fields of the records they receive (entity_id, name, handler_type),
+    so they accept records from any source.
+    """
+
+    name = None
+    BATCH_SIZE = 1000
+    ON_MATCH_MODES = ('merge', 'replace', 'keep')
+
+    # Entities
+
+    @abstractmethod
+    def get_entity(self, entity_id):
+        """Returns the entity record, or None."""
+
+    @abstractmethod
+    def create_entity(self, entity_id, attributes=None):
+        """Creates and returns an entity record."""
+
+    @abstractmethod
+    def update_entity_attributes(self, entity_id, new_attributes):
+        """Merges attributes into an entity; returns its record, or None."""
+
+    @abstractmethod
+    def bulk_update_attributes(self, updates, removals=None):
+        """
+        Merges attribute updates into many entities in one batch.
+
+        Args:
+            updates (dict): entity_id -> dict of attributes to set.
+            removals (dict, optional): entity_id -> attribute keys to delete.
+
+        Returns:
+            list: The IDs of the entities that were updated.
+        """
+
+    @abstractmethod
+    def batch_create_entities(self, entities_data, on_match='merge', batch_size=None):
+        """
+        Creates or merges many entities and their pattern relationships.
+        See Repository.batch_create_entities.
+        """
+
+    @abstractmethod
+    def delete_entity(self, entity_id):
+        """Deletes an entity and its relationships."""
+
+    # Patterns
+
+    @abstractmethod
+    def get_pattern(self, name):
+        """Returns the pattern record, or None."""
+
+    @abstractmethod
+    def create_pattern(self, name):
+        """Creates and returns a pattern record."""
+
+    @abstractmethod
+    def add_pattern_to_entity(self, entity, pattern):
+        pass
+
+    @abstractmethod
+    def remove_pattern_from_entity(self, entity, pattern):
+        pass
+
+    @abstractmethod
+    def add_parent_pattern(self, pattern, parent_pattern):
+        pass
+
+    # iQueries
+
+    @abstractmethod
+    def get_iquery(self, name):
+        """Returns the iQuery record, or None."""
+
+    @abstractmethod
+    def create_iquery(self, name, target_attribute, conditions=None, status='pending', prompt_template=None):
+        """Creates and returns an iQuery record."""
+
+    @abstractmethod
+    def update_iquery_status(self, iquery, status):
+        pass
+
+    @abstractmethod
+    def add_iquery_to_entity(self, entity, iquery):
+        pass
+
+    @abstractmethod
+    def add_iquery_to_pattern(self, pattern, iquery):
+        pass
+
+    # Resource handlers
+
+    @abstractmethod
+    def get_resource_handler(self, handler_type):
+        """Returns the resource handler record, or None."""
+
+    @abstractmethod
+    def create_resource_handler(self, handler_type, config=None):
+        """Creates and returns a resource handler record."""
+
+    @abstractmethod
+    def add_resource_handler_to_iquery(self, iquery, handler):
+        pass
+
+    # Bulk reads
+
+    @abstractmethod
+    def load_snapshot(self, page_size=None):
+        """
+        Loads all records and relationships with a few bulk reads; entities
+        are read in pages of ``page_size`` (default BATCH_SIZE).
+
+        Returns:
+            GraphSnapshot: The stored graph.
+        """
+
+    def close(self):
+        """Releases connections held by the backend."""
+        pass
+
+    def _check_on_match(self, on_match):
+        if on_match not in self.ON_MATCH_MODES:
+            raise ValueError(f"Invalid on_match mode '{on_match}'.")
@@ -0,0 +1,177 @@
+# atlas/data/backends/memory.py
+
+import logging
+import threading
+from collections import defaultdict
+
+from .base import (
+    StorageBackend,
+    EntityRecord,
+    PatternRecord,
+    IQueryRecord,
+    ResourceHandlerRecord,
+    GraphSnapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend(StorageBackend):
+    """
+    Keeps all records in process memory. Nothing survives a restart; meant
+    for tests, benchmarks and simulations that need no external services.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.entities = {}
+        self.patterns = {}
+        self.iqueries = {}
+        self.resource_handlers = {}
+        # Relationships, by the keys of both ends
+        self.entity_patterns = defaultdict(set)
+        self.entity_iqueries = defaultdict(set)
+        self.pattern_iqueries = defaultdict(set)
+        self.pattern_parents = defaultdict(set)
+        self.iquery_handlers = defaultdict(set)
+
+    # Entities
+
+    def get_entity(self, entity_id):
+        return self.entities.get(entity_id)
+
+    def create_entity(self, entity_id, attributes=None):
+        with self._lock:
+            entity = EntityRecord(entity_id=entity_id, attributes=dict(attributes or {}))
+            self.entities[entity_id] = entity
+            return entity
+
+    def update_entity_attributes(self, entity_id, new_attributes):
+        with self._lock:
+            entity = self.entities.get(entity_id)
+            if entity:
+                entity.attributes.update(new_attributes)
+            return entity
+
+    def bulk_update_attributes(self, updates, removals=None):
+        removals = removals or {}
+        updated = []
+        with self._lock:
+            for entity_id in updates.keys() | removals.keys():
+                entity = self.entities.get(entity_id)
+                if entity is None:
+                    continue
+                entity.attributes.update(updates.get(entity_id, {}))
+                for key in removals.get(entity_id, ()):
+                    entity.attributes.pop(key, None)
+                updated.append(entity_id)
+        return updated
+
+    def batch_create_entities(self, entities_data, on_match='merge', batch_size=None):
+        self._check_on_match(on_match)
+        records = []
+        with self._lock:
+            for data in entities_data:
+                entity_id = data['entity_id']
+                attributes = dict(data.get('attributes') or {})
+                entity = self.entities.get(entity_id)
+                if entity is None:
+                    entity = self.entities[entity_id] = EntityRecord(entity_id=entity_id, attributes=attributes)
+                elif on_match == 'merge':
+                    entity.attributes.update(attributes)
+                elif on_match == 'replace':
+                    entity.attributes = attributes
+                for pattern in data.get('patterns', []):
+                    name = getattr(pattern, 'name', pattern)
+                    if name in self.patterns:
+                        self.entity_patterns[entity_id].add(name)
+                records.append(entity)
+        return records
+
+    def delete_entity(self, entity_id):
+        with self._lock:
+            self.entities.pop(entity_id, None)
+            self.entity_patterns.pop(entity_id, None)
+            self.entity_iqueries.pop(entity_id, None)
+
+    # Patterns
+
+    def get_pattern(self, name):
+        return self.patterns.get(name)
+
+    def create_pattern(self, name):
+        with self._lock:
+            pattern = self.patterns[name] = PatternRecord(name=name)
+            return pattern
+
+    def add_pattern_to_entity(self, entity, pattern):
+        with self._lock:
+            self.entity_patterns[entity.entity_id].add(pattern.name)
+
+    def remove_pattern_from_entity(self, entity, pattern):
+        with self._lock:
+            self.entity_patterns[entity.entity_id].discard(pattern.name)
+
+    def add_parent_pattern(self, pattern, parent_pattern):
+        with self._lock:
+            self.pattern_parents[pattern.name].add(parent_pattern.name)
+
+    # iQueries
+
+    def get_iquery(self, name):
+        return self.iqueries.get(name)
+
+    def create_iquery(self, name, target_attribute, conditions=None, status='pending', prompt_template=None):
+        with self._lock:
+            iquery = self.iqueries[name] = IQueryRecord(
+                name=name,
+                target_attribute=target_attribute,
+                conditions=conditions or [],
+                status=status,
+                prompt_template=prompt_template,
+            )
+            return iquery
+
+    def update_iquery_status(self, iquery, status):
+        iquery.status = status
+
+    def add_iquery_to_entity(self, entity, iquery):
+        with self._lock:
+            self.entity_iqueries[entity.entity_id].add(iquery.name)
+
+    def add_iquery_to_pattern(self, pattern, iquery):
+        with self._lock:
+            self.pattern_iqueries[pattern.name].add(iquery.name)
+
+    # Resource handlers
+
+    def get_resource_handler(self, handler_type):
+        return self.resource_handlers.get(handler_type)
+
+    def create_resource_handler(self, handler_type, config=None):
+        with self._lock:
+            handler = self.resource_handlers[handler_type] = ResourceHandlerRecord(
+                handler_type=handler_type, config=config or {}
+            )
+            return handler
+
+    def add_resource_handler_to_iquery(self, iquery, handler):
+        with self._lock:
+            self.iquery_handlers[iquery.name].add(handler.handler_type)
+
+    # Bulk reads
+
+    def load_snapshot(self, page_size=None):
+        with self._lock:
+            return GraphSnapshot(
+                entities=list(self.entities.values()),
+                patterns=list(self.patterns.values()),
+                iqueries=list(self.iqueries.values()),
+                resource_handlers=list(self.resource_handlers.values()),
+                entity_patterns={key: sorted(names) for key, names in self.entity_patterns.items()},
+                pattern_parents={key: sorted(names) for key, names in self.pattern_parents.items()},
+                pattern_iqueries={key: sorted(names) for key, names in self.pattern_iqueries.items()},
+                iquery_handlers={key: sorted(names) for key, names in self.iquery_handlers.items()},
+            )
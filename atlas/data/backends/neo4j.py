@@ -0,0 +1,287 @@
+# atlas/data/backends/neo4j.py
+
+import json
+import logging
+import threading
+import uuid
+
+from neomodel import config as neomodel_config, db
+
+from .base import StorageBackend, GraphSnapshot
+from ..models import EntityModel, PatternModel, IQueryModel, ResourceHandlerModel
+
+logger = logging.getLogger(__name__)
+
+# Serializes the read-merge-write of the JSON attributes within the process,
+# e.g. write-behind flushes against ATLAS.smooth_authority
+_attributes_lock = threading.Lock()
+
+
+class Neo4jBackend(StorageBackend):
+    """
+    Stores the graph in Neo4j through neomodel. Records are the neomodel
+    node objects from atlas.data.models; relationship and status writes
+    match nodes by their keys, so they also accept plain records (e.g. from
+    a checkpoint).
+    """
+
+    name = 'neo4j'
+
+    def __init__(self, database_url=None):
+        """
+        Initialize the Neo4jBackend.
+
+        Args:
+            database_url (str, optional): Bolt URL. Defaults to the one built
+                from the NEO4J_* settings.
+        """
+        from ...utils.config import config
+        neomodel_config.DATABASE_URL = database_url or config.neo4j_database_url
+
+    # Entities
+
+    def get_entity(self, entity_id):
+        return EntityModel.nodes.get_or_none(entity_id=entity_id)
+
+    def create_entity(self, entity_id, attributes=None):
+        entity = EntityModel(entity_id=entity_id, attributes=attributes or {})
+        entity.save()
+        return entity
+
+    def update_entity_attributes(self, entity_id, new_attributes):
+        with _attributes_lock, db.transaction:
+            entity = self.get_entity(entity_id)
+            if entity:
+                entity.attributes.update(new_attributes)
+                entity.save()
+        return entity
+
+    def bulk_update_attributes(self, updates, removals=None):
+        # attributes is stored as a JSON string, so it cannot be merged in
+        # Cypher: read the stored values once, merge, and write them back in
+        # one transaction, so that concurrent writers cannot interleave.
+        removals = removals or {}
+        rows = []
+        with _attributes_lock, db.transaction:
+            for entity_id, attributes in self._stored_attributes(list(updates.keys() | removals.keys())).items():
+                attributes.update(updates.get(entity_id, {}))
+                for key in removals.get(entity_id, ()):
+                    attributes.pop(key, None)
+                rows.append({'entity_id': entity_id, 'attributes': json.dumps(attributes)})
+            db.cypher_query(
+                """
+                UNWIND $rows AS row
+                MATCH (e:EntityModel {entity_id: row.entity_id})
+                SET e.attributes = row.attributes
+                """,
+                {'rows': rows}
+            )
+        return [row['entity_id'] for row in rows]
+
+    def batch_create_entities(self, entities_data, on_match='merge', batch_size=None):
+        self._check_on_match(on_match)
+        batch_size = batch_size or self.BATCH_SIZE
+        set_attributes = (
+            "ON CREATE SET e.uid = row.uid, e.attributes = row.attributes"
+            if on_match == 'keep' else
+            "ON CREATE SET e.uid = row.uid\n        SET e.attributes = row.attributes"
+        )
+        cypher_query = f"""
+        UNWIND $batch as row
+        MERGE (e:EntityModel {{entity_id: row.entity_id}})
+        {set_attributes}
+        WITH e, row
+        CALL {{
+            WITH e, row
+            UNWIND row.patterns AS pattern_name
+            MATCH (p:PatternModel {{name: pattern_name}})
+            MERGE (e)-[:HAS_PATTERN]->(p)
+        }}
+        RETURN e
+        """
+        models = {}
+        for start in range(0, len(entities_data), batch_size):
+            chunk = entities_data[start:start + batch_size]
+            with _attributes_lock, db.transaction:
+                stored = self._stored_attributes([data['entity_id'] for data in chunk]) if on_match == 'merge' else {}
+                batch = []
+                for data in chunk:
+                    attributes = dict(stored.get(data['entity_id'], {}))
+                    attributes.update(data.get('attributes') or {})
+                    if on_match == 'merge':
+                        # A later candidate for the same ID merges into this one
+                        stored[data['entity_id']] = attributes
+                    batch.append({
+                        'entity_id': data['entity_id'],
+                        'uid': uuid.uuid4().hex,
+                        'attributes': json.dumps(attributes),
+                        'patterns': [getattr(pattern, 'name', pattern) for pattern in data.get('patterns', [])],
+                    })
+                results, meta = db.cypher_query(cypher_query, {'batch': batch})
+            for row in results:
+                model = EntityModel.inflate(row[0])
+                models[model.entity_id] = model
+        return [models[data['entity_id']] for data in entities_data]
+
+    def _stored_attributes(self, entity_ids):
+        results, _ = db.cypher_query(
+            "MATCH (e:EntityModel) WHERE e.entity_id IN $ids RETURN e.entity_id, e.attributes",
+            {'ids': entity_ids}
+        )
+        return {entity_id: json.loads(stored) if stored else {} for entity_id, stored in results}
+
+    def delete_entity(self, entity_id):
+        entity = self.get_entity(entity_id)
+        if entity:
+            entity.delete()
+
+    # Patterns
+
+    def get_pattern(self, name):
+        return PatternModel.nodes.get_or_none(name=name)
+
+    def create_pattern(self, name):
+        pattern = PatternModel(name=name)
+        pattern.save()
+        return pattern
+
+    def add_pattern_to_entity(self, entity, pattern):
+        db.cypher_query(
+            """
+            MATCH (e:EntityModel {entity_id: $entity_id}), (p:PatternModel {name: $name})
+            MERGE (e)-[:HAS_PATTERN]->(p)
+            """,
+            {'entity_id': entity.entity_id, 'name': pattern.name}
+        )
+
+    def remove_pattern_from_entity(self, entity, pattern):
+        db.cypher_query(
+            """
+            MATCH (:EntityModel {entity_id: $entity_id})-[r:HAS_PATTERN]->(:PatternModel {name: $name})
+            DELETE r
+            """,
+            {'entity_id': entity.entity_id, 'name': pattern.name}
+        )
+
+    def add_parent_pattern(self, pattern, parent_pattern):
+        db.cypher_query(
+            """
+            MATCH (p:PatternModel {name: $name}), (parent:PatternModel {name: $parent})
+            MERGE (p)-[:INHERITS_FROM]->(parent)
+            """,
+            {'name': pattern.name, 'parent': parent_pattern.name}
+        )
+
+    # iQueries
+
+    def get_iquery(self, name):
+        return IQueryModel.nodes.get_or_none(name=name)
+
+    def create_iquery(self, name, target_attribute, conditions=None, status='pending', prompt_template=None):
+        iquery = IQueryModel(
+            name=name,
+            target_attribute=target_attribute,
+            conditions=conditions or [],
+            status=status,
+            prompt_template=prompt_template
+        )
+        iquery.save()
+        return iquery
+
+    def update_iquery_status(self, iquery, status):
+        iquery.status = status
+        db.cypher_query("MATCH (q:IQueryModel {name: $name}) SET q.status = $status",
+                        {'name': iquery.name, 'status': status})
+
+    def add_iquery_to_entity(self, entity, iquery):
+        db.cypher_query(
+            """
+            MATCH (e:EntityModel {entity_id: $entity_id}), (q:IQueryModel {name: $name})
+            MERGE (e)-[:HAS_IQUERY]->(q)
+            """,
+            {'entity_id': entity.entity_id, 'name': iquery.name}
+        )
+
+    def add_iquery_to_pattern(self, pattern, iquery):
+        db.cypher_query(
+            """
+            MATCH (p:PatternModel {name: $pattern}), (q:IQueryModel {name: $name})
+            MERGE (p)-[:HAS_IQUERY]->(q)
+            """,
+            {'pattern': pattern.name, 'name': iquery.name}
+        )
+
+    # Resource handlers
+
+    def get_resource_handler(self, handler_type):
+        return ResourceHandlerModel.nodes.get_or_none(handler_type=handler_type)
+
+    def create_resource_handler(self, handler_type, config=None):
+        handler = ResourceHandlerModel(handler_type=handler_type, config=config or {})
+        handler.save()
+        return handler
+
+    def add_resource_handler_to_iquery(self, iquery, handler):
+        db.cypher_query(
+            """
+            MATCH (q:IQueryModel {name: $name}), (h:ResourceHandlerModel {handler_type: $handler_type})
+            MERGE (q)-[:USES_HANDLER]->(h)
+            """,
+            {'name': iquery.name, 'handler_type': handler.handler_type}
+        )
+
+    # Bulk reads
+
+    def load_snapshot(self, page_size=None):
+        page_size = page_size or self.BATCH_SIZE
+        snapshot = GraphSnapshot()
+        results, _ = db.cypher_query("MATCH (h:ResourceHandlerModel) RETURN h")
+        snapshot.resource_handlers = [ResourceHandlerModel.inflate(row[0]) for row in results]
+        results, _ = db.cypher_query(
+            """
+            MATCH (q:IQueryModel)
+            OPTIONAL MATCH (q)-[:USES_HANDLER]->(h:ResourceHandlerModel)
+            RETURN q, collect(DISTINCT h.handler_type)
+            """
+        )
+        for node, handler_types in results:
+            iquery = IQueryModel.inflate(node)
+            snapshot.iqueries.append(iquery)
+            snapshot.iquery_handlers[iquery.name] = handler_types
+        results, _ = db.cypher_query(
+            """
+            MATCH (p:PatternModel)
+            OPTIONAL MATCH (p)-[:INHERITS_FROM]->(parent:PatternModel)
+            WITH p, collect(DISTINCT parent.name) AS parents
+            OPTIONAL MATCH (p)-[:HAS_IQUERY]->(q:IQueryModel)
+            RETURN p, parents, collect(DISTINCT q.name)
+            """
+        )
+        for node, parents, iquery_names in results:
+            pattern = PatternModel.inflate(node)
+            snapshot.patterns.append(pattern)
+            snapshot.pattern_parents[pattern.name] = parents
+            snapshot.pattern_iqueries[pattern.name] = iquery_names
+        # Keyset pagination over the unique entity_id index; unlike SKIP,
+        # each page costs the same no matter how far in it starts.
+        last_id = ''
+        while True:
+            results, _ = db.cypher_query(
+                """
+                MATCH (e:EntityModel)
+                WHERE e.entity_id > $last_id
+                WITH e ORDER BY e.entity_id LIMIT $limit
+                OPTIONAL MATCH (e)-[:HAS_PATTERN]->(p:PatternModel)
+                RETURN e, collect(p.name)
+                ORDER BY e.entity_id
+                """,
+                {'last_id': last_id, 'limit': page_size}
+            )
+            for node, pattern_names in results:
+                entity = EntityModel.inflate(node)
+                snapshot.entities.append(entity)
+                snapshot.entity_patterns[entity.entity_id] = pattern_names
+            if len(results) < page_size:
+                break
+            last_id = snapshot.entities[-1].entity_id
+        return snapshot
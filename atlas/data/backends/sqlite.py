@@ -0,0 +1,386 @@
+# atlas/data/backends/sqlite.py
+
+import json
+import logging
+import sqlite3
+import threading
+import uuid
+
+from .base import (
+    StorageBackend,
+    EntityRecord,
+    PatternRecord,
+    IQueryRecord,
+    ResourceHandlerRecord,
+    GraphSnapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL,
+    entity_id TEXT NOT NULL,
+    attributes TEXT NOT NULL DEFAULT '{}'
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_entities_entity_id ON entities (entity_id);
+
+CREATE TABLE IF NOT EXISTS patterns (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_patterns_name ON patterns (name);
+
+CREATE TABLE IF NOT EXISTS iqueries (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    target_attribute TEXT NOT NULL,
+    conditions TEXT NOT NULL DEFAULT '[]',
+    status TEXT NOT NULL DEFAULT 'pending',
+    prompt_template TEXT
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_iqueries_name ON iqueries (name);
+
+CREATE TABLE IF NOT EXISTS resource_handlers (
+    id INTEGER PRIMARY KEY,
+    uid TEXT NOT NULL,
+    handler_type TEXT NOT NULL,
+    config TEXT NOT NULL DEFAULT '{}'
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_resource_handlers_type ON resource_handlers (handler_type);
+
+CREATE TABLE IF NOT EXISTS entity_patterns (
+    entity_id TEXT NOT NULL,
+    pattern_name TEXT NOT NULL,
+    PRIMARY KEY (entity_id, pattern_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_entity_patterns_pattern ON entity_patterns (pattern_name);
+
+CREATE TABLE IF NOT EXISTS entity_iqueries (
+    entity_id TEXT NOT NULL,
+    iquery_name TEXT NOT NULL,
+    PRIMARY KEY (entity_id, iquery_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_entity_iqueries_iquery ON entity_iqueries (iquery_name);
+
+CREATE TABLE IF NOT EXISTS pattern_iqueries (
+    pattern_name TEXT NOT NULL,
+    iquery_name TEXT NOT NULL,
+    PRIMARY KEY (pattern_name, iquery_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_pattern_iqueries_iquery ON pattern_iqueries (iquery_name);
+
+CREATE TABLE IF NOT EXISTS pattern_parents (
+    pattern_name TEXT NOT NULL,
+    parent_name TEXT NOT NULL,
+    PRIMARY KEY (pattern_name, parent_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_pattern_parents_parent ON pattern_parents (parent_name);
+
+CREATE TABLE IF NOT EXISTS iquery_handlers (
+    iquery_name TEXT NOT NULL,
+    handler_type TEXT NOT NULL,
+    PRIMARY KEY (iquery_name, handler_type)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_iquery_handlers_type ON iquery_handlers (handler_type);
+"""
+
+# Columns added after a table was first created: table -> [(column, type)]
+MIGRATIONS = {
+    'iqueries': [('prompt_template', 'TEXT')],
+}
+
+# Stay below SQLITE_MAX_VARIABLE_NUMBER on older SQLite builds
+_MAX_PARAMETERS = 500
+
+
+def _chunks(items, size=_MAX_PARAMETERS):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteBackend(StorageBackend):
+    """
+    Stores the graph in an embedded SQLite database.
+
+    Nodes are tables with unique indexes on their lookup keys (entity_id,
+    pattern name, iQuery name, handler type); relationships are link tables
+    keyed by those names and indexed in both directions. One connection is
+    shared by all threads and serialised with a lock.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path=':memory:'):
+        """
+        Initialize the SQLiteBackend.
+
+        Args:
+            path (str): Database file, or ':memory:' for a private in-memory
+                database.
+        """
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ':memory:':
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        with self._conn:
+            for table, columns in MIGRATIONS.items():
+                existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                for column, column_type in columns:
+                    if column not in existing:
+                        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return self._conn.execute(sql, parameters).fetchall()
+
+    def _write(self, sql, parameters=()):
+        with self._lock, self._conn:
+            self._conn.execute(sql, parameters)
+
+    # Entities
+
+    @staticmethod
+    def _entity(row):
+        uid, entity_id, attributes = row
+        return EntityRecord(entity_id=entity_id, attributes=json.loads(attributes), uid=uid)
+
+    def get_entity(self, entity_id):
+        rows = self._query("SELECT uid, entity_id, attributes FROM entities WHERE entity_id = ?", (entity_id,))
+        return self._entity(rows[0]) if rows else None
+
+    def create_entity(self, entity_id, attributes=None):
+        entity = EntityRecord(entity_id=entity_id, attributes=dict(attributes or {}))
+        self._write(
+            "INSERT INTO entities (uid, entity_id, attributes) VALUES (?, ?, ?)",
+            (entity.uid, entity_id, json.dumps(entity.attributes)),
+        )
+        return entity
+
+    def update_entity_attributes(self, entity_id, new_attributes):
+        with self._lock:
+            entity = self.get_entity(entity_id)
+            if entity:
+                entity.attributes.update(new_attributes)
+                self._write(
+                    "UPDATE entities SET attributes = ? WHERE entity_id = ?",
+                    (json.dumps(entity.attributes), entity_id),
+                )
+            return entity
+
+    def bulk_update_attributes(self, updates, removals=None):
+        removals = removals or {}
+        with self._lock, self._conn:
+            rows = []
+            for entity_id, attributes in self._stored_attributes(list(updates.keys() | removals.keys())).items():
+                attributes.update(updates.get(entity_id, {}))
+                for key in removals.get(entity_id, ()):
+                    attributes.pop(key, None)
+                rows.append((json.dumps(attributes), entity_id))
+            self._conn.executemany("UPDATE entities SET attributes = ? WHERE entity_id = ?", rows)
+        return [entity_id for _, entity_id in rows]
+
+    def _stored_attributes(self, entity_ids):
+        stored = {}
+        for chunk in _chunks(entity_ids):
+            placeholders = ', '.join('?' * len(chunk))
+            for entity_id, attributes in self._conn.execute(
+                f"SELECT entity_id, attributes FROM entities WHERE entity_id IN ({placeholders})", chunk
+            ):
+                stored[entity_id] = json.loads(attributes)
+        return stored
+
+    def batch_create_entities(self, entities_data, on_match='merge', batch_size=None):
+        self._check_on_match(on_match)
+        batch_size = batch_size or self.BATCH_SIZE
+        conflict = {
+            'merge': "DO UPDATE SET attributes = excluded.attributes",
+            'replace': "DO UPDATE SET attributes = excluded.attributes",
+            'keep': "DO NOTHING",
+        }[on_match]
+        records = {}
+        for start in range(0, len(entities_data), batch_size):
+            chunk = entities_data[start:start + batch_size]
+            entity_ids = [data['entity_id'] for data in chunk]
+            with self._lock, self._conn:
+                stored = self._stored_attributes(entity_ids) if on_match == 'merge' else {}
+                rows, links = [], []
+                for data in chunk:
+                    attributes = dict(stored.get(data['entity_id'], {}))
+                    attributes.update(data.get('attributes') or {})
+                    if on_match == 'merge':
+                        # A later candidate for the same ID merges into this one
+                        stored[data['entity_id']] = attributes
+                    rows.append((uuid.uuid4().hex, data['entity_id'], json.dumps(attributes)))
+                    links.extend(
+                        (data['entity_id'], getattr(pattern, 'name', pattern))
+                        for pattern in data.get('patterns', [])
+                    )
+                self._conn.executemany(
+                    f"INSERT INTO entities (uid, entity_id, attributes) VALUES (?, ?, ?) "
+                    f"ON CONFLICT (entity_id) {conflict}",
+                    rows,
+                )
+                # Like the Neo4j MATCH, links to unknown patterns are skipped
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO entity_patterns (entity_id, pattern_name) "
+                    "SELECT ?, name FROM patterns WHERE name = ?",
+                    links,
+                )
+                for chunk_ids in _chunks(entity_ids):
+                    placeholders = ', '.join('?' * len(chunk_ids))
+                    for row in self._conn.execute(
+                        f"SELECT uid, entity_id, attributes FROM entities WHERE entity_id IN ({placeholders})",
+                        chunk_ids,
+                    ):
+                        records[row[1]] = self._entity(row)
+        return [records[data['entity_id']] for data in entities_data]
+
+    def delete_entity(self, entity_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM entities WHERE entity_id = ?", (entity_id,))
+            self._conn.execute("DELETE FROM entity_patterns WHERE entity_id = ?", (entity_id,))
+            self._conn.execute("DELETE FROM entity_iqueries WHERE entity_id = ?", (entity_id,))
+
+    # Patterns
+
+    def get_pattern(self, name):
+        rows = self._query("SELECT uid, name FROM patterns WHERE name = ?", (name,))
+        return PatternRecord(name=rows[0][1], uid=rows[0][0]) if rows else None
+
+    def create_pattern(self, name):
+        pattern = PatternRecord(name=name)
+        self._write("INSERT INTO patterns (uid, name) VALUES (?, ?)", (pattern.uid, name))
+        return pattern
+
+    def add_pattern_to_entity(self, entity, pattern):
+        self._write(
+            "INSERT OR IGNORE INTO entity_patterns (entity_id, pattern_name) VALUES (?, ?)",
+            (entity.entity_id, pattern.name),
+        )
+
+    def remove_pattern_from_entity(self, entity, pattern):
+        self._write(
+            "DELETE FROM entity_patterns WHERE entity_id = ? AND pattern_name = ?",
+            (entity.entity_id, pattern.name),
+        )
+
+    def add_parent_pattern(self, pattern, parent_pattern):
+        self._write(
+            "INSERT OR IGNORE INTO pattern_parents (pattern_name, parent_name) VALUES (?, ?)",
+            (pattern.name, parent_pattern.name),
+        )
+
+    # iQueries
+
+    _IQUERY_COLUMNS = "uid, name, target_attribute, conditions, status, prompt_template"
+
+    @staticmethod
+    def _iquery(row):
+        uid, name, target_attribute, conditions, status, prompt_template = row
+        return IQueryRecord(name=name, target_attribute=target_attribute, conditions=json.loads(conditions),
+                            status=status, prompt_template=prompt_template, uid=uid)
+
+    def get_iquery(self, name):
+        rows = self._query(f"SELECT {self._IQUERY_COLUMNS} FROM iqueries WHERE name = ?", (name,))
+        return self._iquery(rows[0]) if rows else None
+
+    def create_iquery(self, name, target_attribute, conditions=None, status='pending', prompt_template=None):
+        iquery = IQueryRecord(name=name, target_attribute=target_attribute,
+                              conditions=conditions or [], status=status, prompt_template=prompt_template)
+        self._write(
+            f"INSERT INTO iqueries ({self._IQUERY_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?)",
+            # Condition objects are rebuilt from code; store their repr
+            (iquery.uid, name, target_attribute, json.dumps(iquery.conditions, default=repr), status,
+             prompt_template),
+        )
+        return iquery
+
+    def update_iquery_status(self, iquery, status):
+        iquery.status = status
+        self._write("UPDATE iqueries SET status = ? WHERE name = ?", (status, iquery.name))
+
+    def add_iquery_to_entity(self, entity, iquery):
+        self._write(
+            "INSERT OR IGNORE INTO entity_iqueries (entity_id, iquery_name) VALUES (?, ?)",
+            (entity.entity_id, iquery.name),
+        )
+
+    def add_iquery_to_pattern(self, pattern, iquery):
+        self._write(
+            "INSERT OR IGNORE INTO pattern_iqueries (pattern_name, iquery_name) VALUES (?, ?)",
+            (pattern.name, iquery.name),
+        )
+
+    # Resource handlers
+
+    @staticmethod
+    def _resource_handler(row):
+        uid, handler_type, config = row
+        return ResourceHandlerRecord(handler_type=handler_type, config=json.loads(config), uid=uid)
+
+    def get_resource_handler(self, handler_type):
+        rows = self._query(
+            "SELECT uid, handler_type, config FROM resource_handlers WHERE handler_type = ?", (handler_type,)
+        )
+        return self._resource_handler(rows[0]) if rows else None
+
+    def create_resource_handler(self, handler_type, config=None):
+        handler = ResourceHandlerRecord(handler_type=handler_type, config=config or {})
+        self._write(
+            "INSERT INTO resource_handlers (uid, handler_type, config) VALUES (?, ?, ?)",
+            (handler.uid, handler_type, json.dumps(handler.config)),
+        )
+        return handler
+
+    def add_resource_handler_to_iquery(self, iquery, handler):
+        self._write(
+            "INSERT OR IGNORE INTO iquery_handlers (iquery_name, handler_type) VALUES (?, ?)",
+            (iquery.name, handler.handler_type),
+        )
+
+    # Bulk reads
+
+    def _links(self, table, key_column, value_column):
+        links = {}
+        for key, value in self._query(f"SELECT {key_column}, {value_column} FROM {table} ORDER BY {key_column}"):
+            links.setdefault(key, []).append(value)
+        return links
+
+    def load_snapshot(self, page_size=None):
+        page_size = page_size or self.BATCH_SIZE
+        snapshot = GraphSnapshot(
+            patterns=[PatternRecord(name=name, uid=uid) for uid, name in self._query("SELECT uid, name FROM patterns")],
+            iqueries=[self._iquery(row) for row in self._query(f"SELECT {self._IQUERY_COLUMNS} FROM iqueries")],
+            resource_handlers=[self._resource_handler(row) for row in
+                               self._query("SELECT uid, handler_type, config FROM resource_handlers")],
+            entity_patterns=self._links('entity_patterns', 'entity_id', 'pattern_name'),
+            pattern_parents=self._links('pattern_parents', 'pattern_name', 'parent_name'),
+            pattern_iqueries=self._links('pattern_iqueries', 'pattern_name', 'iquery_name'),
+            iquery_handlers=self._links('iquery_handlers', 'iquery_name', 'handler_type'),
+        )
+        # Keyset pagination over the entity_id index
+        last_id = ''
+        while True:
+            rows = self._query(
+                "SELECT uid, entity_id, attributes FROM entities WHERE entity_id > ? ORDER BY entity_id LIMIT ?",
+                (last_id, page_size),
+            )
+            snapshot.entities.extend(self._entity(row) for row in rows)
+            if len(rows) < page_size:
+                break
+            last_id = rows[-1][1]
+        return snapshot
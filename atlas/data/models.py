@@ -23,6 +23,7 @@ class IQueryModel(StructuredNode):
     target_attribute = StringProperty(required=True)
     conditions = JSONProperty(default=[])
     status = StringProperty(default='pending')
+    prompt_template = StringProperty()
 
     # Relationships
     resource_handlers = RelationshipTo('ResourceHandlerModel', 'USES_HANDLER')
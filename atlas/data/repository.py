@@ -1,86 +1,409 @@
 
-from .models import EntityModel, PatternModel, IQueryModel, ResourceHandlerModel
-from cachetools import cached, TTLCache
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
+from .backends import get_backend
+from ..utils.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class _CountingTTLCache(TTLCache):
+    """A TTLCache that counts the entries it evicts and expires."""
+
+    def __init__(self, maxsize, ttl):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.evictions = 0
+        self.expirations = 0
+
+    def popitem(self):
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+
+class IdentityMap:
+    """
+    Process-wide read cache of model lookups.
+
+    Maps (kind, key) to the loaded record, e.g. ('entity', entity_id), so
+    repeated lookups of the same node return the same object without a
+    round trip. Entries
+    are evicted least recently used once ``maxsize`` is reached and expire
+    after ``ttl`` seconds, which bounds how long changes made by other
+    processes stay invisible. Repository writes update or invalidate the
+    affected entries. Missing nodes are not cached.
+
+    ``maxsize`` and ``ttl`` default to the ATLAS_IDENTITY_MAP_SIZE and
+    ATLAS_IDENTITY_MAP_TTL settings, which are read when the map is first
+    used rather than when it is created.
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = None
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def _cache(self):
+        if self._entries is None:
+            with self._lock:
+                if self._entries is None:
+                    self._entries = _CountingTTLCache(
+                        maxsize=config.ATLAS_IDENTITY_MAP_SIZE if self.maxsize is None else self.maxsize,
+                        ttl=config.ATLAS_IDENTITY_MAP_TTL if self.ttl is None else self.ttl,
+                    )
+        return self._entries
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, kind, key, loader):
+        """
+        Look up a record, loading and caching it on a miss.
+
+        Args:
+            kind (str): 'entity', 'pattern', 'iquery' or 'resource_handler'.
+            key: The lookup key (entity_id, name or handler type).
+            loader (callable): Called without arguments on a miss; returns
+                the record or None.
+
+        Returns:
+            The record, or None if it does not exist.
+        """
+        cache_key = (kind, key)
+        with self._lock:
+            model = self._cache.get(cache_key)
+            if model is not None:
+                self.hits += 1
+                return model
+            self.misses += 1
+        model = loader()
+        if model is not None:
+            self.put(kind, key, model)
+        return model
+
+    def put(self, kind, key, model):
+        with self._lock:
+            self._cache[(kind, key)] = model
+
+    def invalidate(self, kind, key):
+        with self._lock:
+            self._cache.pop((kind, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hit, miss, eviction and expiration counters, the hit rate
+            and the current size.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self._cache.evictions,
+                'expirations': self._cache.expirations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self._cache),
+            }
+
+
+# Shared by all Repository instances in the process
+identity_map = IdentityMap()
+
 
 class Repository:
-    def __init__(self):
-        # Cache with a Time-To-Live of 300 seconds and max size of 100 entries
-        self.entity_cache = TTLCache(maxsize=100, ttl=300)
+    """
+    Storage operations used by ATLAS, on top of a pluggable StorageBackend.
 
-    @cached(cache=lambda self: self.entity_cache)
-    def get_entity_by_id(self, entity_id):
-        return EntityModel.nodes.get_or_none(entity_id=entity_id)
+    Lookups go through the shared identity map; writes keep it current.
+    The backend is the process-wide one from atlas.data.backends (selected
+    with the ATLAS_STORAGE_BACKEND setting) unless one is passed in.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_backend()
+        self.identity_map = identity_map
 
     def create_entity(self, entity_id, attributes=None):
-        entity = EntityModel(entity_id=entity_id, attributes=attributes or {})
-        entity.save()
+        entity = self.backend.create_entity(entity_id, attributes)
+        self.identity_map.put('entity', entity_id, entity)
         return entity
 
     def get_entity_by_id(self, entity_id):
-        return EntityModel.nodes.get_or_none(entity_id=entity_id)
+        return self.identity_map.get('entity', entity_id, lambda: self.backend.get_entity(entity_id))
 
     def update_entity_attributes(self, entity_id, new_attributes):
-        entity = self.get_entity_by_id(entity_id)
+        entity = self.backend.update_entity_attributes(entity_id, new_attributes)
         if entity:
-            entity.attributes.update(new_attributes)
-            entity.save()
-            return entity
-        return None
+            self.identity_map.put('entity', entity_id, entity)
+        return entity
+
+    def stage_attribute_updates(self, entity_id, updates=None, removals=()):
+        """
+        Queue attribute changes in the shared write-behind buffer instead of
+        writing them immediately. See WriteBehindBuffer.
+
+        Args:
+            entity_id (str): The entity ID.
+            updates (dict, optional): Attributes to set.
+            removals (iterable): Attribute keys to delete.
+        """
+        write_behind.stage(entity_id, updates, removals)
+
+    def bulk_update_attributes(self, updates, removals=None):
+        """
+        Merge attribute updates into many entities in one batch (one read and
+        one write query on Neo4j).
+
+        Args:
+            updates (dict): entity_id -> dict of attributes to set.
+            removals (dict, optional): entity_id -> attribute keys to delete.
+        """
+        updated = self.backend.bulk_update_attributes(updates, removals)
+        # Cached records may now hold stale attributes
+        for entity_id in updated:
+            self.identity_map.invalidate('entity', entity_id)
 
     def delete_entity(self, entity_id):
-        entity = self.get_entity_by_id(entity_id)
-        if entity:
-            entity.delete()
+        self.backend.delete_entity(entity_id)
+        self.identity_map.invalidate('entity', entity_id)
 
     def create_pattern(self, name):
-        pattern = PatternModel(name=name)
-        pattern.save()
+        pattern = self.backend.create_pattern(name)
+        self.identity_map.put('pattern', name, pattern)
         return pattern
 
     def get_pattern_by_name(self, name):
-        return PatternModel.nodes.get_or_none(name=name)
+        return self.identity_map.get('pattern', name, lambda: self.backend.get_pattern(name))
 
     def add_pattern_to_entity(self, entity, pattern):
-        entity.patterns.connect(pattern)
-
-    def create_iquery(self, name, target_attribute, conditions=None, status='pending'):
-        iquery = IQueryModel(
-            name=name,
-            target_attribute=target_attribute,
-            conditions=conditions or [],
-            status=status
-        )
-        iquery.save()
+        self.backend.add_pattern_to_entity(entity, pattern)
+
+    def remove_pattern_from_entity(self, entity, pattern):
+        self.backend.remove_pattern_from_entity(entity, pattern)
+
+    def add_parent_pattern(self, pattern, parent_pattern):
+        self.backend.add_parent_pattern(pattern, parent_pattern)
+
+    def create_iquery(self, name, target_attribute, conditions=None, status='pending', prompt_template=None):
+        iquery = self.backend.create_iquery(name, target_attribute, conditions, status, prompt_template)
+        self.identity_map.put('iquery', name, iquery)
+        return iquery
+
+    def get_iquery_by_name(self, name):
+        return self.identity_map.get('iquery', name, lambda: self.backend.get_iquery(name))
+
+    def update_iquery_status(self, iquery, status):
+        self.backend.update_iquery_status(iquery, status)
         return iquery
 
     def add_iquery_to_entity(self, entity, iquery):
-        entity.iqueries.connect(iquery)
+        self.backend.add_iquery_to_entity(entity, iquery)
 
     def add_iquery_to_pattern(self, pattern, iquery):
-        pattern.iqueries.connect(iquery)
+        self.backend.add_iquery_to_pattern(pattern, iquery)
 
     def create_resource_handler(self, handler_type, config=None):
-        handler = ResourceHandlerModel(handler_type=handler_type, config=config or {})
-        handler.save()
+        handler = self.backend.create_resource_handler(handler_type, config)
+        self.identity_map.put('resource_handler', handler_type, handler)
         return handler
 
-    def add_resource_handler_to_iquery(self, iquery, handler):
-        iquery.resource_handlers.connect(handler)
-
-    def batch_create_entities(self, entities_data):
-        cypher_query = """
-        UNWIND $batch as row
-        CREATE (e:EntityModel {entity_id: row.entity_id, attributes: row.attributes})
-        RETURN e
-        """
-        
-        results, meta = db.cypher_query(cypher_query, {'batch': entities_data})
-        return [EntityModel.inflate(row[0]) for row in results]
-    
     def get_resource_handler_by_type(self, handler_type):
-        return ResourceHandlerModel.nodes.get_or_none(handler_type=handler_type)
+        return self.identity_map.get(
+            'resource_handler', handler_type, lambda: self.backend.get_resource_handler(handler_type)
+        )
+
+    def add_resource_handler_to_iquery(self, iquery, handler):
+        self.backend.add_resource_handler_to_iquery(iquery, handler)
+
+    def batch_create_entities(self, entities_data, on_match='merge', batch_size=None):
+        """
+        Create or merge many entities, their attributes and their HAS_PATTERN
+        relationships, one transaction per batch of rows.
+
+        Args:
+            entities_data (list): Dicts with 'entity_id' and optional
+                'attributes' and 'patterns' (pattern names or objects with a
+                ``name``). Patterns must already exist.
+            on_match (str): What to do with the attributes of entities that
+                already exist: 'merge' new attributes into the stored ones
+                (one extra read per batch), 'replace' them, or 'keep' them.
+            batch_size (int, optional): Rows per transaction. Defaults to the
+                backend's BATCH_SIZE.
+
+        Returns:
+            list: The entity records, in input order.
+        """
+        records = self.backend.batch_create_entities(entities_data, on_match=on_match, batch_size=batch_size)
+        for record in records:
+            self.identity_map.put('entity', record.entity_id, record)
+        return records
+
+    def load_snapshot(self, page_size=None):
+        """
+        Load the whole stored graph with a few paged bulk reads.
+
+        Args:
+            page_size (int, optional): Entities per read. Defaults to the
+                backend's BATCH_SIZE.
+
+        Returns:
+            GraphSnapshot: All records and their relationships.
+        """
+        return self.backend.load_snapshot(page_size)
+
+
+class WriteBehindBuffer:
+    """
+    Coalesces entity attribute updates in memory and writes them in batches.
+
+    Successive updates to the same entity are merged, so an attribute that
+    changes several times between flushes is written once. Pending updates
+    are flushed with Repository.bulk_update_attributes (one read and one
+    write query) once ``max_entities`` entities are pending or the oldest
+    pending update is ``max_delay`` seconds old. Reads through the Repository
+    do not see pending updates; the in-memory Entity is authoritative until
+    the buffer is flushed.
+
+    Flushes triggered from inside a running event loop are run on a single
+    background thread, so they never block the loop and are written in the
+    order they were taken.
+    """
+
+    _REMOVED = object()
+
+    def __init__(self, max_entities=500, max_delay=2.0):
+        self.max_entities = max_entities
+        self.max_delay = max_delay
+        self._pending = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flush_queued = False
+        self._flusher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='atlas-write-behind')
+        self.staged = 0
+        self.flushed = 0
+        self.flushes = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def stage(self, entity_id, updates=None, removals=()):
+        """
+        Merge attribute changes for an entity into the buffer, flushing if a
+        threshold is reached.
+
+        Args:
+            entity_id (str): The entity ID.
+            updates (dict, optional): Attributes to set.
+            removals (iterable): Attribute keys to delete.
+        """
+        with self._lock:
+            pending = self._pending.setdefault(entity_id, {})
+            pending.update(updates or {})
+            for key in removals:
+                pending[key] = self._REMOVED
+            self.staged += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            due = not self._flush_queued and (len(self._pending) >= self.max_entities
+                                              or time.monotonic() - self._oldest >= self.max_delay)
+            if due:
+                # Claimed under the lock, so concurrent stages queue one flush
+                self._flush_queued = True
+        if due:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+            else:
+                loop.run_in_executor(self._flusher, self._flush_logged)
+
+    def _flush_logged(self):
+        try:
+            return self.flush()
+        except Exception as e:
+            # The changes were put back; the next flush retries them.
+            logger.error(f"Background flush of attribute updates failed: {e}")
+            return 0
+
+    def flush(self):
+        """
+        Write all pending updates now. Concurrent flushes are serialised, so
+        batches reach the database in the order they were taken.
+
+        Returns:
+            int: The number of entities written.
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._oldest = None
+            self._flush_queued = False
+        if not pending:
+            return 0
+        updates, removals = {}, {}
+        for entity_id, changes in pending.items():
+            updates[entity_id] = {k: v for k, v in changes.items() if v is not self._REMOVED}
+            removals[entity_id] = [k for k, v in changes.items() if v is self._REMOVED]
+        try:
+            Repository().bulk_update_attributes(updates, removals)
+        except Exception:
+            # Put the changes back underneath anything staged since, so a
+            # later flush retries them without overwriting newer values.
+            with self._lock:
+                for entity_id, changes in pending.items():
+                    self._pending[entity_id] = {**changes, **self._pending.get(entity_id, {})}
+                self._oldest = self._oldest or time.monotonic()
+            raise
+        self.flushes += 1
+        self.flushed += len(pending)
+        logger.debug(f"Flushed attribute updates for {len(pending)} entities "
+                     f"({self.staged} staged updates so far, {self.flushed} entity writes).")
+        return len(pending)
+
+    async def drain(self):
+        """
+        Flush pending updates off the event loop thread and wait for the
+        write, and any background flush queued before it, to complete.
+        """
+        await asyncio.get_running_loop().run_in_executor(self._flusher, self.flush)
+
+    async def run(self):
+        """
+        Flush periodically, every ``max_delay`` seconds, until cancelled.
+        Pending updates are flushed on cancellation.
+        """
+        try:
+            while True:
+                await asyncio.sleep(self.max_delay)
+                try:
+                    await self.drain()
+                except Exception as e:
+                    logger.error(f"Periodic flush of attribute updates failed: {e}")
+        finally:
+            await self.drain()
+
 
-    def create_resource_handler(self, handler_type, config):
-        handler = ResourceHandlerModel(handler_type=handler_type, config=config)
-        handler.save()
-        return handler
\ No newline at end of file
+# Shared by all Repository instances in the process
+write_behind = WriteBehindBuffer()
@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+
+import aiohttp
+
+from ..utils.config import config
+
+logger = logging.getLogger(__name__)
+
+# Endpoint of the requests in a batch input file
+CHAT_COMPLETIONS_PATH = '/v1/chat/completions'
+
+
+class BatchEndpointError(Exception):
+    pass
+
+
+class BatchEndpoint(ABC):
+    """
+    A batch-style completion endpoint: a JSONL file of requests is
+    submitted at once and answered, at some point, with a JSONL file of
+    results.
+
+    Input lines have the form ``{"custom_id", "method", "url", "body"}``
+    and result lines ``{"custom_id", "response": {"status_code", "body"},
+    "error"}``, as in the OpenAI Batch API.
+    """
+
+    # Statuses after which a batch no longer changes
+    TERMINAL_STATUSES = frozenset({'completed', 'failed', 'expired', 'cancelled'})
+
+    @abstractmethod
+    async def submit(self, input_path: str) -> str:
+        """
+        Submit an input file.
+
+        Returns:
+            str: The batch ID.
+        """
+
+    @abstractmethod
+    async def status(self, batch_id: str) -> dict:
+        """
+        Returns:
+            dict: The batch, with at least a 'status'.
+        """
+
+    @abstractmethod
+    async def download(self, batch: dict, output_path: str) -> int:
+        """
+        Write the result lines of a finished batch (answers and errors) to
+        a file.
+
+        Args:
+            batch (dict): The batch as returned by status().
+            output_path (str): The file to write.
+
+        Returns:
+            int: The number of result lines.
+        """
+
+    async def close(self):
+        pass
+
+
+class OpenAIBatchEndpoint(BatchEndpoint):
+    """
+    The OpenAI Batch API: the input file is uploaded with purpose 'batch'
+    and answered within the completion window.
+    """
+
+    def __init__(self, api_key=None, api_base_url=None, completion_window='24h'):
+        self.api_key = api_key or config.OPENAI_API_KEY
+        self.api_base_url = (api_base_url or config.OPENAI_API_BASE_URL).rstrip('/')
+        self.completion_window = completion_window
+        self.session = aiohttp.ClientSession(headers={'Authorization': f'Bearer {self.api_key}'})
+
+    async def submit(self, input_path):
+        form = aiohttp.FormData()
+        form.add_field('purpose', 'batch')
+        with open(input_path, 'rb') as file:
+            form.add_field('file', file, filename=os.path.basename(input_path), content_type='application/jsonl')
+            async with self.session.post(f"{self.api_base_url}/files", data=form) as response:
+                response.raise_for_status()
+                uploaded = await response.json()
+        async with self.session.post(f"{self.api_base_url}/batches", json={
+            'input_file_id': uploaded['id'],
+            'endpoint': CHAT_COMPLETIONS_PATH,
+            'completion_window': self.completion_window,
+        }) as response:
+            response.raise_for_status()
+            batch = await response.json()
+        return batch['id']
+
+    async def status(self, batch_id):
+        async with self.session.get(f"{self.api_base_url}/batches/{batch_id}") as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def download(self, batch, output_path):
+        lines = 0
+        with open(output_path, 'wb') as output:
+            # Expired batches keep the results of the requests that finished
+            for file_id in (batch.get('output_file_id'), batch.get('error_file_id')):
+                if not file_id:
+                    continue
+                async with self.session.get(f"{self.api_base_url}/files/{file_id}/content") as response:
+                    response.raise_for_status()
+                    async for line in response.content:
+                        if line.strip():
+                            output.write(line if line.endswith(b'\n') else line + b'\n')
+                            lines += 1
+        return lines
+
+    async def close(self):
+        await self.session.close()
+
+
+class LocalBatchEndpoint(BatchEndpoint):
+    """
+    File-based stand-in for a batch endpoint, for tests and dry runs.
+
+    Batches are kept in ``directory`` (input, status and output files), so
+    they survive a restart of the submitting process like a remote batch.
+    A batch is answered on the first status check at least ``delay``
+    seconds after submission, by calling ``respond(body)`` for each request;
+    exceptions become error lines.
+
+    Args:
+        directory (str): Where batches are kept.
+        respond (callable, optional): Request body -> completion text.
+            Defaults to echoing the prompt.
+        delay (float): Seconds before a batch completes.
+    """
+
+    def __init__(self, directory, respond=None, delay=0.0):
+        self.directory = directory
+        self.respond = respond or (lambda body: f"Answer to: {body['messages'][-1]['content']}")
+        self.delay = delay
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, batch_id, suffix):
+        return os.path.join(self.directory, f"{batch_id}.{suffix}")
+
+    def _save(self, batch):
+        temporary = self._path(batch['id'], 'json.tmp')
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(batch, file)
+        os.replace(temporary, self._path(batch['id'], 'json'))
+
+    async def submit(self, input_path):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        shutil.copyfile(input_path, self._path(batch_id, 'input.jsonl'))
+        self._save({'id': batch_id, 'status': 'in_progress', 'created_at': time.time()})
+        return batch_id
+
+    async def status(self, batch_id):
+        try:
+            with open(self._path(batch_id, 'json'), encoding='utf-8') as file:
+                batch = json.load(file)
+        except FileNotFoundError:
+            raise BatchEndpointError(f"Unknown batch '{batch_id}'.")
+        if batch['status'] == 'in_progress' and time.time() - batch['created_at'] >= self.delay:
+            counts = await asyncio.get_running_loop().run_in_executor(None, self._answer, batch_id)
+            batch.update(status='completed', output_file=self._path(batch_id, 'output.jsonl'), request_counts=counts)
+            self._save(batch)
+        return batch
+
+    def _answer(self, batch_id):
+        counts = {'total': 0, 'completed': 0, 'failed': 0}
+        temporary = self._path(batch_id, 'output.jsonl.tmp')
+        with open(self._path(batch_id, 'input.jsonl'), encoding='utf-8') as requests, \
+                open(temporary, 'w', encoding='utf-8') as output:
+            for line in requests:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                counts['total'] += 1
+                result = {'id': f"response_{uuid.uuid4().hex}", 'custom_id': request['custom_id']}
+                try:
+                    text = self.respond(request['body'])
+                    result.update(response={'status_code': 200, 'body': {
+                        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}}],
+                    }}, error=None)
+                    counts['completed'] += 1
+                except Exception as e:
+                    result.update(response=None, error={'code': 'stand_in_error', 'message': str(e)})
+                    counts['failed'] += 1
+                output.write(json.dumps(result) + '\n')
+        os.replace(temporary, self._path(batch_id, 'output.jsonl'))
+        return counts
+
+    async def download(self, batch, output_path):
+        shutil.copyfile(batch['output_file'], output_path)
+        with open(output_path, encoding='utf-8') as file:
+            return sum(1 for line in file if line.strip())
+
+
+def result_text(result):
+    """
+    The completion text of a batch result line.
+
+    Args:
+        result (dict): A decoded result line.
+
+    Returns:
+        str or None: The text, or None if the request failed.
+    """
+    response = result.get('response') or {}
+    if result.get('error') or response.get('status_code') != 200:
+        return None
+    try:
+        return response['body']['choices'][0]['message']['content'].strip()
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return None
@@ -1,6 +1,5 @@
 from abc import ABC, abstractmethod
 from ..data.repository import Repository
-from ..data.models import ResourceHandlerModel
 from typing import Any, Optional
 
 class LLMHandler(ABC):
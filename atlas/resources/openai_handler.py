@@ -2,37 +2,58 @@ import aiohttp
 import asyncio
 import logging
 import json
-from typing import Any, Dict, Optional
-from .llm_handler import LLMHandler
-from atlas.utils.config import config
-from atlas.core.entity import Entity
-from atlas.core.iquery import iQuery
+import random
+import time
+from contextlib import aclosing
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, Optional
 from .llm_handler import LLMHandler
 from .response_processor import ResponseProcessor
-
-logger = logging.getLogger(__name__)
-
-from .llm_handler import LLMHandler
-from ..data.models import ResourceHandlerModel
+from .response_cache import get_response_cache, request_key
+from .single_flight import SingleFlight
+from .rate_limiter import get_rate_limiter, parse_retry_after
+from .streaming import StreamMetrics, event_text, parse_sse_line
+from .batch_endpoint import CHAT_COMPLETIONS_PATH
 from ..utils.config import config
 from ..data.repository import Repository
 
+if TYPE_CHECKING:
+    from ..core.entity import Entity
+    from ..core.iquery import iQuery
+
+logger = logging.getLogger(__name__)
+
 class OpenAIGPTHandler(LLMHandler):
-    def __init__(self):
-        super().__init__(handler_type='OpenAI', config={'model': config.OPENAI_MODEL})
-        self.api_key = config.OPENAI_API_KEY
-        self.api_base_url = config.OPENAI_API_BASE_URL
-        self.model_name = config.OPENAI_MODEL  # Keep the model name string
+    # Statuses that signal overload: retried, and lower the concurrency limit
+    OVERLOAD_STATUSES = (429, 500, 502, 503, 504)
+    # Streams may run longer than a plain request; only gaps between chunks are limited
+    STREAM_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=15)
+
+    def __init__(self, api_key=None, api_base_url=None, model=None):
+        """
+        Args:
+            api_key, api_base_url, model (str, optional): Override the
+                OPENAI_API_KEY, OPENAI_API_BASE_URL and OPENAI_MODEL settings,
+                e.g. to point the handler at a local stand-in server.
+        """
+        model = model or config.OPENAI_MODEL
+        super().__init__(handler_type='OpenAI', config={'model': model})
+        self.api_key = api_key or config.OPENAI_API_KEY
+        self.api_base_url = (api_base_url or config.OPENAI_API_BASE_URL).rstrip('/')
+        self.model_name = model  # Keep the model name string
         self.session = aiohttp.ClientSession()
-        self.semaphore = asyncio.Semaphore(5)
+        # Shared by all handlers with the same credentials
+        self.rate_limiter = get_rate_limiter(self.api_base_url, self.api_key)
         self.response_processor = ResponseProcessor()
+        self.response_cache = get_response_cache()
+        self.single_flight = SingleFlight()
+        self.stream_metrics = StreamMetrics()
         self._persist_handler()
 
     def _persist_handler(self):
         repository = Repository()
         existing_handler = repository.get_resource_handler_by_type('OpenAI')
         if existing_handler:
-            self.resource_handler_model = existing_handler  # Store the ResourceHandlerModel instance
+            self.resource_handler_model = existing_handler  # Store the resource handler record
         else:
             self.resource_handler_model = repository.create_resource_handler('OpenAI', {'model': self.model_name})
 
@@ -41,7 +62,64 @@ class OpenAIGPTHandler(LLMHandler):
     async def execute(self, prompt: str, **kwargs) -> Optional[Dict[str, Any]]:
         """
         Asynchronously sends the prompt to OpenAI's API and returns the processed response.
+
+        With ``stream=True`` the completion is streamed and ``on_partial``,
+        if given, is called with the text received so far after each chunk.
+        """
+        url, headers, payload = self._request(prompt, kwargs)
+        stream = kwargs.get('stream', False)
+        on_partial = kwargs.get('on_partial') if stream else None
+
+        # Identical requests are answered from the response cache, and joined
+        # while in flight, unless the caller opts out (cache=False), e.g. for
+        # non-deterministic prompts
+        max_retries = kwargs.get('max_retries', 3)
+        backoff_factor = kwargs.get('backoff_factor', 0.5)
+        if not kwargs.get('cache', True):
+            return await self._send(url, headers, payload, None, max_retries, backoff_factor, stream, on_partial)
+        key = request_key(payload)
+        if self.response_cache is not None:
+            cached = await self.response_cache.get_async(key)
+            if cached is not None:
+                logger.debug("Answered from the response cache.")
+                return await self.response_processor.process_async(cached)
+        if on_partial is not None:
+            # A caller joining the shared call would not receive partial values
+            # of its own, so streams that report them are not coalesced
+            return await self._send(url, headers, payload, key, max_retries, backoff_factor, stream, on_partial)
+        return await self.single_flight.do(
+            key, lambda: self._send(url, headers, payload, key, max_retries, backoff_factor, stream, on_partial)
+        )
+
+    async def stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
         """
+        Streams the completion of a prompt.
+
+        Yields:
+            str: Pieces of the completion text as they arrive.
+        """
+        url, headers, payload = self._request(prompt, kwargs)
+        try:
+            async with self.rate_limiter.slot(self.estimate_tokens(payload)):
+                async with aclosing(self._deltas(url, headers, payload, {})) as deltas:
+                    async for delta in deltas:
+                        yield delta
+        except aiohttp.ClientResponseError as e:
+            if e.status in self.OVERLOAD_STATUSES:
+                self.rate_limiter.record_overload(
+                    parse_retry_after(e.headers.get('Retry-After') if e.headers else None)
+                )
+            raise
+
+    def batch_request(self, prompt: str, custom_id: str, **kwargs) -> Dict[str, Any]:
+        """
+        The line of a batch input file that requests the completion of a
+        prompt (see atlas.resources.batch_endpoint).
+        """
+        _, _, payload = self._request(prompt, kwargs)
+        return {'custom_id': custom_id, 'method': 'POST', 'url': CHAT_COMPLETIONS_PATH, 'body': payload}
+
+    def _request(self, prompt, kwargs):
         url = f"{self.api_base_url}/chat/completions"
         headers = {
             'Authorization': f'Bearer {self.api_key}',
@@ -55,44 +133,123 @@ class OpenAIGPTHandler(LLMHandler):
             'n': 1,
             'stop': kwargs.get('stop', None),
         }
+        return url, headers, payload
 
-        max_retries = kwargs.get('max_retries', 3)
-        backoff_factor = kwargs.get('backoff_factor', 0.5)
+    async def _send(self, url, headers, payload, cache_key, max_retries, backoff_factor, stream=False,
+                    on_partial=None):
         logger.debug(f"Starting request with max_retries={max_retries}, backoff_factor={backoff_factor}")
+        estimated_tokens = self.estimate_tokens(payload)
         for attempt in range(max_retries):
-            async with self.semaphore:
-                try:
+            try:
+                async with self.rate_limiter.slot(estimated_tokens):
                     logger.debug(f"Attempt {attempt + 1}: Sending request to {url}")
                     logger.debug(f"Payload: {json.dumps(payload, indent=2)}")
-                    logger.debug(f"Headers: {json.dumps(headers, indent=2)}")
-                    async with self.session.post(url, json=payload, headers=headers, timeout=15) as response:
-                        response.raise_for_status()
-                        data = await response.json()
-                        logger.debug(f"Received response: {json.dumps(data, indent=2)}")
-                        text_response = data['choices'][0]['message']['content'].strip()
-                        processed_data = self.process_response(text_response)
-                        logger.debug(f"Processed data: {json.dumps(processed_data, indent=2)}")
-                        return processed_data  # Return processed data (dictionary)
-                except aiohttp.ClientResponseError as e:
-                    if e.status in [429, 500, 502, 503, 504]:
-                        delay = backoff_factor * (2 ** attempt) + random.uniform(0, 0.1)
-                        logger.warning(f"Retrying after {delay:.2f} seconds due to {e.status} error")
-                        await asyncio.sleep(delay)
+                    started = time.monotonic()
+                    if stream:
+                        text_response, usage = await self._complete_streaming(url, headers, payload, on_partial)
                     else:
-                        logger.error(f"Non-retriable HTTP error: {e}")
-                        break
-                except json.JSONDecodeError as e:
-                    logger.error(f"JSON decode error: {e}")
-                    logger.debug(f"Raw response: {await response.text()}")
-                    break
-                except Exception as e:
-                    logger.exception(f"Unexpected error during LLM request: {e}")
-                    break
+                        text_response, usage = await self._complete(url, headers, payload)
+                    latency = time.monotonic() - started
+            except aiohttp.ClientResponseError as e:
+                if e.status in self.OVERLOAD_STATUSES:
+                    retry_after = parse_retry_after(e.headers.get('Retry-After') if e.headers else None)
+                    self.rate_limiter.record_overload(retry_after)
+                    delay = retry_after
+                    if delay is None:
+                        delay = backoff_factor * (2 ** attempt) + random.uniform(0, 0.1)
+                    logger.warning(f"Retrying after {delay:.2f} seconds due to {e.status} error")
+                    await asyncio.sleep(delay)
+                    continue
+                logger.error(f"Non-retriable HTTP error: {e}")
+                break
+            except json.JSONDecodeError as e:
+                logger.error(f"JSON decode error: {e}")
+                break
+            except Exception as e:
+                logger.exception(f"Unexpected error during LLM request: {e}")
+                break
+            self.rate_limiter.record_success(estimated_tokens, usage.get('total_tokens'), latency)
+            processed_data = await self.response_processor.process_async(text_response)
+            if cache_key is not None and self.response_cache is not None and processed_data is not None:
+                await self.response_cache.put_async(cache_key, text_response)
+            logger.debug(f"Processed data: {json.dumps(processed_data, indent=2)}")
+            return processed_data  # Return processed data (dictionary)
         logger.error("All attempts failed")
         return None
 
+    async def _complete(self, url, headers, payload):
+        async with self.session.post(url, json=payload, headers=headers, timeout=15) as response:
+            response.raise_for_status()
+            data = await response.json()
+        logger.debug(f"Received response: {json.dumps(data, indent=2)}")
+        return data['choices'][0]['message']['content'].strip(), data.get('usage') or {}
+
+    async def _complete_streaming(self, url, headers, payload, on_partial=None):
+        usage = {}
+        text = ''
+        async with aclosing(self._deltas(url, headers, payload, usage)) as deltas:
+            async for delta in deltas:
+                text += delta
+                if on_partial is not None:
+                    on_partial(text)
+        logger.debug(f"Received streamed response: {text!r}")
+        return text.strip(), usage
 
-    def build_prompt(self, entity: Entity, iquery: iQuery) -> str:
+    async def _deltas(self, url, headers, payload, usage):
+        """
+        Send a streaming request and yield the content of its events.
+
+        If the consumer stops early (e.g. it is cancelled at its deadline)
+        the connection is closed rather than drained, so the server stops
+        generating output nobody reads. Reported usage is stored in ``usage``.
+        """
+        payload = {**payload, 'stream': True, 'stream_options': {'include_usage': True}}
+        started = time.monotonic()
+        first_token = last_token = None
+        tokens = 0
+        completed = False
+        response = await self.session.post(url, json=payload, headers=headers, timeout=self.STREAM_TIMEOUT)
+        try:
+            response.raise_for_status()
+            async for line in response.content:
+                event = parse_sse_line(line)
+                if event is None:
+                    continue
+                if event == '[DONE]':
+                    break
+                usage.update(event.get('usage') or {})
+                delta = event_text(event)
+                if delta:
+                    last_token = time.monotonic()
+                    if first_token is None:
+                        first_token = last_token
+                    tokens += 1
+                    yield delta
+            completed = True
+        finally:
+            if completed:
+                response.release()
+            else:
+                response.close()
+            if usage.get('completion_tokens'):
+                tokens = usage['completion_tokens']
+            self.stream_metrics.record(
+                None if first_token is None else first_token - started,
+                tokens,
+                0.0 if first_token is None else last_token - first_token,
+                completed,
+            )
+
+    @staticmethod
+    def estimate_tokens(payload):
+        """
+        Tokens a request is expected to use: ~4 characters per prompt token
+        plus the completion limit. Corrected by the reported usage.
+        """
+        prompt = sum(len(message['content']) for message in payload['messages'])
+        return prompt // 4 + (payload.get('max_tokens') or 0)
+
+    def build_prompt(self, entity: 'Entity', iquery: 'iQuery') -> str:
         """
         Constructs the prompt based on the entity's attributes and the iQuery's parameters.
         """
@@ -109,11 +266,10 @@ class OpenAIGPTHandler(LLMHandler):
         """
         Processes and validates the LLM response.
         """
-        if self.response_processor.validate_response(response):
-            return self.response_processor.extract_information(response)
-        else:
+        processed = self.response_processor.process(response)
+        if processed is None:
             logger.warning("Invalid response received from LLM.")
-            return None
+        return processed
 
     async def close(self):
         await self.session.close()
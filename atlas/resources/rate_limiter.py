@@ -0,0 +1,227 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+from ..utils.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class PerLoop:
+    """
+    One asyncio primitive per event loop, created on first use.
+
+    asyncio locks and conditions bind to the loop they are first used on,
+    but limiters are shared process-wide and outlive loops, e.g. successive
+    asyncio.run calls or the loop of a forked shard worker.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instances = {}
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        instance = self._instances.get(loop)
+        if instance is None:
+            # The primitives refer to their loops, so drop those of closed ones
+            self._instances = {known: value for known, value in self._instances.items() if not known.is_closed()}
+            instance = self._instances[loop] = self._factory()
+        return instance
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at ``rate_per_minute``, holding at
+    most ``capacity`` (by default one minute's worth).
+
+    A rate of 0 disables the bucket.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.available = float(self.capacity)
+        self._updated = time.monotonic()
+        self._locks = PerLoop(asyncio.Lock)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount=1):
+        """
+        Wait until ``amount`` is available and take it. Requests larger than
+        the capacity wait for a full bucket. Waiters are served in order.
+        """
+        if not self.rate:
+            return
+        amount = min(amount, self.capacity)
+        async with self._locks.get():
+            self._refill()
+            while self.available < amount:
+                await asyncio.sleep((amount - self.available) / self.rate)
+                self._refill()
+            self.available -= amount
+
+    def adjust(self, amount):
+        """
+        Return (positive) or take (negative) ``amount``, e.g. the difference
+        between the estimated and the reported usage of a request.
+        """
+        if not self.rate:
+            return
+        self._refill()
+        self.available = min(self.capacity, self.available + amount)
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit adjusted by additive increase / multiplicative
+    decrease (AIMD).
+
+    Every successful call raises the limit by ``increase / limit`` (about
+    ``increase`` per round of ``limit`` calls); an overload signal (429,
+    5xx) multiplies it by ``decrease``. Overloads within one round trip
+    (the smoothed latency of successful calls) of the last decrease are
+    treated as the same event, so a burst of failing concurrent calls
+    shrinks the limit once.
+    """
+
+    def __init__(self, initial=5, minimum=1, maximum=32, increase=1.0, decrease=0.5):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.increase = increase
+        self.decrease = decrease
+        self.latency = 1.0
+        self.in_flight = 0
+        self._last_decrease = float('-inf')
+        self._conditions = PerLoop(asyncio.Condition)
+
+    async def acquire(self):
+        condition = self._conditions.get()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        condition = self._conditions.get()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    def on_success(self, latency=None):
+        if latency is not None:
+            self.latency = 0.8 * self.latency + 0.2 * latency
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def on_overload(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency:
+            return
+        self._last_decrease = now
+        previous = self.limit
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        logger.debug(f"Concurrency limit lowered from {previous:.1f} to {self.limit:.1f} after an overload.")
+
+
+class RateLimiter:
+    """
+    Admission control for one set of API credentials: request and token
+    buckets for the provider's per-minute limits, an adaptive concurrency
+    limit, and a shared pause honouring Retry-After.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, initial_concurrency=None,
+                 min_concurrency=None, max_concurrency=None):
+        self.requests = TokenBucket(
+            config.OPENAI_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+        )
+        self.tokens = TokenBucket(
+            config.OPENAI_TOKENS_PER_MINUTE if tokens_per_minute is None else tokens_per_minute
+        )
+        self.concurrency = AdaptiveConcurrency(
+            initial=initial_concurrency or config.OPENAI_INITIAL_CONCURRENCY,
+            minimum=min_concurrency or config.OPENAI_MIN_CONCURRENCY,
+            maximum=max_concurrency or config.OPENAI_MAX_CONCURRENCY,
+        )
+        self._paused_until = 0.0
+        self.overloads = 0
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens=0):
+        """
+        Wait for any Retry-After pause, a concurrency slot and budget in both
+        buckets, then hold the slot for the duration of the request.
+        """
+        while (delay := self._paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        await self.concurrency.acquire()
+        try:
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+            yield
+        finally:
+            await self.concurrency.release()
+
+    def record_success(self, estimated_tokens=0, used_tokens=None, latency=None):
+        self.concurrency.on_success(latency)
+        if used_tokens is not None:
+            self.tokens.adjust(estimated_tokens - used_tokens)
+
+    def record_overload(self, retry_after=None):
+        """
+        Lower the concurrency limit and, given a Retry-After delay in
+        seconds, hold back every request using these credentials until it
+        has passed.
+        """
+        self.overloads += 1
+        self.concurrency.on_overload()
+        if retry_after:
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        return {
+            'concurrency_limit': self.concurrency.limit,
+            'in_flight': self.concurrency.in_flight,
+            'overloads': self.overloads,
+        }
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait according to a Retry-After header (delay in seconds or
+    an HTTP date), or None if absent or unparseable.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(base_url, api_key):
+    """
+    The RateLimiter shared by all handlers using the same endpoint and API
+    key (limits are enforced per key by the provider).
+    """
+    key = hashlib.sha256(f'{base_url}\0{api_key}'.encode('utf-8')).hexdigest()
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter()
+        return _limiters[key]
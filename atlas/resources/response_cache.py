@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
+
+from ..utils.config import config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def request_key(payload):
+    """
+    Content address of an LLM request: the SHA-256 of its canonical JSON.
+
+    Args:
+        payload (dict): The request body (model, messages, temperature, ...).
+
+    Returns:
+        str: The hex digest.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of LLM responses keyed by request_key().
+
+    An in-memory LRU of ``memory_size`` entries sits in front of a SQLite
+    table at ``path`` that survives restarts. Entries expire ``ttl``
+    seconds after they were stored; the disk tier keeps at most
+    ``max_entries`` entries and drops the least recently used ones beyond
+    that. An empty ``path`` keeps the memory tier only.
+
+    On the event loop use get_async and put_async: they check and fill the
+    memory tier inline and run SQLite I/O in a thread of the cache's own.
+    """
+
+    # Size-based eviction of the disk tier runs every this many stores
+    PRUNE_EVERY = 100
+
+    def __init__(self, path=None, memory_size=None, ttl=None, max_entries=None):
+        self.path = config.ATLAS_RESPONSE_CACHE_PATH if path is None else path
+        self.ttl = ttl or config.ATLAS_RESPONSE_CACHE_TTL
+        self.max_entries = max_entries or config.ATLAS_RESPONSE_CACHE_MAX_ENTRIES
+        self._memory = TTLCache(maxsize=memory_size or config.ATLAS_RESPONSE_CACHE_SIZE, ttl=self.ttl)
+        self._lock = threading.RLock()
+        self._connection = None
+        self._executor = None
+        if self.path:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            if self.path != ':memory:':
+                self._connection.execute('PRAGMA journal_mode=WAL')
+                self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(SCHEMA)
+        self._stores = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """
+        Returns:
+            str or None: The cached response, or None on a miss.
+        """
+        response = self._get_memory(key)
+        if response is None:
+            response = self._get_disk(key)
+        return response
+
+    async def get_async(self, key):
+        """
+        Like get, but looks up the disk tier off the event loop.
+        """
+        response = self._get_memory(key)
+        if response is not None:
+            return response
+        if self._connection is None:
+            return self._get_disk(key)  # Only counts the miss
+        return await asyncio.get_running_loop().run_in_executor(self._disk_executor(), self._get_disk, key)
+
+    def put(self, key, response):
+        with self._lock:
+            self._memory[key] = response
+        self._put_disk(key, response)
+
+    async def put_async(self, key, response):
+        """
+        Like put, but writes the disk tier off the event loop.
+        """
+        with self._lock:
+            self._memory[key] = response
+        if self._connection is not None:
+            await asyncio.get_running_loop().run_in_executor(self._disk_executor(), self._put_disk, key, response)
+
+    def _get_memory(self, key):
+        with self._lock:
+            response = self._memory.get(key)
+            if response is not None:
+                self.memory_hits += 1
+            return response
+
+    def _get_disk(self, key):
+        with self._lock:
+            if self._connection is not None:
+                now = time.time()
+                row = self._connection.execute(
+                    'SELECT response FROM responses WHERE key = ? AND created > ?', (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+                    self._memory[key] = row[0]
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def _put_disk(self, key, response):
+        with self._lock:
+            if self._connection is None:
+                return
+            now = time.time()
+            self._connection.execute(
+                'INSERT INTO responses (key, response, created, accessed) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET response = excluded.response, '
+                'created = excluded.created, accessed = excluded.accessed',
+                (key, response, now, now),
+            )
+            self._stores += 1
+            if self._stores % self.PRUNE_EVERY == 0:
+                self.prune()
+
+    def _disk_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='atlas-response-cache')
+            return self._executor
+
+    def prune(self):
+        """
+        Delete expired entries and the least recently used entries beyond
+        ``max_entries`` from the disk tier.
+
+        Returns:
+            int: The number of entries deleted.
+        """
+        if self._connection is None:
+            return 0
+        with self._lock:
+            expired = self._connection.execute(
+                'DELETE FROM responses WHERE created <= ?', (time.time() - self.ttl,)
+            ).rowcount
+            evicted = self._connection.execute(
+                'DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,)
+            ).rowcount
+            self.evictions += expired + evicted
+            return expired + evicted
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._connection is not None:
+                self._connection.execute('DELETE FROM responses')
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hits per tier, misses, disk evictions and the hit rate.
+        """
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_size': len(self._memory),
+            }
+
+    def close(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)  # Finish queued writes; they take the lock
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    The process-wide ResponseCache, created on first use, or None if
+    ATLAS_RESPONSE_CACHE is disabled.
+    """
+    global _cache
+    if not config.ATLAS_RESPONSE_CACHE:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+        return _cache
@@ -1,19 +1,194 @@
-import spacy
-from typing import Dict, Any
+import asyncio
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Any, Optional
+
+from ..utils.config import config
+
+logger = logging.getLogger(__name__)
+
+SPACY_MODEL = 'en_core_web_sm'
+SPACY_LANGUAGE = 'en'  # Language of SPACY_MODEL, for a tokenizer-only pipeline
+# Pipeline components the processing needs. Validation and extraction only
+# look at tokens, so the tagger, parser, NER etc. are not loaded; add names
+# here when extraction starts using their annotations.
+COMPONENTS = ()
+
+_nlp = None
+_nlp_lock = threading.Lock()
+
+
+def get_nlp():
+    """
+    The spaCy pipeline shared by all ResponseProcessors in the process,
+    loaded on first use with only COMPONENTS. The other components of
+    SPACY_MODEL are excluded rather than disabled, so they are not loaded at
+    all; without COMPONENTS only the tokenizer of a blank pipeline is used.
+    """
+    global _nlp
+    if _nlp is None:
+        with _nlp_lock:
+            if _nlp is None:
+                import spacy
+                if not COMPONENTS:
+                    _nlp = spacy.blank(SPACY_LANGUAGE)
+                else:
+                    meta = spacy.util.get_model_meta(spacy.util.get_package_path(SPACY_MODEL))
+                    excluded = [name for name in meta['components'] if name not in COMPONENTS]
+                    _nlp = spacy.load(SPACY_MODEL, exclude=excluded)
+    return _nlp
+
+
+def analyze(doc) -> Optional[Dict[str, Any]]:
+    """
+    Validate a parsed response and extract its information.
+
+    Args:
+        doc (spacy.tokens.Doc): The parsed response.
+
+    Returns:
+        dict or None: The extracted information, or None if invalid.
+    """
+    # Check for specific entities or linguistic features
+    if len(doc) == 0:
+        return None
+    # Extract relevant information from the response
+    # Implement custom logic as needed
+    return {"text": doc.text}
+
+
+def process_batch(texts, batch_size):
+    """
+    Parse responses with one nlp.pipe pass and analyze them. Module-level so
+    that it can run in a worker process.
+
+    Returns:
+        list: The result of analyze() for each text, in order.
+    """
+    return [analyze(doc) for doc in get_nlp().pipe(texts, batch_size=batch_size)]
+
 
 class ResponseProcessor:
-    def __init__(self):
-        self.nlp = spacy.load('en_core_web_sm')
+    @property
+    def nlp(self):
+        return get_nlp()
+
+    def process(self, response: str) -> Optional[Dict[str, Any]]:
+        """
+        Parse a response once, validate it and extract its information.
+
+        Returns:
+            dict or None: The extracted information, or None if invalid.
+        """
+        return analyze(self.nlp(response))
+
+    async def process_async(self, response: str) -> Optional[Dict[str, Any]]:
+        """
+        Like process, but batched with other responses and run off the event
+        loop thread. See ResponseBatcher.
+        """
+        return await get_batcher().submit(response)
 
     def validate_response(self, response: str) -> bool:
-        doc = self.nlp(response)
-        # Check for specific entities or linguistic features
-        if len(doc) > 0:
-            return True
-        return False
+        return self.process(response) is not None
 
     def extract_information(self, response: str) -> Dict[str, Any]:
-        doc = self.nlp(response)
-        # Extract relevant information from the response
-        # Implement custom logic as needed
-        return {"text": response}
+        return self.process(response)
+
+
+class _Batch:
+    __slots__ = ('pending', 'timer')
+
+    def __init__(self):
+        self.pending = []  # (text, future) pairs
+        self.timer = None
+
+
+class ResponseBatcher:
+    """
+    Accumulates responses from concurrent iQueries and parses them together
+    with nlp.pipe, which is much cheaper per text than one call per response.
+
+    A batch is dispatched when ``batch_size`` responses are waiting or
+    ``max_delay`` seconds after the first one arrived. Batches run in a
+    thread, or in a pool of ``processes`` worker processes (each loading its
+    own pipeline) so that parsing does not compete with the event loop for
+    the GIL. Callers await a future that resolves to their own result.
+
+    The batcher is process-wide, so responses are batched per event loop:
+    futures and timers belong to the loop that created them.
+    """
+
+    def __init__(self, batch_size=None, max_delay=None, processes=None):
+        self.batch_size = batch_size or config.ATLAS_NLP_BATCH_SIZE
+        self.max_delay = config.ATLAS_NLP_MAX_DELAY if max_delay is None else max_delay
+        processes = config.ATLAS_NLP_PROCESSES if processes is None else processes
+        if processes:
+            self.executor = ProcessPoolExecutor(max_workers=processes)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='atlas-nlp')
+        self._batches = {}  # Event loop -> _Batch
+
+    async def submit(self, text):
+        """
+        Queue a response for the next batch.
+
+        Returns:
+            dict or None: The result of analyze() for the response.
+        """
+        loop = asyncio.get_running_loop()
+        queued = self._batches.get(loop)
+        if queued is None:
+            # Responses left by closed loops can no longer be delivered
+            self._batches = {known: value for known, value in self._batches.items() if not known.is_closed()}
+            queued = self._batches[loop] = _Batch()
+        future = loop.create_future()
+        queued.pending.append((text, future))
+        if len(queued.pending) >= self.batch_size:
+            self._dispatch(queued)
+        elif queued.timer is None:
+            queued.timer = loop.call_later(self.max_delay, self._dispatch, queued)
+        return await future
+
+    def _dispatch(self, queued):
+        if queued.timer is not None:
+            queued.timer.cancel()
+            queued.timer = None
+        batch, queued.pending = queued.pending, []
+        if not batch:
+            return
+        texts = [text for text, _ in batch]
+        task = asyncio.get_running_loop().run_in_executor(self.executor, process_batch, texts, self.batch_size)
+        task.add_done_callback(lambda done: self._resolve(batch, done))
+
+    def _resolve(self, batch, done):
+        if done.cancelled():
+            for _, future in batch:
+                future.cancel()
+            return
+        if done.exception() is not None:
+            logger.error(f"Processing a batch of {len(batch)} responses failed: {done.exception()}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(done.exception())
+            return
+        for (_, future), result in zip(batch, done.result()):
+            if not future.done():
+                future.set_result(result)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+_batcher = None
+
+
+def get_batcher():
+    """
+    The process-wide ResponseBatcher, created on first use.
+    """
+    global _batcher
+    if _batcher is None:
+        _batcher = ResponseBatcher()
+    return _batcher
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key starts the work as a task; callers arriving
+    while it runs await the same task instead of starting their own, so
+    duplicates take no concurrency slot or API quota. All callers receive
+    the result or the exception of the shared call. A caller that is
+    cancelled only stops waiting; the shared call is cancelled once every
+    caller waiting for it has been cancelled.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._calls)
+
+    async def do(self, key, function):
+        """
+        Run ``function()`` for ``key``, or join the call already in flight.
+
+        Args:
+            key (hashable): Identifies equivalent calls, e.g. request_key().
+            function (callable): Returns the awaitable to run.
+
+        Returns:
+            The result of the shared call.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = self._calls[key] = _Call(asyncio.ensure_future(function()))
+            call.task.add_done_callback(lambda task: self._finished(key, call))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+            logger.debug(f"Joined an identical call in flight ({call.waiters} waiting).")
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _finished(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled():
+            # Retrieve the exception so that it is not reported as unhandled
+            # when every caller was cancelled before the call failed
+            call.task.exception()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Calls executed, calls that joined one in flight, and the
+            number in flight now.
+        """
+        return {'executions': self.executions, 'coalesced': self.coalesced, 'in_flight': len(self._calls)}
@@ -0,0 +1,93 @@
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def parse_sse_line(line):
+    """
+    Decode one line of a chat completions event stream.
+
+    Args:
+        line (bytes): A raw line, e.g. b'data: {...}'.
+
+    Returns:
+        dict, str or None: The decoded event, '[DONE]' at the end of the
+        stream, or None for comments, keep-alives and non-data fields.
+    """
+    line = line.strip()
+    if not line.startswith(b'data:'):
+        return None
+    data = line[len(b'data:'):].strip()
+    if data == b'[DONE]':
+        return '[DONE]'
+    try:
+        return json.loads(data)
+    except json.JSONDecodeError:
+        logger.warning(f"Skipping malformed stream event: {data[:100]!r}")
+        return None
+
+
+def event_text(event):
+    """
+    The text added by a streamed chat completion chunk.
+    """
+    return ''.join((choice.get('delta') or {}).get('content') or '' for choice in event.get('choices') or [])
+
+
+class StreamMetrics:
+    """
+    Time-to-first-token and throughput of streamed completions.
+
+    Counts one token per content chunk unless the stream reports usage.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.streams = 0
+        self.cancelled = 0
+        self.first_tokens = 0  # Streams that produced a first token
+        self.tokens = 0
+        self.first_token_seconds = 0.0
+        self.generation_seconds = 0.0
+        self.last = {}
+
+    def record(self, first_token_seconds, tokens, generation_seconds, completed=True):
+        """
+        Args:
+            first_token_seconds (float or None): Request start to first token.
+            tokens (int): Tokens received.
+            generation_seconds (float): First token to last token.
+            completed (bool): False if the stream was abandoned early.
+        """
+        with self._lock:
+            self.streams += 1
+            self.cancelled += not completed
+            self.tokens += tokens
+            if first_token_seconds is not None:
+                self.first_tokens += 1
+                self.first_token_seconds += first_token_seconds
+                self.generation_seconds += generation_seconds
+            self.last = {
+                'ttft': first_token_seconds,
+                'tokens': tokens,
+                'tokens_per_second': tokens / generation_seconds if generation_seconds else None,
+                'completed': completed,
+            }
+
+    def stats(self):
+        """
+        Returns:
+            dict: Stream counts, mean time-to-first-token of the streams that
+            produced one, overall tokens per
+            second while generating, and the metrics of the last stream.
+        """
+        with self._lock:
+            return {
+                'streams': self.streams,
+                'cancelled': self.cancelled,
+                'mean_ttft': self.first_token_seconds / self.first_tokens if self.first_tokens else None,
+                'tokens_per_second': self.tokens / self.generation_seconds if self.generation_seconds else None,
+                'last': dict(self.last),
+            }
@@ -1,10 +1,22 @@
-# atlas/utils/circuit_breaker.py
+# atlas/utils/circuitbreaker.py
 
 import time
 import logging
+import threading
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+
+from .config import config
 
 logger = logging.getLogger(__name__)
 
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a backend whose circuit is open."""
+    pass
+
+
 class CircuitBreaker:
     def __init__(self, max_failures=5, reset_timeout=60):
         self.max_failures = max_failures
@@ -18,7 +30,7 @@ class CircuitBreaker:
             if time.time() - self.last_failure_time > self.reset_timeout:
                 self.state = 'HALF_OPEN'
             else:
-                raise Exception("Circuit is open")
+                raise CircuitOpenError("Circuit is open")
 
         try:
             result = func(*args, **kwargs)
@@ -39,3 +51,199 @@ class CircuitBreaker:
         if self.failure_count >= self.max_failures:
             self.state = 'OPEN'
             logger.warning("Circuit breaker opened")
+
+
+class Attempt:
+    """
+    One call admitted by an AsyncCircuitBreaker. Calls count as successful
+    unless they raise or ``failed()`` is called, e.g. for a handler that
+    reports errors by returning None.
+    """
+
+    def __init__(self):
+        self.ok = True
+
+    def failed(self):
+        self.ok = False
+
+
+class AsyncCircuitBreaker:
+    """
+    Circuit breaker for coroutines, shared by all callers of one backend.
+
+    While CLOSED, the outcomes of calls are counted in a rolling window of
+    ``window`` seconds (in one-second buckets). Once the window holds at
+    least ``min_calls`` calls, the circuit OPENs if the share of failures
+    reaches ``failure_rate``, or the share of calls slower than
+    ``slow_call_seconds`` reaches ``slow_call_rate``: a backend that still
+    answers, but too slowly, is tripped as well.
+
+    An OPEN circuit rejects calls immediately with CircuitOpenError. After
+    ``reset_timeout`` seconds it turns HALF_OPEN and admits at most
+    ``half_open_calls`` concurrent probes. It closes once that many probes
+    have succeeded in time, and opens again on the first one that fails or
+    is slow. Cancelled calls count as neither success nor failure.
+
+    State is only touched from the event loop, between awaits, so no lock
+    is needed.
+    """
+
+    CLOSED = 'CLOSED'
+    OPEN = 'OPEN'
+    HALF_OPEN = 'HALF_OPEN'
+
+    def __init__(self, name='', window=None, min_calls=None, failure_rate=None, slow_call_seconds=None,
+                 slow_call_rate=None, reset_timeout=None, half_open_calls=None):
+        self.name = name
+        self.window = config.ATLAS_BREAKER_WINDOW if window is None else window
+        self.min_calls = config.ATLAS_BREAKER_MIN_CALLS if min_calls is None else min_calls
+        self.failure_rate = config.ATLAS_BREAKER_FAILURE_RATE if failure_rate is None else failure_rate
+        self.slow_call_seconds = (config.ATLAS_BREAKER_SLOW_CALL_SECONDS
+                                  if slow_call_seconds is None else slow_call_seconds)
+        self.slow_call_rate = config.ATLAS_BREAKER_SLOW_CALL_RATE if slow_call_rate is None else slow_call_rate
+        self.reset_timeout = config.ATLAS_BREAKER_RESET_TIMEOUT if reset_timeout is None else reset_timeout
+        self.half_open_calls = max(1, config.ATLAS_BREAKER_HALF_OPEN_CALLS
+                                   if half_open_calls is None else half_open_calls)
+        self.state = self.CLOSED
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        # [second, calls, failures, slow calls] per second of the window, plus totals
+        self._buckets = deque()
+        self._calls = self._failures = self._slow = 0
+
+    def allows(self):
+        """
+        Whether a call would be admitted now. Does not reserve a probe.
+        """
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+        if self.state == self.OPEN:
+            return False
+        return self.state == self.CLOSED or self._probes < self.half_open_calls
+
+    @asynccontextmanager
+    async def attempt(self):
+        """
+        Admit one call and record its outcome and latency.
+
+        Yields:
+            Attempt: Call ``failed()`` on it to count the call as failed
+            without raising.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with all
+                probes in flight. The body is not run.
+        """
+        if not self.allows():
+            self.rejected += 1
+            raise CircuitOpenError(f"Circuit '{self.name}' is {self.state.lower().replace('_', '-')}.")
+        probe = self.state == self.HALF_OPEN
+        if probe:
+            self._probes += 1
+        attempt = Attempt()
+        started = time.monotonic()
+        outcome = None
+        try:
+            yield attempt
+            outcome = attempt.ok
+        except Exception:
+            outcome = False
+            raise
+        finally:
+            if probe:
+                self._probes -= 1
+            if outcome is not None:
+                self.record(outcome, time.monotonic() - started, probe)
+
+    def record(self, ok, latency, probe=False):
+        """
+        Record the outcome of a call.
+
+        Args:
+            ok (bool): Whether the call succeeded.
+            latency (float): Its duration in seconds.
+            probe (bool): Whether it was admitted as a half-open probe.
+        """
+        slow = bool(self.slow_call_seconds) and latency >= self.slow_call_seconds
+        if self.state == self.HALF_OPEN:
+            if not probe:
+                return  # Admitted before the circuit opened; says nothing about recovery
+            if ok and not slow:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._transition(self.CLOSED)
+            else:
+                self._transition(self.OPEN)
+            return
+        if self.state == self.OPEN:
+            return
+        self._count(not ok, slow)
+        if self._calls < self.min_calls:
+            return
+        if self._failures >= self.failure_rate * self._calls:
+            self._transition(self.OPEN, f"{self._failures}/{self._calls} calls failed")
+        elif self.slow_call_seconds and self._slow >= self.slow_call_rate * self._calls:
+            self._transition(self.OPEN, f"{self._slow}/{self._calls} calls took over {self.slow_call_seconds}s")
+
+    def _count(self, failed, slow):
+        second = int(time.monotonic())
+        buckets = self._buckets
+        while buckets and buckets[0][0] <= second - self.window:
+            _, calls, failures, slow_calls = buckets.popleft()
+            self._calls -= calls
+            self._failures -= failures
+            self._slow -= slow_calls
+        if not buckets or buckets[-1][0] != second:
+            buckets.append([second, 0, 0, 0])
+        bucket = buckets[-1]
+        bucket[1] += 1
+        bucket[2] += failed
+        bucket[3] += slow
+        self._calls += 1
+        self._failures += failed
+        self._slow += slow
+
+    def _transition(self, state, reason=None):
+        self.state = state
+        if state == self.OPEN:
+            self.opened += 1
+            self._opened_at = time.monotonic()
+            logger.warning(f"Circuit '{self.name}' opened" + (f": {reason}." if reason else " again by a failed probe."))
+        elif state == self.HALF_OPEN:
+            self._probe_successes = 0
+            logger.info(f"Circuit '{self.name}' half-open; probing.")
+        else:
+            logger.info(f"Circuit '{self.name}' closed after {self.half_open_calls} successful probes.")
+        if state != self.HALF_OPEN:
+            self._buckets.clear()
+            self._calls = self._failures = self._slow = 0
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'calls': self._calls,
+            'failure_rate': self._failures / self._calls if self._calls else 0.0,
+            'slow_call_rate': self._slow / self._calls if self._calls else 0.0,
+            'opened': self.opened,
+            'rejected': self.rejected,
+        }
+
+
+_breakers = weakref.WeakKeyDictionary()
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(handler):
+    """
+    The AsyncCircuitBreaker of a resource handler, shared by every iQuery
+    that uses the handler.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(handler)
+        if breaker is None:
+            name = getattr(handler, 'handler_type', None) or type(handler).__name__
+            breaker = _breakers[handler] = AsyncCircuitBreaker(name)
+        return breaker
@@ -0,0 +1,75 @@
+# atlas/utils/settings.py
+
+import os
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+class Settings(BaseSettings):
+    ATLAS_UPDATE_INTERVAL: int = Field(default=60, env='ATLAS_UPDATE_INTERVAL')
+    # Per-cycle execution budget; 0 means unlimited
+    ATLAS_CYCLE_CALL_BUDGET: int = Field(default=0, env='ATLAS_CYCLE_CALL_BUDGET')
+    ATLAS_CYCLE_TOKEN_BUDGET: int = Field(default=0, env='ATLAS_CYCLE_TOKEN_BUDGET')
+    # Continuous worker-pool mode
+    ATLAS_WORKERS: int = Field(default=8, env='ATLAS_WORKERS')
+    ATLAS_WORK_QUEUE_SIZE: int = Field(default=100, env='ATLAS_WORK_QUEUE_SIZE')
+    ATLAS_ITEM_DEADLINE: float = Field(default=120.0, env='ATLAS_ITEM_DEADLINE')
+    # Threads running repository calls for async code paths
+    ATLAS_REPOSITORY_THREADS: int = Field(default=8, env='ATLAS_REPOSITORY_THREADS')
+    # Storage backend: 'neo4j', 'memory' or 'sqlite'
+    ATLAS_STORAGE_BACKEND: str = Field(default='neo4j', env='ATLAS_STORAGE_BACKEND')
+    ATLAS_SQLITE_PATH: str = Field(default='atlas.db', env='ATLAS_SQLITE_PATH')
+    # Process-wide identity map of repository lookups
+    ATLAS_IDENTITY_MAP_SIZE: int = Field(default=4096, env='ATLAS_IDENTITY_MAP_SIZE')
+    ATLAS_IDENTITY_MAP_TTL: float = Field(default=300.0, env='ATLAS_IDENTITY_MAP_TTL')
+    # Binary checkpoints of the runtime state; an empty path disables them
+    ATLAS_CHECKPOINT_PATH: str = Field(default='', env='ATLAS_CHECKPOINT_PATH')
+    ATLAS_CHECKPOINT_INTERVAL: float = Field(default=300.0, env='ATLAS_CHECKPOINT_INTERVAL')
+    ATLAS_CHECKPOINT_COMPRESS: bool = Field(default=True, env='ATLAS_CHECKPOINT_COMPRESS')
+    # Offline update cycles through a batch endpoint (ATLAS.offline_update_cycle)
+    ATLAS_OFFLINE_DIR: str = Field(default='atlas_offline', env='ATLAS_OFFLINE_DIR')
+    ATLAS_OFFLINE_POLL_INTERVAL: float = Field(default=60.0, env='ATLAS_OFFLINE_POLL_INTERVAL')
+    # Batched spaCy processing of LLM responses; 0 processes parses in a thread
+    ATLAS_NLP_BATCH_SIZE: int = Field(default=32, env='ATLAS_NLP_BATCH_SIZE')
+    ATLAS_NLP_MAX_DELAY: float = Field(default=0.005, env='ATLAS_NLP_MAX_DELAY')
+    ATLAS_NLP_PROCESSES: int = Field(default=0, env='ATLAS_NLP_PROCESSES')
+    # Two-tier LLM response cache; an empty path keeps the in-memory tier only
+    ATLAS_RESPONSE_CACHE: bool = Field(default=True, env='ATLAS_RESPONSE_CACHE')
+    ATLAS_RESPONSE_CACHE_PATH: str = Field(default='', env='ATLAS_RESPONSE_CACHE_PATH')
+    ATLAS_RESPONSE_CACHE_SIZE: int = Field(default=1024, env='ATLAS_RESPONSE_CACHE_SIZE')
+    ATLAS_RESPONSE_CACHE_MAX_ENTRIES: int = Field(default=100000, env='ATLAS_RESPONSE_CACHE_MAX_ENTRIES')
+    ATLAS_RESPONSE_CACHE_TTL: float = Field(default=86400.0, env='ATLAS_RESPONSE_CACHE_TTL')
+    # Circuit breakers of resource handlers (AsyncCircuitBreaker); 0 seconds disables slow-call tripping
+    ATLAS_BREAKER_WINDOW: float = Field(default=60.0, env='ATLAS_BREAKER_WINDOW')
+    ATLAS_BREAKER_MIN_CALLS: int = Field(default=10, env='ATLAS_BREAKER_MIN_CALLS')
+    ATLAS_BREAKER_FAILURE_RATE: float = Field(default=0.5, env='ATLAS_BREAKER_FAILURE_RATE')
+    ATLAS_BREAKER_SLOW_CALL_SECONDS: float = Field(default=60.0, env='ATLAS_BREAKER_SLOW_CALL_SECONDS')
+    ATLAS_BREAKER_SLOW_CALL_RATE: float = Field(default=0.8, env='ATLAS_BREAKER_SLOW_CALL_RATE')
+    ATLAS_BREAKER_RESET_TIMEOUT: float = Field(default=30.0, env='ATLAS_BREAKER_RESET_TIMEOUT')
+    ATLAS_BREAKER_HALF_OPEN_CALLS: int = Field(default=2, env='ATLAS_BREAKER_HALF_OPEN_CALLS')
+    # Hedged requests of iQueries with hedge=True (HedgePolicy)
+    ATLAS_HEDGE_QUANTILE: float = Field(default=0.95, env='ATLAS_HEDGE_QUANTILE')
+    ATLAS_HEDGE_MAX_FRACTION: float = Field(default=0.1, env='ATLAS_HEDGE_MAX_FRACTION')
+    ATLAS_HEDGE_MIN_SAMPLES: int = Field(default=20, env='ATLAS_HEDGE_MIN_SAMPLES')
+    OPENAI_API_KEY: str = Field(..., env='OPENAI_API_KEY')
+    OPENAI_API_BASE_URL: str = 'https://api.openai.com/v1'
+    OPENAI_MODEL: str = 'gpt-4'
+    # Provider limits per API key (0 disables a limit) and the adaptive concurrency range
+    OPENAI_REQUESTS_PER_MINUTE: int = Field(default=500, env='OPENAI_REQUESTS_PER_MINUTE')
+    OPENAI_TOKENS_PER_MINUTE: int = Field(default=90000, env='OPENAI_TOKENS_PER_MINUTE')
+    OPENAI_INITIAL_CONCURRENCY: int = Field(default=5, env='OPENAI_INITIAL_CONCURRENCY')
+    OPENAI_MIN_CONCURRENCY: int = Field(default=1, env='OPENAI_MIN_CONCURRENCY')
+    OPENAI_MAX_CONCURRENCY: int = Field(default=32, env='OPENAI_MAX_CONCURRENCY')
+
+    # Neo4j settings
+    NEO4J_USERNAME: str = Field(default='neo4j', env='NEO4J_USERNAME')
+    NEO4J_PASSWORD: str = Field(..., env='NEO4J_PASSWORD')
+    NEO4J_HOST: str = Field(default='localhost', env='NEO4J_HOST')
+    NEO4J_PORT: int = Field(default=7687, env='NEO4J_PORT')
+
+    class Config:
+        env_file = os.path.join(os.path.dirname(__file__), '..', '.env')
+        env_file_encoding = 'utf-8'
+
+    @property
+    def neo4j_database_url(self):
+        return f"bolt://{self.NEO4J_USERNAME}:{self.NEO4J_PASSWORD}@{self.NEO4J_HOST}:{self.NEO4J_PORT}"
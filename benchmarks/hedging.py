@@ -0,0 +1,108 @@
+"""
+Compare iQuery latency with and without hedged requests.
+
+Two stand-in handlers answer after a short random latency, and a small
+share of their calls (--tail-share) take --tail-latency seconds longer. The
+same iQuery runs for --requests entities, --concurrency at a time, first
+without and then with hedging, and the script reports latency percentiles
+and how many requests each handler received.
+
+Hedging at the p95 latency cuts off tails that affect fewer than 5% of
+calls; a larger tail share moves the p95 itself into the tail.
+
+Usage:
+    python benchmarks/hedging.py [--requests N] [--tail-share P] [--tail-latency S]
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import random
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'stand-in')
+os.environ.setdefault('NEO4J_PASSWORD', 'stand-in')
+os.environ.setdefault('ATLAS_STORAGE_BACKEND', 'memory')
+os.environ.setdefault('ATLAS_RESPONSE_CACHE', 'false')
+
+from atlas.core.atlas import ATLAS
+from atlas.core.entity import Entity
+from atlas.core.hedging import get_hedge_policy
+from atlas.core.iquery import iQuery
+from atlas.core.pattern import Pattern
+from atlas.resources.openai_handler import OpenAIGPTHandler
+
+
+class StandInHandler(OpenAIGPTHandler):
+    def __init__(self, name, rng, tail_share, tail_latency):
+        super().__init__()
+        self.name = name
+        self.rng = rng
+        self.tail_share = tail_share
+        self.tail_latency = tail_latency
+        self.calls = 0
+        self.cancelled = 0
+
+    async def execute(self, prompt, **kwargs):
+        self.calls += 1
+        latency = 0.01 + self.rng.expovariate(200)
+        if self.rng.random() < self.tail_share:
+            latency += self.tail_latency
+        try:
+            await asyncio.sleep(latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return {'attribute_value': f'answer from {self.name}'}
+
+
+async def run_iqueries(args, hedge):
+    rng = random.Random(args.seed)
+    primary = StandInHandler('primary', rng, args.tail_share, args.tail_latency)
+    backup = StandInHandler('backup', rng, args.tail_share, args.tail_latency)
+    iquery = iQuery(f'benchmark_{hedge}', 'answer', [primary, backup], hedge=hedge)
+    pattern = Pattern(f'benchmark_{hedge}', [iquery])
+    with contextlib.redirect_stdout(io.StringIO()):  # Silence entity registration
+        entities = [Entity(f'benchmark_{hedge}_{i}', [pattern]) for i in range(args.requests)]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def run(entity):
+        async with semaphore:
+            start = time.perf_counter()
+            await iquery.execute(entity)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(run(entity) for entity in entities))
+    latencies.sort()
+    percentile = lambda q: latencies[int(q * len(latencies)) - 1] * 1000
+    print(f"hedge={str(hedge):5}  p50 {percentile(0.5):4.0f}ms  p95 {percentile(0.95):4.0f}ms  "
+          f"p99 {percentile(0.99):4.0f}ms  calls primary {primary.calls}, backup {backup.calls} "
+          f"({primary.cancelled + backup.cancelled} cancelled)")
+    await primary.close()
+    await backup.close()
+
+
+async def run(args):
+    ATLAS()
+    await run_iqueries(args, hedge=False)
+    await run_iqueries(args, hedge=True)
+    print(f"policy       {get_hedge_policy().stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--tail-share', type=float, default=0.02)
+    parser.add_argument('--tail-latency', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=1)
+    logging.disable(logging.WARNING)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Measure how long it takes to import ATLAS modules in a fresh interpreter.
+
+Each module is imported in a new Python process, several times, and the
+median wall time is reported together with whether the import loaded the
+settings, spaCy or neomodel. A cheap import keeps CLI startup and
+short-lived worker processes fast.
+
+Usage:
+    python benchmarks/import_time.py [--repeat N] [--modules atlas atlas.core.atlas ...] [--profile MODULE]
+
+--profile prints the slowest imports of one module from `python -X importtime`.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    'atlas',
+    'atlas.utils.config',
+    'atlas.data.repository',
+    'atlas.core.atlas',
+    'atlas.resources.openai_handler',
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+from atlas.utils import config
+print(json.dumps({{
+    'seconds': elapsed,
+    'settings': config._settings is not None,
+    'spacy': 'spacy' in sys.modules,
+    'neomodel': 'neomodel' in sys.modules,
+}}))
+"""
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(*args):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, env=env, cwd=ROOT)
+
+
+def measure(module, repeat):
+    samples = []
+    for _ in range(repeat):
+        result = run_python('-c', PROBE.format(module=module))
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return samples, None
+
+
+def profile(module, top=15):
+    result = run_python('-X', 'importtime', '-c', f'import {module}')
+    rows = []
+    for line in result.stderr.splitlines():
+        # "import time: <self us> | <cumulative us> | <module>"
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>10.1f} ms {self_us / 1000:>10.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--modules', nargs='+', default=DEFAULT_MODULES)
+    parser.add_argument('--profile', metavar='MODULE')
+    args = parser.parse_args()
+
+    if args.profile:
+        print(f"{'cumulative':>13} {'self':>13}  module")
+        profile(args.profile)
+        return
+
+    print(f"{'module':<34} {'median ms':>10} {'min ms':>8}  loaded")
+    for module in args.modules:
+        samples, error = measure(module, args.repeat)
+        if samples is None:
+            print(f"{module:<34} failed: {error}")
+            continue
+        seconds = [sample['seconds'] for sample in samples]
+        loaded = [name for name in ('settings', 'spacy', 'neomodel') if samples[-1][name]]
+        print(f"{module:<34} {statistics.median(seconds) * 1000:>10.1f} {min(seconds) * 1000:>8.1f}  "
+              f"{', '.join(loaded) or '-'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Exercise OpenAIGPTHandler's rate limiting against a local stand-in server.
+
+The server speaks the chat completions API, answers after a fixed latency
+and rejects requests with 429 and a Retry-After header when more than
+--server-concurrency are in flight. The handler is pointed at it through
+its api_base_url argument; the response cache is disabled and every prompt
+is distinct, so each request reaches the server.
+
+Usage:
+    python benchmarks/rate_limiting.py [--requests N] [--server-concurrency C] [--latency S]
+"""
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'stand-in')
+os.environ.setdefault('NEO4J_PASSWORD', 'stand-in')
+os.environ.setdefault('ATLAS_STORAGE_BACKEND', 'memory')
+os.environ.setdefault('ATLAS_RESPONSE_CACHE', 'false')
+
+from aiohttp import web
+
+from atlas.resources.openai_handler import OpenAIGPTHandler
+
+
+class StandInServer:
+    def __init__(self, concurrency, latency, retry_after):
+        self.concurrency = concurrency
+        self.latency = latency
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.peak = 0
+        self.accepted = 0
+        self.rejected = 0
+
+    async def chat_completions(self, request):
+        payload = await request.json()
+        if self.in_flight >= self.concurrency:
+            self.rejected += 1
+            return web.json_response({'error': 'rate limited'}, status=429,
+                                     headers={'Retry-After': str(self.retry_after)})
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        self.accepted += 1
+        content = payload['messages'][0]['content']
+        return web.json_response({
+            'choices': [{'message': {'content': f'answer to {content}'}}],
+            'usage': {'total_tokens': len(content) // 4 + 10},
+        })
+
+
+async def run(args):
+    server = StandInServer(args.server_concurrency, args.latency, args.retry_after)
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', server.chat_completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    handler = OpenAIGPTHandler(api_base_url=f'http://127.0.0.1:{port}/v1')
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        handler.execute(f'prompt {i}', max_retries=args.max_retries) for i in range(args.requests)
+    ))
+    elapsed = time.perf_counter() - start
+    await handler.close()
+    await runner.cleanup()
+
+    completed = sum(result is not None for result in results)
+    print(f"completed      {completed}/{args.requests} in {elapsed:.2f}s ({completed / elapsed:.1f}/s)")
+    print(f"server 429s    {server.rejected}")
+    print(f"server peak    {server.peak} concurrent (limit {args.server_concurrency})")
+    print(f"limiter        {handler.rate_limiter.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--server-concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--retry-after', type=float, default=0.2)
+    parser.add_argument('--max-retries', type=int, default=10)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare the throughput of the storage backends.
+
+Runs the same workload against each backend through the Repository: bulk
+entity creation, single-entity lookups, batched attribute updates and
+iQuery status writes. The identity map is bypassed for lookups so that the
+backends themselves are measured.
+
+Usage:
+    python benchmarks/storage_backends.py [--entities N] [--backends memory sqlite neo4j]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from atlas.data.backends import create_backend
+from atlas.data.repository import Repository
+
+
+def timed(label, results, func, count):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    results[label] = (elapsed, count / elapsed if elapsed else float('inf'))
+
+
+def run_workload(backend, num_entities):
+    repository = Repository(backend=backend)
+    pattern = repository.create_pattern(f'bench-{time.time_ns()}')
+    iquery = repository.create_iquery(f'bench-{time.time_ns()}', 'summary')
+    entity_ids = [f'bench-entity-{i}' for i in range(num_entities)]
+    results = {}
+
+    timed('batch create', results, lambda: repository.batch_create_entities(
+        [{'entity_id': eid, 'attributes': {'index': i}, 'patterns': [pattern]} for i, eid in enumerate(entity_ids)]
+    ), num_entities)
+    timed('lookup', results, lambda: [backend.get_entity(eid) for eid in entity_ids], num_entities)
+    timed('bulk update', results, lambda: repository.bulk_update_attributes(
+        {eid: {'score': i / num_entities} for i, eid in enumerate(entity_ids)}
+    ), num_entities)
+    timed('status write', results, lambda: [
+        repository.update_iquery_status(iquery, 'completed') for _ in range(num_entities)
+    ], num_entities)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--entities', type=int, default=10000)
+    parser.add_argument('--backends', nargs='+', default=['memory', 'sqlite'])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for name in args.backends:
+            options = {'path': os.path.join(directory, 'bench.db')} if name == 'sqlite' else {}
+            backend = create_backend(name, **options)
+            try:
+                results = run_workload(backend, args.entities)
+            finally:
+                backend.close()
+            print(f"\n{name} ({args.entities} entities)")
+            for label, (elapsed, rate) in results.items():
+                print(f"  {label:<14} {elapsed:8.3f}s  {rate:12.0f} ops/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Compare streamed and plain completions against a local SSE stand-in server.
+
+The server answers chat completions with --tokens chunks, one every
+--token-delay seconds, as server-sent events (or as one JSON body when not
+streaming). The script reports the time until a caller sees the first text
+and the streaming metrics of OpenAIGPTHandler, then cancels a stream at a
+deadline and reports how many chunks the server generated after the
+client went away.
+
+Usage:
+    python benchmarks/streaming.py [--tokens N] [--token-delay S] [--deadline S]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault('OPENAI_API_KEY', 'stand-in')
+os.environ.setdefault('NEO4J_PASSWORD', 'stand-in')
+os.environ.setdefault('ATLAS_STORAGE_BACKEND', 'memory')
+os.environ.setdefault('ATLAS_RESPONSE_CACHE', 'false')
+
+from aiohttp import web
+
+from atlas.resources.openai_handler import OpenAIGPTHandler
+
+
+class StandInServer:
+    def __init__(self, tokens, token_delay):
+        self.tokens = tokens
+        self.token_delay = token_delay
+        self.chunks_sent = 0
+        self.aborted = 0
+
+    async def chat_completions(self, request):
+        payload = await request.json()
+        words = [f'word{i} ' for i in range(self.tokens)]
+        if not payload.get('stream'):
+            await asyncio.sleep(self.token_delay * self.tokens)
+            return web.json_response({
+                'choices': [{'message': {'content': ''.join(words)}}],
+                'usage': {'total_tokens': self.tokens},
+            })
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        try:
+            for word in words:
+                await asyncio.sleep(self.token_delay)
+                chunk = {'choices': [{'delta': {'content': word}}]}
+                await response.write(f'data: {json.dumps(chunk)}\n\n'.encode())
+                self.chunks_sent += 1
+            usage = {'choices': [], 'usage': {'completion_tokens': self.tokens, 'total_tokens': self.tokens}}
+            await response.write(f'data: {json.dumps(usage)}\n\ndata: [DONE]\n\n'.encode())
+        except ConnectionResetError:
+            # The client went away: stop generating
+            self.aborted += 1
+        except asyncio.CancelledError:
+            self.aborted += 1
+            raise
+        return response
+
+
+async def run(args):
+    server = StandInServer(args.tokens, args.token_delay)
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', server.chat_completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    handler = OpenAIGPTHandler(api_base_url=f'http://127.0.0.1:{port}/v1')
+
+    start = time.perf_counter()
+    await handler.execute('plain')
+    plain = time.perf_counter() - start
+
+    first_partial = []
+    start = time.perf_counter()
+    await handler.execute('streamed', stream=True,
+                          on_partial=lambda text: first_partial or first_partial.append(time.perf_counter() - start))
+    streamed = time.perf_counter() - start
+    print(f"plain       first text after {plain:.3f}s")
+    print(f"streamed    first text after {first_partial[0]:.3f}s, complete after {streamed:.3f}s")
+    print(f"metrics     {handler.stream_metrics.stats()['last']}")
+
+    server.chunks_sent = 0
+    try:
+        await asyncio.wait_for(handler.execute('cancelled', stream=True), timeout=args.deadline)
+    except asyncio.TimeoutError:
+        pass
+    sent_at_deadline = server.chunks_sent
+    await asyncio.sleep(args.token_delay * 10)
+    print(f"cancelled   {sent_at_deadline} chunks sent by the deadline, "
+          f"{server.chunks_sent - sent_at_deadline} after it (of {args.tokens}); "
+          f"server streams aborted: {server.aborted}")
+    print(f"totals      {handler.stream_metrics.stats()}")
+
+    await handler.close()
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=100)
+    parser.add_argument('--token-delay', type=float, default=0.01)
+    parser.add_argument('--deadline', type=float, default=0.3)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -63,6 +63,7 @@ seed_entities = [
 patterns = [
     {
         "name": "PublicHealthDomain",
+        "batched": True,
         "iqueries": [
             {
                 "name": "Definition",
@@ -165,23 +166,22 @@ async def run_simulation():
         # Create patterns
         patterns_dict = {}
         for pattern_data in patterns:
-            pattern = Pattern(pattern_data['name'])
+            pattern = Pattern(pattern_data['name'], batched=pattern_data.get('batched', False))
             for iquery_data in pattern_data['iqueries']:
                 iquery = iQuery(
                     iquery_data['name'],
                     iquery_data['target_attribute'],
-                    [openai_handler]
+                    [openai_handler],
+                    prompt_template=iquery_data['prompt_template']
                 )
                 pattern.add_iquery(iquery)
             patterns_dict[pattern_data['name']] = pattern
 
-        # Create and register seed entities
-        for entity_data in seed_entities:
-            entity = EntityFactory.create_entity({
-                **entity_data,
-                'patterns': [patterns_dict['PublicHealthDomain']]
-            })
-            atlas.register_entity(entity)
+        # Create and register seed entities in one batched write
+        EntityFactory.create_many([
+            {**entity_data, 'patterns': [patterns_dict['PublicHealthDomain']]}
+            for entity_data in seed_entities
+        ])
 
         # Run initial update cycles
         print("Running initial update cycles...")
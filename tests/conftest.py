@@ -0,0 +1,8 @@
+import os
+
+# Settings the tests need without external services: entities are kept in
+# memory and handlers are pointed at local stand-in servers.
+os.environ.setdefault('OPENAI_API_KEY', 'stand-in')
+os.environ.setdefault('NEO4J_PASSWORD', 'stand-in')
+os.environ.setdefault('ATLAS_STORAGE_BACKEND', 'memory')
+os.environ.setdefault('ATLAS_RESPONSE_CACHE', 'false')
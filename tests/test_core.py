@@ -0,0 +1,937 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+import types
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from atlas.core import checkpoint
+from atlas.core.atlas import ATLAS
+from atlas.core.checkpoint import CheckpointError, RecordType
+from atlas.core.condition import AttributeCondition, Condition, GlobalCondition
+from atlas.core.dependencies import build_dependency_graph, dependency_depth, order_by_dependencies
+from atlas.core.entity import Entity
+from atlas.core.graph import ReferenceGraph
+from atlas.core.hedging import HedgePolicy, LatencyTracker, first_response
+from atlas.core.iquery import iQuery
+from atlas.core.metrics import clip_scores
+from atlas.core.offline import OfflineCycle
+from atlas.core.pattern import Pattern, PatternBatch, plan_batches
+from atlas.core.scheduler import CycleBudget, UpdateScheduler
+from atlas.core.workers import WorkerPool
+from atlas.core.sharding import ShardedATLAS, ShardRouter, ShardWorker, shard_for
+from atlas.data import backends
+from atlas.data.backends.memory import MemoryBackend
+from atlas.data.repository import Repository, identity_map
+from atlas.resources.batch_endpoint import LocalBatchEndpoint
+from atlas.resources.openai_handler import OpenAIGPTHandler
+from atlas.utils.circuitbreaker import get_circuit_breaker
+
+
+class StandInHandler(OpenAIGPTHandler):
+    """Answers from ``respond(prompt)`` instead of the API; None fails the call."""
+
+    def __init__(self, respond, latency=0.0):
+        super().__init__()
+        self.respond = respond
+        self.latency = latency
+        self.calls = []
+
+    async def execute(self, prompt, **kwargs):
+        self.calls.append(prompt)
+        await asyncio.sleep(self.latency)
+        return self.respond(prompt)
+
+
+def test_run_iquery_uses_the_outcome_of_its_own_execution():
+    async def run():
+        atlas = ATLAS()
+        # Fails for one entity and succeeds for the other: the shared iQuery
+        # ends up 'completed', which must not hide the failure.
+        handler = StandInHandler(lambda prompt: None if 'failing' in prompt else {'attribute_value': 'ok'},
+                                 latency=0.01)
+        iquery = iQuery('outcome_query', 'answer', [handler])
+        pattern = Pattern('outcome_pattern', [iquery])
+        failing, passing = Entity('outcome_failing', [pattern]), Entity('outcome_passing', [pattern])
+        results = await asyncio.gather(
+            failing.run_iquery(iquery, atlas.global_state),
+            passing.run_iquery(iquery, atlas.global_state),
+        )
+        await handler.close()
+        return atlas, results, failing, passing
+
+    atlas, results, failing, passing = asyncio.run(run())
+    assert results == [False, True]
+    assert passing.attributes['answer'] == 'ok'
+    assert ('outcome_failing', 'outcome_query') in atlas.scheduler.pending()
+    assert ('outcome_passing', 'outcome_query') not in atlas.scheduler.pending()
+
+
+def test_clip_scores_without_bounds_returns_values_unchanged():
+    values = np.array([-1.0, 0.5, 2.0])
+    mask = np.array([True, True, False])
+    assert clip_scores(values, mask) is values
+    assert values.tolist() == [-1.0, 0.5, 2.0]
+    assert clip_scores(values, mask, lower=0.0).tolist() == [0.0, 0.5, 2.0]
+
+
+def batch_answers(prompt):
+    """Answers single iQueries, and batched ones with a JSON object of their attributes."""
+    if prompt.startswith(PatternBatch.PROMPT):
+        keys = re.findall(r'^"(\w+)":', prompt, re.MULTILINE)
+        return {'text': json.dumps({key: f'batched {key}' for key in keys})}
+    return {'attribute_value': f'single {prompt}'}
+
+
+def test_batches_that_depend_on_each_other_are_not_planned():
+    async def run():
+        atlas = ATLAS()
+        handler = StandInHandler(batch_answers)
+        a1 = iQuery('cycle_a1', 'x', [handler])
+        b1 = iQuery('cycle_b1', 'y', [handler])
+        a2 = iQuery('cycle_a2', 'a2', [handler], prompt_template='Read {y}')
+        b2 = iQuery('cycle_b2', 'b2', [handler], prompt_template='Read {x}')
+        first = Pattern('cycle_first', [a1, a2], batched=True)
+        second = Pattern('cycle_second', [b1, b2], batched=True)
+        entity = Entity('cycle_entity', [first, second])
+        # Batching both {a1, a2} and {b1, b2} would deadlock: a2 waits for b1,
+        # which waits for b2, which waits for a1, which waits for a2
+        iqueries = [a1, b1, a2, b2]
+        batches = plan_batches(entity, iqueries, build_dependency_graph(iqueries))
+        await asyncio.wait_for(entity.local_update(atlas.global_state, iqueries), timeout=2)
+        await handler.close()
+        return batches, entity
+
+    batches, entity = asyncio.run(run())
+    assert sorted(batches) == [0, 2]
+    assert entity.attributes['x'] == 'batched x' and entity.attributes['a2'] == 'batched a2'
+    assert entity.attributes['y'] == 'single Provide y for cycle_entity'
+    assert entity.attributes['b2'] == 'single Read batched x'
+
+
+def test_batch_members_do_not_wait_for_a_member_whose_upstream_failed():
+    def answer(prompt):
+        if 'upstream' in prompt:
+            raise asyncio.CancelledError()
+        return batch_answers(prompt)
+
+    async def run():
+        atlas = ATLAS()
+        handler = StandInHandler(answer)
+        upstream = iQuery('abandon_upstream', 'upstream', [handler])
+        independent = iQuery('abandon_independent', 'x', [handler])
+        dependent = iQuery('abandon_dependent', 'y', [handler], prompt_template='Read {upstream}')
+        batched = Pattern('abandon_batched', [independent, dependent], batched=True)
+        entity = Entity('abandon_entity', [batched, Pattern('abandon_single', [upstream])])
+        with pytest.raises(asyncio.CancelledError):
+            await entity.local_update(atlas.global_state, [independent, upstream, dependent])
+        for _ in range(100):
+            if 'x' in entity.attributes:
+                break
+            await asyncio.sleep(0.01)
+        await handler.close()
+        return entity
+
+    entity = asyncio.run(run())
+    assert entity.attributes['x'] == 'single Provide x for abandon_entity'
+    assert 'y' not in entity.attributes
+
+
+class AnswerProcessor:
+    """Stands in for the spaCy processing: a non-empty answer is the attribute value."""
+
+    async def process_async(self, response):
+        return {'attribute_value': response} if response else None
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingCycle(OfflineCycle):
+    """Stops, like a crashed process, once the manifest records ``crash_after``."""
+
+    def __init__(self, *args, crash_after, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.crash_after = crash_after
+
+    def _save_manifest(self, manifest):
+        super()._save_manifest(manifest)
+        if manifest['state'] == self.crash_after:
+            raise Crash(self.crash_after)
+
+
+class DroppingEndpoint(LocalBatchEndpoint):
+    """Leaves out the results of the requests whose prompt contains ``drop``."""
+
+    def __init__(self, directory, respond=None, drop=None):
+        super().__init__(directory, respond)
+        self.drop = drop
+
+    async def download(self, batch, output_path):
+        await super().download(batch, output_path)
+        with open(output_path, encoding='utf-8') as file:
+            results = [line for line in file if self.drop not in json.loads(line)['custom_id']]
+        with open(output_path, 'w', encoding='utf-8') as file:
+            file.writelines(results)
+        return len(results)
+
+
+@pytest.fixture
+def fresh_atlas(monkeypatch):
+    # ATLAS is a process-wide singleton; give the test one without other tests' pending work
+    monkeypatch.setattr(ATLAS, '_instance', None)
+
+
+def offline_setup(name, count):
+    handler = StandInHandler(lambda prompt: None)  # Only builds batch requests
+    handler.response_processor = AnswerProcessor()
+    pattern = Pattern(name, [iQuery(name, 'answer', [handler])])
+    return handler, [Entity(f'{name}_{i}', [pattern]) for i in range(count)]
+
+
+@pytest.mark.parametrize('crash_after', ['prepared', 'submitted', 'downloaded'])
+def test_offline_cycle_resumes_after_a_crash_without_resubmitting(tmp_path, fresh_atlas, crash_after):
+    endpoint_directory, directory = str(tmp_path / 'endpoint'), str(tmp_path / 'cycle')
+
+    async def run():
+        atlas = ATLAS()
+        handler, entities = offline_setup(f'resume_{crash_after}', 3)
+        crashing = CrashingCycle(atlas, LocalBatchEndpoint(endpoint_directory), directory, poll_interval=0,
+                                 crash_after=crash_after)
+        with pytest.raises(Crash):
+            await crashing.run()
+        # A new process: new endpoint client and cycle, same directories
+        report = await OfflineCycle(atlas, LocalBatchEndpoint(endpoint_directory), directory, poll_interval=0).run()
+        await handler.close()
+        return atlas, entities, report
+
+    atlas, entities, report = asyncio.run(run())
+    assert report['state'] == 'applied'
+    assert (report['requests'], report['applied'], report['failed']) == (3, 3, 0)
+    assert len(list((tmp_path / 'endpoint').glob('*.input.jsonl'))) == 1
+    for entity in entities:
+        assert entity.attributes['answer'] == f'Answer to: Provide answer for {entity.entity_id}'
+    assert not atlas.scheduler.pending()
+
+
+def test_offline_cycle_reschedules_missing_and_failed_results(tmp_path, fresh_atlas):
+    def respond(body):
+        prompt = body['messages'][-1]['content']
+        if prompt.endswith('_1'):
+            raise RuntimeError('Request failed')
+        return '' if prompt.endswith('_2') else f'Answer to: {prompt}'
+
+    async def run():
+        atlas = ATLAS()
+        handler, entities = offline_setup('reschedule', 4)
+        endpoint = DroppingEndpoint(str(tmp_path / 'endpoint'), respond, drop='reschedule_3')
+        report = await OfflineCycle(atlas, endpoint, str(tmp_path / 'cycle'), poll_interval=0).run()
+        await handler.close()
+        return atlas, entities, report
+
+    atlas, entities, report = asyncio.run(run())
+    assert (report['requests'], report['applied'], report['failed']) == (4, 1, 3)
+    assert entities[0].attributes['answer'] == 'Answer to: Provide answer for reschedule_0'
+    assert all('answer' not in entity.attributes for entity in entities[1:])
+    # Errors, empty answers and results missing from the output run again
+    assert atlas.scheduler.pending() == {(f'reschedule_{i}', 'reschedule') for i in (1, 2, 3)}
+
+
+def test_primary_that_loses_to_a_hedge_records_a_lower_bound():
+    async def respond(seconds, answer):
+        await asyncio.sleep(seconds)
+        return answer
+
+    async def run():
+        tracker = LatencyTracker()
+        policy = HedgePolicy(max_fraction=1.0, min_samples=0)
+        policy.start_request()
+        hedged = await first_response(respond(1.0, 'primary'), lambda: respond(0.05, 'backup'), 0.05, policy, tracker)
+        policy.start_request()
+        unhedged = await first_response(respond(0.01, 'primary'), lambda: respond(0.05, 'backup'), 0.05, policy,
+                                        tracker)
+        return hedged, unhedged, tracker, policy
+
+    hedged, unhedged, tracker, policy = asyncio.run(run())
+    assert (hedged, unhedged) == ('backup', 'primary')
+    assert policy.hedge_wins == 1
+    # The cancelled primary had taken at least the delay plus the backup's time
+    assert len(tracker) == 1 and 0.1 <= tracker.quantile(0.5) < 1.0
+
+
+def no_patterns():
+    return []
+
+
+# Queues without processes: shards are driven in the test's own process
+in_process = types.SimpleNamespace(Queue=queue.Queue)
+
+
+async def serve(worker, count):
+    """Handle the next ``count`` messages of a shard's inbox, as ShardWorker._serve does."""
+    for _ in range(count):
+        await worker._handle(worker.inbox.get(timeout=5))
+
+
+def test_sharded_graph_analysis_updates_the_metrics_of_each_shard(fresh_atlas):
+    sharded = ShardedATLAS(1, no_patterns, mp_context=in_process)
+    worker = ShardWorker(0, 1, no_patterns, sharded.inboxes, sharded.results)
+
+    async def run():
+        # Shards set up their ATLAS inside their event loop
+        worker._setup()
+        for entity_id, references in [('scores_a', ['scores_c']), ('scores_b', ['scores_c']), ('scores_c', [])]:
+            sharded.add_entity({'entity_id': entity_id, 'attributes': {'references': references}})
+        await serve(worker, 3)
+        before = worker.atlas.work_priority(worker.atlas.entities['scores_c'], 'any')
+        authority = []
+        coordinator = threading.Thread(target=lambda: authority.append(sharded.perform_graph_analysis(timeout=5)))
+        coordinator.start()
+        await serve(worker, 2)  # The graph request, then the scores
+        coordinator.join(5)
+        return worker.atlas, before, authority[0]
+
+    atlas, before, authority = asyncio.run(run())
+    cited = atlas.entities['scores_c']
+    assert authority['scores_c'] > 0
+    assert atlas.metrics.get('authority', 'scores_c') == pytest.approx(authority['scores_c'])
+    assert atlas.metrics.get('authority', 'scores_a') == pytest.approx(0.0)
+    assert atlas.metrics.get('hub', 'scores_a') > 0
+    assert atlas.work_priority(cited, 'any') > before
+    assert cited.attributes['authority'] == atlas.metrics.get('authority', 'scores_c')
+    assert Repository().get_entity_by_id('scores_c').attributes['authority'] == cited.attributes['authority']
+
+
+def test_shard_assignment_is_stable_across_processes():
+    ids = [f'entity_{i}' for i in range(1000)]
+    assert [shard_for(entity_id, 8) for entity_id in ('alpha', 'beta', 'gamma')] == [2, 6, 5]
+    # hash() would differ between these interpreters
+    script = 'import sys; from atlas.core.sharding import shard_for; print([shard_for(i, 4) for i in sys.argv[1:]])'
+    for seed in ('1', '2'):
+        output = subprocess.run([sys.executable, '-c', script, *ids], capture_output=True, text=True, check=True,
+                                env={**os.environ, 'PYTHONHASHSEED': seed}).stdout
+        assert output.strip() == str([shard_for(entity_id, 4) for entity_id in ids])
+    counts = Counter(shard_for(entity_id, 4) for entity_id in ids)
+    assert sorted(counts) == [0, 1, 2, 3] and min(counts.values()) > 200
+
+
+def test_router_sends_remote_entities_and_reference_deltas_to_their_owners():
+    inboxes = [queue.Queue(), queue.Queue()]
+    router = ShardRouter(0, 2, inboxes)
+    assert (router.owner('alpha'), router.owner('gamma')) == (0, 1)
+    pattern = types.SimpleNamespace(name='routed_pattern')
+    router.route_entity({'entity_id': 'gamma', 'patterns': [pattern, 'named_pattern']})
+    local = router.route_reference_deltas(Counter({'alpha': 1, 'beta': -1, 'gamma': 2}))
+    assert local == Counter({'alpha': 1, 'beta': -1})
+    assert inboxes[0].empty()
+    # Pattern objects hold live handlers; they travel by name
+    assert inboxes[1].get_nowait() == ('create_entity', {'entity_id': 'gamma',
+                                                         'patterns': ['routed_pattern', 'named_pattern']})
+    assert inboxes[1].get_nowait() == ('reference_delta', {'gamma': 2})
+
+
+def test_shard_keeps_only_its_own_entities_and_reference_counts(fresh_atlas):
+    inboxes, results = [queue.Queue(), queue.Queue()], queue.Queue()
+    worker = ShardWorker(0, 2, no_patterns, inboxes, results)
+
+    async def run():
+        worker._setup()
+        atlas = worker.atlas
+        assert atlas.spawn_entity({'entity_id': 'gamma'}) is None
+        atlas.register_entities([{'entity_id': 'beta'}, {'entity_id': 'gamma'}])
+        alpha = await atlas.spawn_entity_async({'entity_id': 'alpha', 'attributes': {'references': ['beta', 'gamma']}})
+        assert await atlas.spawn_entity_async({'entity_id': 'alpha'}) is alpha
+        alpha.remove_reference('gamma')
+        inboxes[0].put(('reference_delta', {'alpha': 3}))  # From shard 1
+        await serve(worker, 1)
+        return atlas
+
+    atlas = asyncio.run(run())
+    assert sorted(atlas.entities) == ['alpha', 'beta']
+    assert atlas.reference_counts == Counter({'alpha': 3, 'beta': 1})
+    remote = [inboxes[1].get_nowait() for _ in range(inboxes[1].qsize())]
+    assert remote == [('create_entity', {'entity_id': 'gamma', 'patterns': []}),
+                      ('create_entity', {'entity_id': 'gamma', 'patterns': []}),
+                      ('reference_delta', {'gamma': 1}),
+                      ('reference_delta', {'gamma': -1})]
+
+
+def test_shard_processes_analyse_the_whole_graph():
+    sharded = ShardedATLAS(2, no_patterns)
+    sharded.start()
+    try:
+        for entity_id, references in [('alpha', ['gamma']), ('beta', ['gamma']), ('gamma', ['alpha'])]:
+            sharded.add_entity({'entity_id': entity_id, 'attributes': {'references': references}})
+        authority = sharded.perform_graph_analysis()
+        references = sharded.gather_references()
+    finally:
+        sharded.stop()
+    assert references == {'alpha': ['gamma'], 'beta': ['gamma'], 'gamma': ['alpha']}
+    assert authority['gamma'] > authority['alpha'] > authority['beta']
+    assert not sharded.processes
+
+
+def test_open_circuit_falls_through_to_the_next_handler_without_backoff():
+    def fail(prompt):
+        raise RuntimeError('Backend unavailable')
+
+    async def run():
+        atlas = ATLAS()
+        open_handler, tripping_handler = StandInHandler(fail), StandInHandler(fail)
+        fallback = StandInHandler(lambda prompt: {'attribute_value': 'fallback'})
+        for breaker, failures in ((get_circuit_breaker(open_handler), 0), (get_circuit_breaker(tripping_handler), 1)):
+            # One more failure opens the second circuit
+            for _ in range(breaker.min_calls - failures):
+                breaker.record(False, 0.0)
+        iquery = iQuery('breaker_query', 'answer', [open_handler, tripping_handler, fallback])
+        entity = Entity('breaker_entity', [Pattern('breaker_pattern', [iquery])])
+        started = time.monotonic()
+        await iquery.execute(entity)
+        elapsed = time.monotonic() - started
+        for handler in (open_handler, tripping_handler, fallback):
+            await handler.close()
+        return entity, elapsed, [len(handler.calls) for handler in (open_handler, tripping_handler, fallback)]
+
+    entity, elapsed, calls = asyncio.run(run())
+    assert entity.attributes['answer'] == 'fallback'
+    assert calls == [0, 1, 1]
+    assert elapsed < iQuery.BACKOFF_FACTOR  # Shorter than a single backoff sleep
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_checkpoint_records_round_trip(tmp_path, compress):
+    path = str(tmp_path / 'records.ckpt')
+    records = [
+        (RecordType.META, checkpoint.encode_json({'cycle': 3})),
+        (RecordType.ENTITY, checkpoint.encode_json({'entity_id': 'node', 'attributes': {'text': 'x' * 1000}})),
+        (RecordType.METRIC, checkpoint.encode_metric('authority', np.linspace(0.0, 1.0, 100))),
+    ]
+    size = checkpoint.write_checkpoint(path, records, compress=compress)
+    assert list(checkpoint.read_records(path)) == records
+    uncompressed = sum(len(payload) for _, payload in records)
+    assert (size < uncompressed) is compress
+    name, values = checkpoint.decode_metric(records[2][1])
+    assert name == 'authority' and values.tolist() == np.linspace(0.0, 1.0, 100).tolist()
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_restored_checkpoint_resumes_metrics_pending_work_and_graph(tmp_path, fresh_atlas, monkeypatch, compress):
+    path = str(tmp_path / 'atlas.ckpt')
+
+    async def capture():
+        atlas = ATLAS()
+        handler = StandInHandler(lambda prompt: None)
+        describe = iQuery('checkpoint_describe', 'description', [handler])
+        summarise = iQuery('checkpoint_summarise', 'summary', [handler], prompt_template='Summarise {description}')
+        pattern = Pattern('checkpoint_pattern', [describe, summarise])
+        atlas.register_pattern(pattern)
+        for entity_id, references in [('ckpt_a', ['ckpt_c']), ('ckpt_b', ['ckpt_c', 'ckpt_outside']), ('ckpt_c', [])]:
+            Entity(entity_id, [pattern], {'references': references, 'label': entity_id.upper()})
+        atlas.global_state['phase'] = 'growth'
+        atlas.perform_graph_analysis(write_back=False)
+        atlas.scheduler.mark_clean('ckpt_a', 'checkpoint_describe')
+        atlas.scheduler.mark_clean('ckpt_c', 'checkpoint_summarise')
+        checkpoint.write_checkpoint(path, checkpoint.capture(atlas), compress=compress)
+        return atlas, handler
+
+    async def restore():
+        atlas = ATLAS()
+        report = atlas.restore_checkpoint(path, {'OpenAI': handler})
+        await handler.close()
+        return atlas, report
+
+    original, handler = asyncio.run(capture())
+    monkeypatch.setattr(ATLAS, '_instance', None)
+    restored, report = asyncio.run(restore())
+
+    assert restored is not original
+    assert (report['entities'], report['patterns'], report['iqueries']) == (3, 1, 2)
+    assert restored.global_state['phase'] == 'growth'
+    assert restored.entities['ckpt_b'].attributes['label'] == 'CKPT_B'
+    assert [iquery.name for iquery in restored.entities['ckpt_b'].iqueries] == \
+        ['checkpoint_describe', 'checkpoint_summarise']
+    assert restored.entities['ckpt_a'].iqueries[0].resource_handlers == [handler]
+    assert set(restored.reference_graph.ids) == set(original.reference_graph.ids)
+    for entity_id in original.reference_graph.ids:
+        for name in ('authority', 'hub'):
+            assert restored.metrics.get(name, entity_id) == original.metrics.get(name, entity_id)
+    assert restored.metrics.get('authority', 'ckpt_c') > 0
+    assert restored.scheduler.pending() == original.scheduler.pending()
+    assert ('ckpt_a', 'checkpoint_describe') not in restored.scheduler.pending()
+
+
+@pytest.mark.parametrize('damage', ['empty', 'header', 'truncated', 'magic', 'version'])
+def test_damaged_checkpoints_are_rejected(tmp_path, damage):
+    path = tmp_path / 'damaged.ckpt'
+    records = [(RecordType.GLOBAL_STATE, checkpoint.encode_json({'phase': 'growth'}))] * 3
+    checkpoint.write_checkpoint(str(path), records)
+    data = path.read_bytes()
+    path.write_bytes({
+        'empty': b'',
+        'header': data[:4],
+        'truncated': data[:-5],
+        'magic': b'NOTACKPT' + data[8:],
+        'version': data[:8] + (checkpoint.VERSION + 1).to_bytes(2, 'little') + data[10:],
+    }[damage])
+    with pytest.raises(CheckpointError):
+        checkpoint.load_checkpoint(str(path))
+
+
+BACKEND_WRITES = (
+    'create_entity', 'update_entity_attributes', 'bulk_update_attributes', 'batch_create_entities', 'delete_entity',
+    'create_pattern', 'add_pattern_to_entity', 'remove_pattern_from_entity', 'add_parent_pattern', 'create_iquery',
+    'update_iquery_status', 'add_iquery_to_entity', 'add_iquery_to_pattern', 'create_resource_handler',
+    'add_resource_handler_to_iquery',
+)
+
+
+@pytest.fixture
+def memory_backend(monkeypatch):
+    # A backend of the test's own, so the stored graph holds only what the test seeds
+    backend = MemoryBackend()
+    monkeypatch.setattr(backends, '_backend', backend)
+    identity_map.clear()
+    yield backend
+    identity_map.clear()
+
+
+def test_hydrate_rebuilds_the_graph_without_writing_back(fresh_atlas, memory_backend, monkeypatch):
+    backend = memory_backend
+    handler_record = backend.create_resource_handler('OpenAI', {'model': 'stand-in'})
+    describe = backend.create_iquery('hydrate_describe', 'description')
+    summarise = backend.create_iquery('hydrate_summarise', 'summary', prompt_template='Summarise {description}')
+    for iquery in (describe, summarise):
+        backend.add_resource_handler_to_iquery(iquery, handler_record)
+    base, derived = backend.create_pattern('hydrate_base'), backend.create_pattern('hydrate_derived')
+    backend.add_iquery_to_pattern(base, describe)
+    backend.add_iquery_to_pattern(derived, summarise)
+    backend.add_parent_pattern(derived, base)
+    backend.batch_create_entities([
+        {'entity_id': 'hydrate_a', 'attributes': {'references': ['hydrate_b']}, 'patterns': ['hydrate_derived']},
+        {'entity_id': 'hydrate_b', 'attributes': {'references': ['hydrate_c']}, 'patterns': ['hydrate_base']},
+        {'entity_id': 'hydrate_c', 'attributes': {'description': 'stored'}},
+    ])
+    writes = []
+
+    async def run():
+        atlas = ATLAS()
+        handler = StandInHandler(lambda prompt: None)
+        for name in BACKEND_WRITES:
+            monkeypatch.setattr(backend, name, lambda *args, name=name, **kwargs: writes.append(name))
+        report = atlas.hydrate({'OpenAI': handler}, page_size=2)
+        await handler.close()
+        return atlas, handler, report
+
+    atlas, handler, report = asyncio.run(run())
+    assert writes == []
+    assert (report['entities'], report['patterns'], report['iqueries']) == (3, 2, 2)
+    assert sorted(atlas.entities) == ['hydrate_a', 'hydrate_b', 'hydrate_c']
+    entity = atlas.entities['hydrate_a']
+    assert entity.model is backend.entities['hydrate_a']
+    assert [pattern.name for pattern in entity.patterns] == ['hydrate_derived']
+    assert [parent.name for parent in atlas.patterns['hydrate_derived'].parent_patterns] == ['hydrate_base']
+    # Inherited iQueries come first
+    assert [iquery.name for iquery in entity.iqueries] == ['hydrate_describe', 'hydrate_summarise']
+    summarise = entity.iqueries[1]
+    assert summarise.prompt_template == 'Summarise {description}' and summarise.resource_handlers == [handler]
+    assert atlas.entities['hydrate_c'].attributes == {'description': 'stored'}
+    assert atlas.reference_counts == Counter({'hydrate_b': 1, 'hydrate_c': 1})
+    assert set(atlas.reference_graph.ids) == {'hydrate_a', 'hydrate_b', 'hydrate_c'}
+    assert atlas.scheduler.pending() == {('hydrate_a', 'hydrate_describe'), ('hydrate_a', 'hydrate_summarise'),
+                                         ('hydrate_b', 'hydrate_describe')}
+
+
+def reference_graph(references):
+    graph = ReferenceGraph()
+    for entity_id, targets in references.items():
+        graph.set_references(entity_id, targets)
+    return graph
+
+
+def by_id(graph, scores):
+    return {entity_id: float(scores[row]) for entity_id, row in graph.index.items()}
+
+
+def random_references(seed, size=60):
+    rng = random.Random(seed)
+    ids = [f'node_{i}' for i in range(size)]
+    # A ring keeps the graph connected; extra references vary the degrees
+    return {entity_id: sorted({ids[(i + 1) % size], *rng.sample(ids, rng.randint(0, 4))})
+            for i, entity_id in enumerate(ids)}
+
+
+def test_hits_and_pagerank_match_hand_computed_scores():
+    graph = reference_graph({'a': ['c'], 'b': ['c'], 'c': ['a']})
+    hubs, authorities = graph.hits(tol=1e-12, max_iter=200)
+    # The authority matrix A^T A is diag(1, 0, 2): c is the only authority
+    assert by_id(graph, authorities) == pytest.approx({'a': 0.0, 'b': 0.0, 'c': 1.0}, abs=1e-9)
+    assert by_id(graph, hubs) == pytest.approx({'a': 0.5, 'b': 0.5, 'c': 0.0}, abs=1e-9)
+
+    graph = reference_graph({'a': ['b']})
+    # b is dangling: r_a = (0.85 r_b + 0.15) / 2 and r_b = 0.85 r_a + r_a
+    ranks = by_id(graph, graph.pagerank(tol=1e-12))
+    assert ranks == pytest.approx({'a': 1 / 2.85, 'b': 1.85 / 2.85})
+    assert ReferenceGraph().hits()[0].size == 0 and ReferenceGraph().pagerank().size == 0
+
+
+def test_hits_and_pagerank_match_networkx():
+    nx = pytest.importorskip('networkx')
+    references = random_references(seed=1)
+    graph = reference_graph(references)
+    hubs, authorities = graph.hits(tol=1e-12, max_iter=1000)
+    ranks = graph.pagerank(tol=1e-12)
+    digraph = nx.DiGraph([(source, target) for source, targets in references.items() for target in targets])
+    expected_hubs, expected_authorities = nx.hits(digraph, tol=1e-12, max_iter=1000)
+    assert by_id(graph, hubs) == pytest.approx(expected_hubs, abs=1e-8)
+    assert by_id(graph, authorities) == pytest.approx(expected_authorities, abs=1e-8)
+    assert by_id(graph, ranks) == pytest.approx(nx.pagerank(digraph, tol=1e-12), abs=1e-8)
+
+
+def test_reference_deltas_fold_into_the_same_matrix_as_a_fresh_build():
+    references = random_references(seed=2)
+    incremental = reference_graph(references)
+    incremental.matrix  # Fold the initial edges, then change them
+    rng = random.Random(3)
+    for entity_id in rng.sample(sorted(references), 20):
+        references[entity_id] = rng.sample(sorted(references), rng.randint(0, 3))
+        incremental.set_references(entity_id, references[entity_id])
+        if rng.random() < 0.3:
+            incremental.matrix
+    incremental.remove_node('node_0')
+    references['node_0'] = []
+    references['node_1'] = ['node_0', 'node_1', 'newcomer']
+    incremental.set_references('node_1', references['node_1'])
+
+    fresh = reference_graph(references)
+
+    def edges(graph):
+        rows, columns = graph.matrix.nonzero()
+        return sorted(zip((graph.ids[row] for row in rows), (graph.ids[column] for column in columns)))
+
+    assert edges(incremental) == edges(fresh)
+    assert set(incremental.matrix.data) == {1.0}
+    assert by_id(incremental, incremental.hits(tol=1e-12, max_iter=1000)[1]) == \
+        pytest.approx(by_id(fresh, fresh.hits(tol=1e-12, max_iter=1000)[1]), abs=1e-8)
+
+
+def test_warm_started_analysis_converges_to_the_cold_result(caplog):
+    references = random_references(seed=4, size=200)
+    graph = reference_graph(references)
+    graph.hits(tol=1e-10, max_iter=1000)
+    graph.pagerank(tol=1e-10)
+    references['node_0'] = references['node_0'] + ['node_50']
+    references['node_7'] = ['node_8']
+    for entity_id in ('node_0', 'node_7'):
+        graph.set_references(entity_id, references[entity_id])
+    cold = reference_graph(references)
+
+    with caplog.at_level(logging.DEBUG, logger='atlas.core.graph'):
+        warm_hubs, warm_authorities = graph.hits()
+        cold_hubs, cold_authorities = cold.hits()
+    iterations = [int(re.search(r'after (\d+) iterations', record.message).group(1))
+                  for record in caplog.records if 'HITS finished' in record.message]
+    assert 'did not converge' not in caplog.text
+    assert iterations[0] < iterations[1]
+    assert by_id(graph, warm_authorities) == pytest.approx(by_id(cold, cold_authorities), abs=1e-6)
+    assert by_id(graph, warm_hubs) == pytest.approx(by_id(cold, cold_hubs), abs=1e-6)
+    assert by_id(graph, graph.pagerank()) == pytest.approx(by_id(cold, cold.pagerank()), abs=1e-6)
+
+
+def test_budget_cut_cycle_does_not_hand_out_work_ahead_of_its_inputs():
+    describe = iQuery('budget_describe', 'description', [])
+    summarise = iQuery('budget_summarise', 'summary', [], prompt_template='Summarise {description}')
+    other = iQuery('budget_other', 'other', [])
+    entity = types.SimpleNamespace(entity_id='budget_entity', iqueries=[describe, summarise, other])
+    # The downstream iQuery is the most urgent one
+    priorities = {'budget_summarise': 10.0, 'budget_describe': 1.0}
+    scheduler = UpdateScheduler(priority_fn=lambda entity, name: priorities.get(name, 0.0))
+    scheduler.track_entity(entity)
+
+    def names(batch):
+        return [[iquery.name for iquery in iqueries] for _, iqueries in batch]
+
+    assert names(scheduler.take(CycleBudget(max_calls=1))) == [['budget_describe']]
+    assert scheduler.pending() == {('budget_entity', 'budget_summarise'), ('budget_entity', 'budget_other')}
+    assert names(scheduler.take(CycleBudget(max_calls=1))) == [['budget_summarise']]
+
+    scheduler.mark_dirty('budget_entity', 'budget_summarise')
+    scheduler.mark_dirty('budget_entity', 'budget_describe')
+    # Without a cut, both run in one local_update, which orders them
+    assert names(scheduler.take()) == [['budget_describe', 'budget_summarise', 'budget_other']]
+    assert not scheduler.pending()
+
+
+def test_unexpected_errors_of_an_iquery_are_logged_with_their_traceback(caplog):
+    def respond(prompt):
+        return {'attribute_value': 'ok', 'new_entities': [{'no_entity_id': True}]}
+
+    async def run():
+        atlas = ATLAS()
+        handler = StandInHandler(respond)
+        iquery = iQuery('logged_query', 'answer', [handler])
+        entity = Entity('logged_entity', [Pattern('logged_pattern', [iquery])])
+        with caplog.at_level(logging.ERROR, logger='atlas.core.entity'):
+            result = await entity.run_iquery(iquery, atlas.global_state)
+        await handler.close()
+        return atlas, result
+
+    atlas, result = asyncio.run(run())
+    assert result is False
+    assert ('logged_entity', 'logged_query') in atlas.scheduler.pending()
+    [record] = [record for record in caplog.records if record.name == 'atlas.core.entity']
+    assert "Entity 'logged_entity'" in record.getMessage() and record.exc_info[0] is KeyError
+
+
+class OpaqueCondition(Condition):
+    """A condition that cannot report what it reads."""
+
+    def evaluate(self, entity, global_state):
+        return True
+
+
+def is_set(actual, expected):
+    return actual is not None
+
+
+def dependency_iqueries():
+    return [
+        iQuery('dag_describe', 'description', []),
+        iQuery('dag_summarise', 'summary', [], prompt_template='Summarise {description} of {entity_id}'),
+        iQuery('dag_score', 'score', [], conditions=AttributeCondition('summary', None, is_set)),
+        iQuery('dag_tag', 'tag', [], conditions=GlobalCondition('phase', 'growth')),
+        iQuery('dag_redescribe', 'description', []),
+        iQuery('dag_label', 'label', [], conditions=AttributeCondition('tag', None, is_set) & GlobalCondition('phase', 1)),
+        iQuery('dag_opaque', 'opaque', [], conditions=OpaqueCondition()),
+    ]
+
+
+def test_dependency_graph_follows_conditions_and_template_fields():
+    iqueries = dependency_iqueries()
+    predecessors = build_dependency_graph(iqueries)
+    assert predecessors == [
+        set(),
+        {0},              # Reads {description}; entity_id is not an attribute
+        {1},              # Its condition reads summary
+        set(),            # Global keys are not attributes
+        {0},              # Writes the same attribute as an earlier iQuery
+        {3},              # Composite conditions read the union
+        {0, 1, 2, 3, 4, 5},  # Unknown reads wait for everything before
+    ]
+    assert dependency_depth(predecessors) == 4
+    assert dependency_depth([]) == 0
+
+
+def test_dependency_order_puts_readers_after_writers(caplog):
+    describe, summarise, score, tag, _, label, opaque = dependency_iqueries()
+    ordered = order_by_dependencies([opaque, label, score, summarise, tag, describe])
+    assert [iquery.name for iquery in ordered] == \
+        ['dag_tag', 'dag_label', 'dag_describe', 'dag_summarise', 'dag_score', 'dag_opaque']
+
+    first = iQuery('dag_cycle_first', 'first', [], prompt_template='{second}')
+    second = iQuery('dag_cycle_second', 'second', [], prompt_template='{first}')
+    with caplog.at_level(logging.WARNING, logger='atlas.core.dependencies'):
+        assert order_by_dependencies([second, first]) == [second, first]
+    assert 'Read cycle' in caplog.text
+
+
+class TimedHandler(StandInHandler):
+    """Records when each prompt starts and finishes."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+
+    async def execute(self, prompt, **kwargs):
+        self.events.append(('start', prompt))
+        try:
+            return await super().execute(prompt, **kwargs)
+        finally:
+            self.events.append(('end', prompt))
+
+
+def test_local_update_overlaps_independent_iqueries_and_orders_dependent_ones():
+    async def run():
+        atlas = ATLAS()
+        atlas.global_state['phase'] = 'growth'
+        handler = TimedHandler(lambda prompt: {'attribute_value': prompt.upper()}, latency=0.1)
+        iqueries = [
+            iQuery('overlap_describe', 'description', [handler], prompt_template='describe'),
+            iQuery('overlap_tag', 'tag', [handler], prompt_template='tag',
+                   conditions=GlobalCondition('phase', 'growth')),
+            iQuery('overlap_summarise', 'summary', [handler], prompt_template='summarise {description}'),
+            iQuery('overlap_score', 'score', [handler], prompt_template='score',
+                   conditions=AttributeCondition('summary', None, is_set)),
+        ]
+        entity = Entity('overlap_entity', [Pattern('overlap_pattern', iqueries)])
+        await entity.local_update(atlas.global_state)
+        await handler.close()
+        return entity, handler.events
+
+    entity, events = asyncio.run(run())
+    assert entity.attributes['summary'] == 'SUMMARISE DESCRIBE' and entity.attributes['score'] == 'SCORE'
+    # describe and tag run together; summarise waits for describe, score for summarise
+    assert events[:2] == [('start', 'describe'), ('start', 'tag')]
+    assert events.index(('start', 'summarise DESCRIBE')) > events.index(('end', 'describe'))
+    assert events.index(('start', 'score')) > events.index(('end', 'summarise DESCRIBE'))
+
+
+class GatedHandler(StandInHandler):
+    """Holds every call until ``gate`` is set."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gate = asyncio.Event()
+
+    async def execute(self, prompt, **kwargs):
+        await self.gate.wait()
+        return await super().execute(prompt, **kwargs)
+
+
+async def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'Timed out'
+        await asyncio.sleep(0.01)
+
+
+def test_worker_pool_queue_applies_backpressure(fresh_atlas):
+    async def run():
+        atlas = ATLAS()
+        handler = GatedHandler(lambda prompt: {'attribute_value': 'done'})
+        pattern = Pattern('pressure_pattern', [iQuery('pressure_query', 'answer', [handler])])
+        entities = [Entity(f'pressure_{i}', [pattern]) for i in range(6)]
+        pool = WorkerPool(atlas, num_workers=1, queue_size=2, item_deadline=5, retry_delay=5)
+        running = asyncio.create_task(pool.run())
+        await wait_until(lambda: pool.queue is not None and pool.queue.full())
+        await asyncio.sleep(0.05)
+        # One item running, two queued and one waiting to be put; the rest
+        # stay in the scheduler's heap
+        held = (pool.queue.qsize(), len(atlas.scheduler))
+        handler.gate.set()
+        await wait_until(lambda: pool.completed == 6)
+        pool.stop()
+        await running
+        await handler.close()
+        return atlas, entities, held
+
+    atlas, entities, held = asyncio.run(run())
+    assert held == (2, 2)
+    assert all(entity.attributes['answer'] == 'done' for entity in entities)
+    assert not atlas.scheduler.pending()
+
+
+@pytest.mark.parametrize('outcome', ['timeout', 'failure'])
+def test_worker_pool_retries_failed_and_late_items_after_the_retry_delay(fresh_atlas, outcome):
+    calls = []
+
+    async def run():
+        atlas = ATLAS()
+
+        class FlakyHandler(StandInHandler):
+            async def execute(self, prompt, **kwargs):
+                calls.append(time.monotonic())
+                if len(calls) == 1:
+                    if outcome == 'timeout':
+                        await asyncio.sleep(5)
+                    return None
+                return {'attribute_value': 'recovered'}
+
+        handler = FlakyHandler(None)
+        pattern = Pattern(f'flaky_{outcome}', [iQuery(f'flaky_{outcome}', 'answer', [handler])])
+        entity = Entity(f'flaky_{outcome}_entity', [pattern])
+        pool = WorkerPool(atlas, num_workers=2, queue_size=4, item_deadline=0.1, retry_delay=0.2)
+        running = asyncio.create_task(pool.run())
+        await wait_until(lambda: pool.failed + pool.timed_out == 1)
+        # Neither queued nor running until the retry delay has passed
+        waiting = atlas.scheduler.pending()
+        await wait_until(lambda: pool.completed == 1)
+        pool.stop()
+        await running
+        await handler.close()
+        return entity, pool, waiting
+
+    entity, pool, waiting = asyncio.run(run())
+    assert (pool.timed_out, pool.failed) == ((1, 0) if outcome == 'timeout' else (0, 1))
+    assert waiting == set()
+    assert entity.attributes['answer'] == 'recovered'
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.2
+
+
+def test_worker_pool_picks_up_work_registered_while_it_runs(fresh_atlas):
+    async def run():
+        atlas = ATLAS()
+        handler = StandInHandler(lambda prompt: {'attribute_value': 'picked up'})
+        pattern = Pattern('pickup_pattern', [iQuery('pickup_query', 'answer', [handler])])
+        pool = WorkerPool(atlas, num_workers=2, queue_size=4)
+        running = asyncio.create_task(pool.run())
+        await asyncio.sleep(0.05)  # The feeder is waiting for work
+        started = time.monotonic()
+        entity = Entity('pickup_entity', [pattern])
+        await wait_until(lambda: pool.completed == 1)
+        latency = time.monotonic() - started
+        pool.stop()
+        await running
+        await handler.close()
+        return entity, latency
+
+    entity, latency = asyncio.run(run())
+    assert entity.attributes['answer'] == 'picked up'
+    assert latency < 1  # Fed when marked dirty, not at the next update interval
+
+
+def counting_batches(backend, monkeypatch):
+    batches = []
+    batch_create = backend.batch_create_entities
+
+    def recording(entities_data, *args, **kwargs):
+        batches.append([data['entity_id'] for data in entities_data])
+        return batch_create(entities_data, *args, **kwargs)
+
+    monkeypatch.setattr(backend, 'batch_create_entities', recording)
+    return batches
+
+
+@pytest.mark.parametrize('mode', ['sync', 'async'])
+def test_generated_entities_are_deduplicated_and_written_in_one_batch(fresh_atlas, memory_backend, monkeypatch,
+                                                                      mode):
+    generated = [
+        {'entity_id': 'Health Policy', 'patterns': ['dedup_pattern'], 'attributes': {'source': 'first'}},
+        {'entity_id': 'health_policy', 'attributes': {'source': 'duplicate'}},
+        {'entity_id': ' HEALTH  POLICY ', 'attributes': {'source': 'duplicate'}},
+        {'entity_id': 'Known Entity', 'attributes': {'source': 'duplicate'}},
+        {'entity_id': 'Trade', 'patterns': ['unknown_pattern']},
+        {'entity_id': 'trade'},
+    ]
+
+    async def run():
+        atlas = ATLAS()
+        pattern = Pattern('dedup_pattern', [iQuery('dedup_query', 'answer', [])])
+        Entity('known_entity', attributes={'source': 'registered'})
+        batches = counting_batches(memory_backend, monkeypatch)
+        if mode == 'async':
+            created = await atlas.register_entities_async(generated)
+            again = await atlas.register_entities_async(generated)
+        else:
+            created = atlas.register_entities(generated)
+            again = atlas.register_entities(generated)
+        return atlas, pattern, created, again, batches
+
+    atlas, pattern, created, again, batches = asyncio.run(run())
+    assert batches == [['Health Policy', 'Trade']]
+    assert [entity.entity_id for entity in created] == ['Health Policy', 'Trade'] and again == []
+    assert created[0].patterns == [pattern] and created[1].patterns == []
+    assert memory_backend.get_entity('Health Policy').attributes == {'source': 'first'}
+    assert memory_backend.get_entity('known_entity').attributes == {'source': 'registered'}
+    assert sorted(memory_backend.entities) == ['Health Policy', 'Trade', 'known_entity']
+    assert sorted(atlas.entities) == ['Health Policy', 'Trade', 'known_entity']
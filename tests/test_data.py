@@ -0,0 +1,333 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from atlas.data import backends
+from atlas.data.async_repository import AsyncRepository
+from atlas.data.backends import create_backend
+from atlas.data.backends.memory import MemoryBackend
+from atlas.data.backends.sqlite import SQLiteBackend
+from atlas.data.repository import IdentityMap, Repository, WriteBehindBuffer, identity_map
+from atlas.utils.config import config
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request):
+    # The same cases run against every backend that needs no external service
+    backend = create_backend(request.param, **({'path': ':memory:'} if request.param == 'sqlite' else {}))
+    yield backend
+    backend.close()
+
+
+def test_backend_creates_updates_and_links_records(backend):
+    entity = backend.create_entity('node', {'a': 1})
+    pattern = backend.create_pattern('kind')
+    parent = backend.create_pattern('base_kind')
+    iquery = backend.create_iquery('describe', 'description', prompt_template='Describe {entity_id}')
+    handler = backend.create_resource_handler('llm', {'model': 'small'})
+    backend.add_pattern_to_entity(entity, pattern)
+    backend.add_pattern_to_entity(entity, pattern)
+    backend.add_parent_pattern(pattern, parent)
+    backend.add_iquery_to_pattern(pattern, iquery)
+    backend.add_resource_handler_to_iquery(iquery, handler)
+    backend.update_iquery_status(iquery, 'completed')
+
+    assert backend.update_entity_attributes('node', {'b': 2}).attributes == {'a': 1, 'b': 2}
+    assert backend.update_entity_attributes('missing', {'b': 2}) is None
+    assert backend.bulk_update_attributes({'node': {'c': 3}, 'missing': {'c': 3}}, removals={'node': ['a']}) == ['node']
+    assert backend.get_entity('node').attributes == {'b': 2, 'c': 3}
+    assert backend.get_entity('node').uid == entity.uid
+    assert backend.get_iquery('describe').status == 'completed'
+    assert backend.get_iquery('describe').prompt_template == 'Describe {entity_id}'
+    assert backend.get_resource_handler('llm').config == {'model': 'small'}
+    assert backend.get_pattern('kind').name == 'kind'
+    assert backend.get_entity('missing') is None and backend.get_pattern('missing') is None
+
+    backend.remove_pattern_from_entity(entity, pattern)
+    assert backend.load_snapshot().entity_patterns.get('node', []) == []
+    backend.delete_entity('node')
+    assert backend.get_entity('node') is None
+
+
+def test_backend_loads_the_whole_graph_in_pages(backend):
+    pattern = backend.create_pattern('kind')
+    iquery = backend.create_iquery('describe', 'description')
+    backend.add_iquery_to_pattern(pattern, iquery)
+    backend.add_resource_handler_to_iquery(iquery, backend.create_resource_handler('llm'))
+    for i in range(7):
+        backend.add_pattern_to_entity(backend.create_entity(f'node_{i}', {'i': i}), pattern)
+
+    snapshot = backend.load_snapshot(page_size=3)
+    assert sorted((record.entity_id, record.attributes['i']) for record in snapshot.entities) == \
+        [(f'node_{i}', i) for i in range(7)]
+    assert [record.name for record in snapshot.patterns] == ['kind']
+    assert [record.name for record in snapshot.iqueries] == ['describe']
+    assert [record.handler_type for record in snapshot.resource_handlers] == ['llm']
+    assert snapshot.entity_patterns == {f'node_{i}': ['kind'] for i in range(7)}
+    assert snapshot.pattern_iqueries == {'kind': ['describe']}
+    assert snapshot.iquery_handlers == {'describe': ['llm']}
+    assert snapshot.pattern_parents == {}
+
+
+@pytest.mark.parametrize('on_match, expected', [
+    ('merge', {'stored': 1, 'first': 1, 'second': 2}),
+    ('replace', {'second': 2}),
+    ('keep', {'stored': 1, 'first': 0}),
+])
+def test_backend_batch_upserts_follow_the_on_match_mode(backend, on_match, expected):
+    backend.create_entity('node', {'stored': 1, 'first': 0})
+    backend.create_pattern('kind')
+    records = backend.batch_create_entities([
+        {'entity_id': 'node', 'attributes': {'first': 1}, 'patterns': ['kind']},
+        {'entity_id': 'new', 'attributes': {'x': 1}, 'patterns': ['unknown']},
+        # A second candidate for the same ID in the same batch
+        {'entity_id': 'node', 'attributes': {'second': 2}},
+    ], on_match=on_match, batch_size=10)
+    assert [record.entity_id for record in records] == ['node', 'new', 'node']
+    assert backend.get_entity('node').attributes == expected
+    assert backend.get_entity('new').attributes == {'x': 1}
+    # Links to unknown patterns are skipped
+    assert backend.load_snapshot().entity_patterns == {'node': ['kind']}
+    with pytest.raises(ValueError):
+        backend.batch_create_entities([{'entity_id': 'node'}], on_match='overwrite')
+
+
+def test_sqlite_migrations_upgrade_old_databases_and_can_run_again(tmp_path):
+    path = str(tmp_path / 'atlas.db')
+    with sqlite3.connect(path) as connection:
+        # iqueries as created before prompt templates were stored
+        connection.execute("CREATE TABLE iqueries (id INTEGER PRIMARY KEY, uid TEXT NOT NULL, name TEXT NOT NULL, "
+                           "target_attribute TEXT NOT NULL, conditions TEXT NOT NULL DEFAULT '[]', "
+                           "status TEXT NOT NULL DEFAULT 'pending')")
+        connection.execute("INSERT INTO iqueries (uid, name, target_attribute) VALUES ('uid', 'old', 'value')")
+    connection.close()
+
+    backend = SQLiteBackend(path)
+    assert backend.get_iquery('old').prompt_template is None
+    backend.create_iquery('new', 'value', prompt_template='About {entity_id}')
+    backend.close()
+
+    backend = SQLiteBackend(path)
+    assert backend.get_iquery('old').target_attribute == 'value'
+    assert backend.get_iquery('new').prompt_template == 'About {entity_id}'
+    backend.close()
+
+
+@pytest.mark.parametrize('on_match, expected', [
+    ('merge', {'kept': 'stored', 'changed': 'new', 'added': 'new'}),
+    ('replace', {'changed': 'new', 'added': 'new'}),
+    ('keep', {'kept': 'stored', 'changed': 'stored'}),
+])
+def test_repository_batch_create_entities_on_match(on_match, expected):
+    repository = Repository(MemoryBackend())
+    repository.create_pattern('kind')
+    existing = [f'{on_match}_existing_{i}' for i in range(3)]
+    for entity_id in existing:
+        repository.create_entity(entity_id, {'kept': 'stored', 'changed': 'stored'})
+        repository.get_entity_by_id(entity_id)  # Cached before the batch
+    new = [f'{on_match}_new_{i}' for i in range(2)]
+    entities_data = [
+        {'entity_id': entity_id, 'attributes': {'changed': 'new', 'added': 'new'}, 'patterns': ['kind']}
+        for entity_id in existing + new
+    ]
+    records = repository.batch_create_entities(entities_data, on_match=on_match, batch_size=2)
+
+    assert [record.entity_id for record in records] == existing + new
+    for entity_id in existing:
+        assert repository.get_entity_by_id(entity_id).attributes == expected
+    for entity_id in new:
+        # New entities are created with their attributes in every mode
+        assert repository.get_entity_by_id(entity_id).attributes == {'changed': 'new', 'added': 'new'}
+    assert repository.load_snapshot().entity_patterns == {entity_id: ['kind'] for entity_id in existing + new}
+
+
+def test_repository_batch_create_entities_rejects_unknown_modes():
+    repository = Repository(MemoryBackend())
+    with pytest.raises(ValueError):
+        repository.batch_create_entities([{'entity_id': 'rejected'}], on_match='upsert')
+    assert repository.backend.get_entity('rejected') is None
+
+
+def test_identity_map_counts_hits_misses_and_evictions():
+    identity_map = IdentityMap(maxsize=2, ttl=60)
+    loads = []
+
+    def loader(key):
+        return lambda: loads.append(key) or f'record {key}'
+
+    assert identity_map.get('entity', 'a', loader('a')) == 'record a'
+    assert identity_map.get('entity', 'a', loader('a')) == 'record a'
+    assert identity_map.get('entity', 'missing', lambda: None) is None
+    identity_map.put('entity', 'b', 'record b')
+    identity_map.put('entity', 'c', 'record c')  # Evicts 'a', the least recently used
+    assert identity_map.get('entity', 'a', loader('a')) == 'record a'
+
+    assert loads == ['a', 'a']
+    assert identity_map.stats() == {
+        'hits': 1, 'misses': 3, 'evictions': 2, 'expirations': 0, 'hit_rate': 0.25, 'size': 2,
+    }
+
+
+def test_identity_map_expires_entries_after_the_ttl():
+    identity_map = IdentityMap(maxsize=10, ttl=0.05)
+    identity_map.put('entity', 'a', 'record a')
+    identity_map.put('entity', 'b', 'record b')
+    assert identity_map.get('entity', 'a', lambda: None) == 'record a'
+    time.sleep(0.1)
+    assert identity_map.get('entity', 'a', lambda: None) is None
+    identity_map.put('entity', 'c', 'record c')  # Writes purge expired entries
+    assert identity_map.stats()['expirations'] == 2
+    assert len(identity_map) == 1
+
+
+def test_identity_map_takes_zero_limits_as_given(monkeypatch):
+    monkeypatch.setattr(config, 'ATLAS_IDENTITY_MAP_TTL', 60)
+    identity_map = IdentityMap(ttl=0)
+    identity_map.put('entity', 'a', 'record a')
+    # A TTL of 0 disables caching rather than falling back to the setting
+    assert identity_map.get('entity', 'a', lambda: None) is None
+
+
+class SlowBackend(MemoryBackend):
+    """A memory backend whose reads take as long as a remote round trip."""
+
+    def __init__(self, latency):
+        super().__init__()
+        self.latency = latency
+        self.threads = []
+
+    def get_entity(self, entity_id):
+        self.threads.append(threading.current_thread().name)
+        time.sleep(self.latency)
+        return super().get_entity(entity_id)
+
+
+def test_async_repository_keeps_the_event_loop_responsive():
+    backend = SlowBackend(latency=0.2)
+    for i in range(4):
+        backend.create_entity(f'slow_{i}', {'i': i})
+    repository = AsyncRepository(Repository(backend))
+
+    async def run():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def tick():
+            nonlocal ticks
+            while not done.is_set():
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        started = time.monotonic()
+        # Fresh IDs: the identity map must not answer these from memory
+        records = await asyncio.gather(*(repository.get_entity_by_id(f'slow_{i}') for i in range(4)))
+        elapsed = time.monotonic() - started
+        done.set()
+        await ticker
+        return records, ticks, elapsed
+
+    records, ticks, elapsed = asyncio.run(run())
+    assert [record.attributes['i'] for record in records] == [0, 1, 2, 3]
+    # The four reads overlap on the shared pool while the loop keeps ticking
+    assert elapsed < 0.6 and ticks >= 10
+    assert len(backend.threads) == 4 and all(name.startswith('atlas-repository') for name in backend.threads)
+
+
+class FlakyBackend(MemoryBackend):
+    """A memory backend that records bulk updates and can fail them."""
+
+    def __init__(self):
+        super().__init__()
+        self.batches = []
+        self.failures = 0
+
+    def bulk_update_attributes(self, updates, removals=None):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError('write failed')
+        self.batches.append((threading.current_thread().name, sorted(updates)))
+        return super().bulk_update_attributes(updates, removals)
+
+
+@pytest.fixture
+def flaky_backend(monkeypatch):
+    # Flushes write through Repository(), i.e. the process-wide backend
+    backend = FlakyBackend()
+    monkeypatch.setattr(backends, '_backend', backend)
+    identity_map.clear()
+    yield backend
+    identity_map.clear()
+
+
+def test_write_behind_coalesces_updates_per_entity(flaky_backend):
+    flaky_backend.create_entity('a', {'x': 0, 'z': 0})
+    flaky_backend.create_entity('b', {})
+    buffer = WriteBehindBuffer(max_entities=10, max_delay=60)
+    buffer.stage('a', {'x': 1})
+    buffer.stage('a', {'x': 2, 'y': 1}, removals=['z'])
+    buffer.stage('b', {'x': 1})
+    buffer.stage('b', removals=['x'])
+    assert len(buffer) == 2 and flaky_backend.batches == []
+
+    assert buffer.flush() == 2
+    assert [keys for _, keys in flaky_backend.batches] == [['a', 'b']]
+    assert flaky_backend.get_entity('a').attributes == {'x': 2, 'y': 1}
+    assert flaky_backend.get_entity('b').attributes == {}
+    assert (buffer.staged, buffer.flushed, buffer.flushes) == (4, 2, 1)
+    assert buffer.flush() == 0 and buffer.flushes == 1
+
+
+def test_write_behind_flushes_at_the_entity_and_age_thresholds(flaky_backend):
+    buffer = WriteBehindBuffer(max_entities=3, max_delay=60)
+    for entity_id in ('a', 'b', 'a'):
+        buffer.stage(entity_id, {'x': 1})
+    assert flaky_backend.batches == []
+    buffer.stage('c', {'x': 1})
+    assert [keys for _, keys in flaky_backend.batches] == [['a', 'b', 'c']] and len(buffer) == 0
+
+    buffer = WriteBehindBuffer(max_entities=100, max_delay=0.05)
+    buffer.stage('d', {'x': 1})
+    time.sleep(0.1)
+    buffer.stage('e', {'x': 1})
+    assert [keys for _, keys in flaky_backend.batches][1:] == [['d', 'e']]
+
+
+def test_write_behind_queues_one_background_flush_from_the_event_loop(flaky_backend):
+    buffer = WriteBehindBuffer(max_entities=2, max_delay=60)
+
+    async def run():
+        # Keep the flusher thread busy so staged updates pile up behind it
+        release = threading.Event()
+        blocked = asyncio.get_running_loop().run_in_executor(buffer._flusher, release.wait)
+        for i in range(6):
+            buffer.stage(f'node_{i}', {'i': i})
+        assert flaky_backend.batches == []
+        release.set()
+        await blocked
+        await buffer.drain()
+
+    asyncio.run(run())
+    # One queued flush took all six; the drain found nothing left
+    assert [keys for _, keys in flaky_backend.batches] == [[f'node_{i}' for i in range(6)]]
+    assert flaky_backend.batches[0][0].startswith('atlas-write-behind')
+    assert buffer.flushes == 1
+
+
+def test_write_behind_puts_changes_back_after_a_failed_flush(flaky_backend):
+    flaky_backend.create_entity('a', {})
+    buffer = WriteBehindBuffer(max_entities=10, max_delay=60)
+    buffer.stage('a', {'x': 1, 'kept': 1})
+    flaky_backend.failures = 1
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    assert len(buffer) == 1 and buffer.flushes == 0
+    # Staged after the failure: newer than the changes put back
+    buffer.stage('a', {'x': 2})
+
+    assert buffer.flush() == 1
+    assert flaky_backend.get_entity('a').attributes == {'x': 2, 'kept': 1}
+    assert (buffer.flushed, buffer.flushes) == (1, 1)
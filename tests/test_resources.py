@@ -0,0 +1,290 @@
+import asyncio
+import contextlib
+import json
+import threading
+import time
+
+import pytest
+from aiohttp import web
+
+from atlas.resources import response_processor
+from atlas.resources.openai_handler import OpenAIGPTHandler
+from atlas.resources.rate_limiter import RateLimiter
+from atlas.resources.response_cache import ResponseCache
+from atlas.resources.response_processor import ResponseBatcher
+from atlas.resources.streaming import StreamMetrics
+
+
+def sse_chunk(text):
+    return 'data: ' + json.dumps({'choices': [{'delta': {'content': text}}]})
+
+
+class StandInAPI:
+    """
+    Local stand-in for the chat completions endpoint.
+
+    Streams ``lines`` as server-sent events, one every ``token_delay``
+    seconds, or answers with ``text`` as one JSON body when not streaming.
+    The first ``overloads`` requests get a 429 with ``retry_after``.
+    """
+
+    def __init__(self, words=('Hello', ' world'), lines=None, token_delay=0.0, overloads=0, retry_after=None):
+        self.text = ''.join(words)
+        self.lines = lines if lines is not None else [sse_chunk(word) for word in words] + ['data: [DONE]']
+        self.token_delay = token_delay
+        self.overloads = overloads
+        self.retry_after = retry_after
+        self.request_times = []
+        self.chunks_sent = 0
+        self.aborted = 0
+
+    @property
+    def requests(self):
+        return len(self.request_times)
+
+    async def chat_completions(self, request):
+        payload = await request.json()
+        self.request_times.append(time.monotonic())
+        if self.requests <= self.overloads:
+            headers = {} if self.retry_after is None else {'Retry-After': str(self.retry_after)}
+            return web.json_response({'error': {'message': 'Rate limited'}}, status=429, headers=headers)
+        if not payload.get('stream'):
+            return web.json_response({'choices': [{'message': {'content': self.text}}], 'usage': {}})
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+        await response.prepare(request)
+        try:
+            for line in self.lines:
+                await asyncio.sleep(self.token_delay)
+                await response.write(line.encode() + b'\n\n')
+                self.chunks_sent += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            # The client went away
+            self.aborted += 1
+        return response
+
+
+class TextProcessor:
+    """Stands in for the spaCy processing, which is tested on its own."""
+
+    async def process_async(self, response):
+        return {'text': response} if response else None
+
+
+@contextlib.asynccontextmanager
+async def serving(api):
+    """
+    Run ``api`` on a local port and yield an OpenAIGPTHandler pointed at it.
+    """
+    app = web.Application()
+    app.router.add_post('/v1/chat/completions', api.chat_completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    handler = OpenAIGPTHandler(api_base_url=f'http://127.0.0.1:{port}/v1')
+    handler.response_processor = TextProcessor()
+    try:
+        yield handler
+    finally:
+        await handler.close()
+        await runner.cleanup()
+
+
+@pytest.fixture
+def fresh_nlp(monkeypatch):
+    # get_nlp caches the pipeline for the process
+    monkeypatch.setattr(response_processor, '_nlp', None)
+
+
+def test_nlp_pipeline_has_only_the_needed_components(fresh_nlp):
+    pytest.importorskip('spacy')
+    assert response_processor.get_nlp().pipe_names == list(response_processor.COMPONENTS)
+
+
+def test_nlp_pipeline_excludes_unneeded_model_components(fresh_nlp, monkeypatch):
+    spacy = pytest.importorskip('spacy')
+    if not spacy.util.is_package(response_processor.SPACY_MODEL):
+        pytest.skip(f"{response_processor.SPACY_MODEL} is not installed")
+    monkeypatch.setattr(response_processor, 'COMPONENTS', ('tok2vec',))
+    assert response_processor.get_nlp().pipe_names == ['tok2vec']
+
+
+def test_response_cache_disk_tier_runs_off_the_event_loop(tmp_path, monkeypatch):
+    path = str(tmp_path / 'responses.db')
+    loop_threads = []
+
+    async def run():
+        loop_threads.append(threading.get_ident())
+        cache = ResponseCache(path=path)
+        await cache.put_async('key', 'response')
+        # A new cache starts with an empty memory tier
+        reopened = ResponseCache(path=path)
+        disk_get = reopened._get_disk
+        disk_threads = []
+
+        def recording_get_disk(key):
+            disk_threads.append(threading.get_ident())
+            return disk_get(key)
+
+        monkeypatch.setattr(reopened, '_get_disk', recording_get_disk)
+        results = [await reopened.get_async('key'), await reopened.get_async('key'),
+                   await reopened.get_async('other')]
+        stats = reopened.stats()
+        cache.close()
+        reopened.close()
+        return results, stats, disk_threads
+
+    results, stats, disk_threads = asyncio.run(run())
+    assert results == ['response', 'response', None]
+    assert (stats['memory_hits'], stats['disk_hits'], stats['misses']) == (1, 1, 1)
+    assert len(disk_threads) == 2 and loop_threads[0] not in disk_threads
+
+
+def test_response_cache_defaults_to_memory_only():
+    cache = ResponseCache()
+    assert cache.path == '' and cache._connection is None
+    assert asyncio.run(cache.get_async('key')) is None
+    asyncio.run(cache.put_async('key', 'response'))
+    assert asyncio.run(cache.get_async('key')) == 'response'
+
+
+def test_identical_requests_share_one_call():
+    api = StandInAPI(token_delay=0.01)
+
+    async def run():
+        async with serving(api) as handler:
+            return await asyncio.gather(*(handler.execute('same prompt') for _ in range(3)))
+
+    assert asyncio.run(run()) == [{'text': 'Hello world'}] * 3
+    assert api.requests == 1
+
+
+def test_streams_with_partial_callbacks_are_not_coalesced():
+    api = StandInAPI(token_delay=0.01)
+    partials = [[], []]
+
+    async def run():
+        async with serving(api) as handler:
+            return await asyncio.gather(*(
+                handler.execute('same prompt', stream=True, on_partial=received.append) for received in partials
+            ))
+
+    assert asyncio.run(run()) == [{'text': 'Hello world'}] * 2
+    assert partials == [['Hello', 'Hello world']] * 2
+    assert api.requests == 2
+
+
+def test_retry_after_pauses_every_request_with_the_same_credentials():
+    api = StandInAPI(overloads=1, retry_after=0.2)
+
+    async def run():
+        async with serving(api) as handler:
+            async def later():
+                await asyncio.sleep(0.05)  # Sent while the first request is paused
+                return await handler.execute('second')
+
+            return await asyncio.gather(handler.execute('first'), later()), handler.rate_limiter.stats()
+
+    results, stats = asyncio.run(run())
+    assert results == [{'text': 'Hello world'}] * 2
+    assert stats['overloads'] == 1 and stats['in_flight'] == 0
+    first, *others = api.request_times
+    assert len(others) == 2 and all(at - first >= 0.2 for at in others)
+
+
+def test_rate_limiter_is_usable_from_successive_event_loops():
+    limiter = RateLimiter(requests_per_minute=6000, tokens_per_minute=0, initial_concurrency=1,
+                          min_concurrency=1, max_concurrency=1)
+
+    async def contend():
+        async def request():
+            async with limiter.slot():
+                await asyncio.sleep(0.01)
+
+        # Waiting for the single slot binds the asyncio primitives to this loop
+        await asyncio.gather(*(request() for _ in range(3)))
+
+    asyncio.run(contend())
+    asyncio.run(contend())
+    assert limiter.stats()['in_flight'] == 0
+
+
+def test_response_batcher_is_usable_from_successive_event_loops(monkeypatch):
+    monkeypatch.setattr(response_processor, 'process_batch', lambda texts, batch_size: [{'text': t} for t in texts])
+    batcher = ResponseBatcher(batch_size=10, max_delay=0.05, processes=0)
+
+    async def abandon():
+        # Cancelled before the batch is dispatched; the loop then closes
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(batcher.submit('abandoned'), timeout=0.01)
+
+    async def submit():
+        return await asyncio.wait_for(batcher.submit('answered'), timeout=1)
+
+    asyncio.run(abandon())
+    assert asyncio.run(submit()) == {'text': 'answered'}
+    batcher.close()
+
+
+def test_streamed_completion_is_assembled_with_partial_values():
+    api = StandInAPI(words=('The', ' quick', ' fox'))
+    partials = []
+
+    async def run():
+        async with serving(api) as handler:
+            result = await handler.execute('prompt', stream=True, on_partial=partials.append)
+            return result, handler.stream_metrics.stats()
+
+    result, stats = asyncio.run(run())
+    assert result == {'text': 'The quick fox'}
+    assert partials == ['The', 'The quick', 'The quick fox']
+    assert (stats['streams'], stats['cancelled'], stats['last']['tokens']) == (1, 0, 3)
+
+
+def test_stream_skips_malformed_lines_and_stops_at_done():
+    lines = [
+        ': keep-alive',
+        sse_chunk('Hello'),
+        'data: {not json',
+        'event: ping',
+        sse_chunk(' world'),
+        'data: {"choices": [], "usage": {"completion_tokens": 7}}',
+        'data: [DONE]',
+        sse_chunk(' after the end'),
+    ]
+    api = StandInAPI(lines=lines)
+
+    async def run():
+        async with serving(api) as handler:
+            return await handler.execute('prompt', stream=True), handler.stream_metrics.stats()
+
+    result, stats = asyncio.run(run())
+    assert result == {'text': 'Hello world'}
+    assert stats['last']['tokens'] == 7 and stats['last']['completed']
+
+
+def test_cancelled_stream_closes_the_connection():
+    api = StandInAPI(words=[f'word{i} ' for i in range(100)], token_delay=0.01)
+
+    async def run():
+        async with serving(api) as handler:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(handler.execute('prompt', stream=True), timeout=0.1)
+            await asyncio.sleep(0.1)  # Let the server notice
+            return handler.stream_metrics.stats()
+
+    stats = asyncio.run(run())
+    assert (stats['streams'], stats['cancelled']) == (1, 1)
+    assert not stats['last']['completed']
+    assert api.aborted == 1 and api.chunks_sent < 50
+
+
+def test_mean_time_to_first_token_only_counts_streams_that_produced_one():
+    metrics = StreamMetrics()
+    metrics.record(0.2, 10, 1.0)
+    metrics.record(None, 0, 0.0, completed=False)
+    metrics.record(0.4, 10, 1.0)
+    stats = metrics.stats()
+    assert stats['streams'] == 3 and stats['cancelled'] == 1
+    assert stats['mean_ttft'] == pytest.approx(0.3)
@@ -0,0 +1,154 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import types
+
+import pytest
+
+from atlas.utils import circuitbreaker
+from atlas.utils.circuitbreaker import AsyncCircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    """A monotonic clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the breaker's clock; the event loop keeps the real one
+    monkeypatch.setattr(circuitbreaker, 'time', types.SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+def breaker(**options):
+    defaults = dict(window=10, min_calls=4, failure_rate=0.5, slow_call_seconds=1.0, slow_call_rate=0.5,
+                    reset_timeout=5, half_open_calls=2)
+    return AsyncCircuitBreaker('test', **{**defaults, **options})
+
+
+def test_breaker_only_counts_calls_in_the_rolling_window(clock):
+    circuit = breaker()
+    for ok in (False, False, True):
+        circuit.record(ok, 0.1)
+    clock.advance(11)
+    # The earlier failures have left the window
+    for ok in (True, False, True):
+        circuit.record(ok, 0.1)
+    assert circuit.state == circuit.CLOSED
+    assert circuit.stats()['calls'] == 3
+    circuit.record(False, 0.1)
+    assert circuit.state == circuit.OPEN
+    assert not circuit.allows()
+
+
+def test_half_open_breaker_admits_a_limited_number_of_probes(clock):
+    circuit = breaker()
+    for _ in range(4):
+        circuit.record(False, 0.1)
+    clock.advance(5)
+
+    async def run():
+        release = asyncio.Event()
+        admitted = []
+
+        async def probe():
+            async with circuit.attempt():
+                admitted.append(circuit.state)
+                await release.wait()
+
+        probes = [asyncio.create_task(probe()) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(CircuitOpenError):
+            async with circuit.attempt():
+                pass
+        release.set()
+        await asyncio.gather(*probes)
+        return admitted
+
+    assert asyncio.run(run()) == [circuit.HALF_OPEN] * 2
+    assert circuit.state == circuit.CLOSED
+    assert (circuit.stats()['opened'], circuit.stats()['rejected']) == (1, 1)
+
+
+def test_slow_calls_trip_the_breaker_until_probes_are_fast(clock):
+    circuit = breaker()
+
+    async def call(seconds):
+        async with circuit.attempt():
+            clock.advance(seconds)
+
+    async def run():
+        for seconds in (2.0, 0.1, 2.0, 0.1):
+            await call(seconds)
+        opened = circuit.state
+        clock.advance(5)
+        await call(2.0)  # A slow probe opens the circuit again
+        reopened = circuit.state
+        clock.advance(5)
+        await call(0.1)
+        await call(0.1)
+        return opened, reopened
+
+    assert asyncio.run(run()) == (circuit.OPEN, circuit.OPEN)
+    assert circuit.state == circuit.CLOSED and circuit.opened == 2
+
+
+IMPORT_PROBE = """
+import json, sys
+
+class Recorder:
+    # Records attempted imports of spaCy without providing or hiding it
+    attempted = []
+
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] == 'spacy':
+            self.attempted.append(name)
+        return None
+
+sys.meta_path.insert(0, Recorder())
+
+def state():
+    from atlas.utils import config
+    return {'settings': 'atlas.utils.settings' in sys.modules and config._settings is not None,
+            'pydantic': 'pydantic' in sys.modules,
+            'processor': 'atlas.resources.response_processor' in sys.modules,
+            'spacy': bool(Recorder.attempted)}
+
+import atlas
+steps = [state()]
+atlas.config.ATLAS_IDENTITY_MAP_SIZE
+steps.append(state())
+processor = atlas.ResponseProcessor()
+steps.append(state())
+try:
+    processor.nlp
+except ImportError:
+    pass  # spaCy is not installed; the attempt is what is recorded
+steps.append(state())
+print(json.dumps(steps))
+"""
+
+
+def test_importing_atlas_defers_settings_and_spacy_until_used():
+    # A fresh interpreter: the test session has long imported everything
+    output = subprocess.run([sys.executable, '-c', IMPORT_PROBE], capture_output=True, text=True, check=True,
+                            env=os.environ.copy()).stdout
+    steps = [tuple(name for name, loaded in step.items() if loaded) for step in json.loads(output)]
+    assert steps == [
+        (),
+        ('settings', 'pydantic'),
+        ('settings', 'pydantic', 'processor'),
+        ('settings', 'pydantic', 'processor', 'spacy'),
+    ]